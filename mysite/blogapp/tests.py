@@ -1,3 +1,45 @@
+from datetime import timedelta
+
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Article
+
+
+class ArticleViewsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.articles = Article.objects.bulk_create([
+            Article(title=f"Article {i}", body="body " * 100, published_at=now - timedelta(days=i))
+            for i in range(7)
+        ])
+        cls.draft = Article.objects.create(title="Draft", body="body")
+
+    async def test_list_shows_published_articles(self):
+        response = await self.async_client.get(reverse("blogapp:articles"))
+        self.assertContains(response, "Article 0")
+        self.assertContains(response, "Article 6")
+        self.assertNotContains(response, "Draft")
+        titles = [article.title for article in response.context["object_list"]]
+        self.assertEqual(titles, [f"Article {i}" for i in range(7)])
+
+    async def test_detail(self):
+        article = self.articles[0]
+        response = await self.async_client.get(reverse("blogapp:article", kwargs={"pk": article.pk}))
+        self.assertContains(response, article.title)
+        response = await self.async_client.get(reverse("blogapp:article", kwargs={"pk": 10_000}))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_feed_lists_latest_articles(self):
+        response = await self.async_client.get(reverse("blogapp:articles-feed"))
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertEqual(content.count("<item>"), 5)
+        self.assertIn("Article 4", content)
+        self.assertNotIn("Article 5", content)
 
-# Create your tests here.
+    def test_feed_works_under_wsgi(self):
+        response = self.client.get(reverse("blogapp:articles-feed"))
+        self.assertEqual(response.content.decode().count("<item>"), 5)
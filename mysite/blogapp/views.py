@@ -1,33 +1,69 @@
+from asgiref.sync import markcoroutinefunction
 from django.contrib.syndication.views import Feed
-from django.views.generic import ListView, DetailView
+from django.http import Http404, HttpRequest, HttpResponse
+from django.template.response import TemplateResponse
+from django.views import View
 from django.urls import reverse, reverse_lazy
 
 from .models import Article
 
+LATEST_ARTICLES_COUNT = 5
 
-class ArticlesListView(ListView):
-    queryset = (
+
+def published_articles():
+    return (
         Article.objects
         .filter(published_at__isnull=False)
         .order_by("-published_at")
     )
 
 
-class ArticleDetailView(DetailView):
-    model = Article
+class ArticlesListView(View):
+    template_name = "blogapp/article_list.html"
+
+    async def get(self, request: HttpRequest) -> HttpResponse:
+        articles = [article async for article in published_articles()]
+        context = {
+            "object_list": articles,
+            "article_list": articles,
+        }
+        return TemplateResponse(request, self.template_name, context)
+
+
+class ArticleDetailView(View):
+    template_name = "blogapp/article_detail.html"
+
+    async def get(self, request: HttpRequest, pk: int) -> HttpResponse:
+        try:
+            article = await Article.objects.aget(pk=pk)
+        except Article.DoesNotExist:
+            raise Http404("No article found matching the query")
+        return TemplateResponse(request, self.template_name, {"object": article, "article": article})
 
 
 class LatestArticlesFeed(Feed):
+    """
+    Feed only knows the sync ORM, so the items are loaded with the
+    async one first and handed over as the feed object: building
+    the XML from them runs no query.
+    """
     title = "Blog articles (latest)"
     description = "Updates on changes and addition blog articles"
     link = reverse_lazy("blogapp:articles")
 
-    def items(self):
-        return (
-            Article.objects
-            .filter(published_at__isnull=False)
-            .order_by("-published_at")[:5]
-        )
+    def __init__(self):
+        # the handler only awaits callables marked as coroutine functions
+        markcoroutinefunction(self)
+
+    async def __call__(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        articles = [article async for article in published_articles()[:LATEST_ARTICLES_COUNT]]
+        return super().__call__(request, articles=articles)
+
+    def get_object(self, request: HttpRequest, articles: list[Article]) -> list[Article]:
+        return articles
+
+    def items(self, articles: list[Article]) -> list[Article]:
+        return articles
 
     def item_title(self, item: Article):
         return item.title
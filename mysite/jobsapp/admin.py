@@ -0,0 +1,41 @@
+import json
+
+from django.contrib import admin
+from django.utils.html import format_html
+
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = "id", "task", "status", "percent", "attempts", "user", "created_at", "finished_at"
+    list_filter = "status", "task"
+    readonly_fields = [
+        "id",
+        "task",
+        "kwargs",
+        "user",
+        "status",
+        "progress",
+        "total",
+        "attempts",
+        "max_attempts",
+        "result_pretty",
+        "error_pretty",
+        "run_after",
+        "created_at",
+        "started_at",
+        "finished_at",
+    ]
+    exclude = "result", "error"
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description="result")
+    def result_pretty(self, obj: Job) -> str:
+        return format_html("<pre>{}</pre>", json.dumps(obj.result, indent=2))
+
+    @admin.display(description="error")
+    def error_pretty(self, obj: Job) -> str:
+        return format_html("<pre>{}</pre>", obj.error)
@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
+
+
+class JobsappConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "jobsapp"
+
+    def ready(self):
+        # tasks are registered by the `tasks` module of each app
+        autodiscover_modules("tasks")
@@ -0,0 +1,155 @@
+"""
+A small job queue stored in the database.
+
+Functions registered with `@task("name")` (in the `tasks` module of any
+app) are called by the run_jobs worker with the Job as first argument,
+so they can report progress, and the keyword arguments given to
+`enqueue()`. Their return value is stored as the job result. Failed
+jobs are retried with an exponential backoff up to `max_attempts`
+times, which only makes sense for tasks that are safe to run twice.
+
+Files a job needs (e.g. an uploaded CSV) can't go through the database:
+save them with `get_job_files_storage()` and pass their name.
+"""
+import logging
+import os
+import traceback
+from datetime import timedelta
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.storage import FileSystemStorage
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 3
+# the first retry waits this long, then twice as long every time
+DEFAULT_RETRY_DELAY = timedelta(seconds=30)
+
+TASKS: dict[str, Callable] = {}
+
+
+def task(name: str) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        TASKS[name] = func
+        return func
+
+    return decorator
+
+
+def get_task(name: str) -> Callable:
+    try:
+        return TASKS[name]
+    except KeyError:
+        raise LookupError(f"Unknown task {name!r}")
+
+
+def get_job_files_storage() -> FileSystemStorage:
+    # not under MEDIA_ROOT: job files must not be served
+    return FileSystemStorage(location=settings.JOBS_FILES_ROOT)
+
+
+def enqueue(
+    task_name: str,
+    user: Optional[User] = None,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    **kwargs,
+) -> Job:
+    get_task(task_name)
+    if user is not None and not user.is_authenticated:
+        user = None
+    return Job.objects.create(task=task_name, kwargs=kwargs, user=user, max_attempts=max_attempts)
+
+
+def claim_jobs(limit: int) -> list:
+    """
+    Marks up to `limit` due jobs as running and returns their ids
+    """
+    if limit <= 0:
+        return []
+    now = timezone.now()
+    with transaction.atomic():
+        # on SQLite the write lock taken by the transaction keeps
+        # other workers out, elsewhere the locked rows are skipped
+        job_ids = list(
+            Job.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=Job.Status.PENDING, run_after__lte=now)
+            .order_by("run_after", "created_at")
+            .values_list("pk", flat=True)[:limit]
+        )
+        Job.objects.filter(pk__in=job_ids).update(
+            status=Job.Status.RUNNING,
+            attempts=F("attempts") + 1,
+            started_at=now,
+            updated_at=now,
+        )
+    return job_ids
+
+
+def requeue_stale_jobs(stale_after: timedelta) -> int:
+    """
+    Jobs left running by a worker that died are made pending again
+    """
+    now = timezone.now()
+    return Job.objects.filter(
+        status=Job.Status.RUNNING,
+        updated_at__lt=now - stale_after,
+    ).update(status=Job.Status.PENDING, run_after=now, updated_at=now)
+
+
+def get_retry_delay(attempts: int) -> timedelta:
+    delay = getattr(settings, "JOBS_RETRY_DELAY", DEFAULT_RETRY_DELAY)
+    return delay * 2 ** max(attempts - 1, 0)
+
+
+def run_job(job_id) -> str:
+    """
+    Runs a claimed job and records its outcome, returns the new status
+    """
+    job = Job.objects.get(pk=job_id)
+    try:
+        result = get_task(job.task)(job, **job.kwargs)
+    except Exception:
+        now = timezone.now()
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            status = Job.Status.PENDING
+            log.warning("Job %s (%s) failed, retrying:\n%s", job.pk, job.task, error)
+            Job.objects.filter(pk=job.pk).update(
+                status=status,
+                error=error,
+                run_after=now + get_retry_delay(job.attempts),
+                updated_at=now,
+            )
+        else:
+            status = Job.Status.FAILED
+            log.error("Job %s (%s) failed:\n%s", job.pk, job.task, error)
+            Job.objects.filter(pk=job.pk).update(status=status, error=error, finished_at=now, updated_at=now)
+        return status
+
+    now = timezone.now()
+    Job.objects.filter(pk=job.pk).update(
+        status=Job.Status.DONE,
+        result=result,
+        error="",
+        finished_at=now,
+        updated_at=now,
+    )
+    return Job.Status.DONE
+
+
+def init_worker() -> None:
+    import django
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+    django.setup()
+    # forked workers must not share the parent's connections
+    for connection in connections.all(initialized_only=True):
+        connection.close()
@@ -0,0 +1,81 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from time import sleep
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from jobsapp.jobs import claim_jobs, init_worker, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    """
+    Runs queued jobs in a pool of worker processes
+    """
+    help = "Process background jobs, no broker needed"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=getattr(settings, "JOBS_WORKERS", 2),
+            help="worker processes, 0 runs the jobs in this process",
+        )
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds between queue checks")
+        parser.add_argument(
+            "--stale-after",
+            type=int,
+            default=600,
+            help="seconds without progress after which a running job is considered lost",
+        )
+        parser.add_argument("--once", action="store_true", help="exit when the queue is empty")
+
+    def handle(self, *args, **options):
+        self.options = options
+        requeued = requeue_stale_jobs(timedelta(seconds=options["stale_after"]))
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale jobs")
+        try:
+            if options["workers"]:
+                self.run_pool()
+            else:
+                self.run_inline()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping, running jobs will be requeued when they go stale")
+
+    def run_inline(self):
+        while True:
+            job_ids = claim_jobs(1)
+            for job_id in job_ids:
+                self.report(job_id, run_job(job_id))
+            if not job_ids:
+                if self.options["once"]:
+                    return
+                sleep(self.options["poll_interval"])
+
+    def run_pool(self):
+        workers = self.options["workers"]
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            running = {}
+            while True:
+                for job_id in claim_jobs(workers - len(running)):
+                    running[executor.submit(run_job, job_id)] = job_id
+                if not running:
+                    if self.options["once"]:
+                        return
+                    sleep(self.options["poll_interval"])
+                    continue
+                done, _ = wait(running, timeout=self.options["poll_interval"], return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        self.report(job_id, future.result())
+                    except BrokenProcessPool:
+                        # a worker was killed: its jobs are requeued once stale
+                        self.stderr.write(f"Job {job_id}: worker process died")
+                        raise
+
+    def report(self, job_id, status: str) -> None:
+        style = self.style.SUCCESS if status == "done" else self.style.WARNING
+        self.stdout.write(style(f"Job {job_id}: {status}"))
@@ -0,0 +1,62 @@
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """
+    A task call waiting for, or processed by, the run_jobs worker
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        RUNNING = "running"
+        DONE = "done"
+        FAILED = "failed"
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["status", "run_after"], name="job_status_run_after_idx"),
+        ]
+
+    # not guessable, on top of the status endpoint checking the user
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    task = models.CharField(max_length=200)
+    kwargs = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    progress = models.PositiveBigIntegerField(default=0)
+    total = models.PositiveBigIntegerField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # doubles as a heartbeat of running jobs
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Job({self.task}, {self.status})"
+
+    @property
+    def percent(self):
+        if not self.total:
+            return None
+        return min(100, round(self.progress * 100 / self.total))
+
+    def set_progress(self, progress: int, total: int = None) -> None:
+        self.progress = progress
+        if total is not None:
+            self.total = total
+        Job.objects.filter(pk=self.pk).update(
+            progress=self.progress,
+            total=self.total,
+            updated_at=timezone.now(),
+        )
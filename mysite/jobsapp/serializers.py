@@ -0,0 +1,35 @@
+from rest_framework import serializers
+
+from .models import Job
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = (
+            "id",
+            "task",
+            "status",
+            "progress",
+            "total",
+            "percent",
+            "attempts",
+            "max_attempts",
+            "result",
+            "error",
+            "created_at",
+            "started_at",
+            "finished_at",
+        )
+
+
+class JobProgressSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = (
+            "id",
+            "status",
+            "progress",
+            "total",
+            "percent",
+        )
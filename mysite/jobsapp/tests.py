@@ -0,0 +1,112 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from jobsapp.jobs import claim_jobs, enqueue, requeue_stale_jobs, run_job, task
+from jobsapp.models import Job
+
+CALLS = []
+
+
+@task("jobsapp.tests.count")
+def count(job: Job, total: int) -> dict:
+    for done in range(1, total + 1):
+        job.set_progress(done, total)
+    return {"counted": total}
+
+
+@task("jobsapp.tests.flaky")
+def flaky(job: Job, failures: int) -> str:
+    CALLS.append(job.attempts)
+    if job.attempts <= failures:
+        raise RuntimeError("not yet")
+    return "finally"
+
+
+@override_settings(JOBS_RETRY_DELAY=timedelta(0))
+class RunJobTestCase(TestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def run_queue(self) -> str:
+        out = StringIO()
+        call_command("run_jobs", once=True, workers=0, stdout=out)
+        return out.getvalue()
+
+    def test_unknown_task_is_rejected(self):
+        with self.assertRaises(LookupError):
+            enqueue("jobsapp.tests.missing")
+        self.assertFalse(Job.objects.exists())
+
+    def test_result_and_progress_are_stored(self):
+        job = enqueue("jobsapp.tests.count", total=4)
+        self.assertIn(f"Job {job.pk}: done", self.run_queue())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.DONE)
+        self.assertEqual(job.result, {"counted": 4})
+        self.assertEqual((job.progress, job.total, job.percent), (4, 4, 100))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_failed_job_is_retried(self):
+        job = enqueue("jobsapp.tests.flaky", failures=2)
+        self.run_queue()
+        job.refresh_from_db()
+        self.assertEqual(CALLS, [1, 2, 3])
+        self.assertEqual(job.status, Job.Status.DONE)
+        self.assertEqual(job.result, "finally")
+        self.assertEqual(job.error, "")
+
+    def test_job_fails_after_max_attempts(self):
+        job = enqueue("jobsapp.tests.flaky", max_attempts=2, failures=5)
+        self.run_queue()
+        job.refresh_from_db()
+        self.assertEqual(CALLS, [1, 2])
+        self.assertEqual(job.status, Job.Status.FAILED)
+        self.assertIn("RuntimeError: not yet", job.error)
+
+    def test_retry_waits_for_its_delay(self):
+        job = enqueue("jobsapp.tests.flaky", failures=1)
+        with self.settings(JOBS_RETRY_DELAY=timedelta(hours=1)):
+            self.assertEqual(run_job(claim_jobs(1)[0]), Job.Status.PENDING)
+        self.assertEqual(claim_jobs(1), [])
+        job.refresh_from_db()
+        self.assertGreater(job.run_after, timezone.now())
+
+    def test_stale_running_jobs_are_requeued(self):
+        job = enqueue("jobsapp.tests.count", total=1)
+        self.assertEqual(claim_jobs(5), [job.pk])
+        self.assertEqual(requeue_stale_jobs(timedelta(minutes=10)), 0)
+        Job.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(timedelta(minutes=10)), 1)
+        self.assertEqual(claim_jobs(5), [job.pk])
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 2)
+
+
+class JobViewSetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="owner")
+
+    def test_progress(self):
+        job = enqueue("jobsapp.tests.count", user=self.user, total=3)
+        job.set_progress(1, 4)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("jobsapp:job-progress", kwargs={"pk": job.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["percent"], 25)
+        self.assertNotIn("result", response.json())
+
+    def test_only_the_owner_and_staff_see_a_job(self):
+        job = enqueue("jobsapp.tests.count", user=self.user, total=3)
+        url = reverse("jobsapp:job-detail", kwargs={"pk": job.pk})
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(User.objects.create_user(username="other"))
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(User.objects.create_user(username="staff", is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
@@ -0,0 +1,13 @@
+from django.urls import include, path
+from rest_framework.routers import DefaultRouter
+
+from .views import JobViewSet
+
+app_name = "jobsapp"
+
+routers = DefaultRouter()
+routers.register("jobs", JobViewSet)
+
+urlpatterns = [
+    path("api/", include(routers.urls)),
+]
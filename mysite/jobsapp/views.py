@@ -0,0 +1,32 @@
+from rest_framework.decorators import action
+from rest_framework.mixins import RetrieveModelMixin
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.viewsets import GenericViewSet
+
+from .models import Job
+from .serializers import JobProgressSerializer, JobSerializer
+
+
+class JobViewSet(RetrieveModelMixin, GenericViewSet):
+    """
+    Status of a job, for the user who enqueued it and staff. There is
+    no list: ids are random and only known to whoever enqueued the job.
+    """
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # results and tracebacks are nobody else's business
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(user=self.request.user)
+        return queryset
+
+    @action(detail=True)
+    def progress(self, request: Request, pk=None):
+        # cheap enough to poll: no result or traceback
+        job = self.get_object()
+        return Response(JobProgressSerializer(job).data)
@@ -0,0 +1,105 @@
+"""
+TieredCache counting its hits, misses, sets, evictions, bytes and get
+latency per key prefix in the host's metrics store:
+
+    CACHES = {"default": {"BACKEND": "metricsapp.cache.MeteredCache", ...}}
+
+The prefix of a key is what comes before its first ":"
+("generation:shopapp.product" -> "generation"), except for the keys
+made by Django: cache_page keys are grouped by their `key_prefix`
+("cache_page:shop-index-key-prefix"), template fragments by their name
+("template:product-list-item"), and single flight locks are counted
+apart ("products_data_export:lock").
+"""
+import re
+from functools import lru_cache
+from time import perf_counter
+
+from django.core.cache.backends.base import default_key_func
+
+from mysite.backends.cache import TieredCache
+
+from .metrics import describe, get_store
+
+CACHE_PAGE_KEY = re.compile(r"^views\.decorators\.cache\.cache_(page|header)\.(.*?)\.(GET|HEAD|single_flight|[0-9a-f]{32})(\.|$)")
+TEMPLATE_KEY = re.compile(r"^template\.cache\.(.*)\.[0-9a-f]{32}$")
+
+# TieredCache event -> (metric, labels other than the prefix)
+EVENTS = {
+    "l1_hits": ("cache_hits_total", {"tier": "l1"}),
+    "l2_hits": ("cache_hits_total", {"tier": "l2"}),
+    "misses": ("cache_misses_total", {}),
+    "sets": ("cache_sets_total", {}),
+    "deletes": ("cache_deletes_total", {}),
+    "l1_evictions": ("cache_evictions_total", {"tier": "l1"}),
+    "l2_evictions": ("cache_evictions_total", {"tier": "l2"}),
+    "l1_invalidations": ("cache_invalidations_total", {}),
+}
+# the sizes worth adding up
+BYTES = {
+    "l1_hits": "cache_hit_bytes_total",
+    "l2_hits": "cache_hit_bytes_total",
+    "sets": "cache_set_bytes_total",
+}
+
+describe("cache_hits_total", "counter", "Cache gets that found a value, by tier.")
+describe("cache_misses_total", "counter", "Cache gets that found nothing.")
+describe("cache_sets_total", "counter", "Values written to the cache.")
+describe("cache_deletes_total", "counter", "Keys deleted from the cache.")
+describe("cache_evictions_total", "counter", "Values dropped to make room, by tier.")
+describe("cache_invalidations_total", "counter", "Per-process values dropped after another worker's write.")
+describe("cache_hit_bytes_total", "counter", "Pickled size of the values found.")
+describe("cache_set_bytes_total", "counter", "Pickled size of the values written.")
+describe("cache_get_duration_seconds", "histogram", "Time taken by cache gets.")
+
+
+@lru_cache(maxsize=1024)
+def key_prefix(key: str) -> str:
+    """
+    Groups `key` (as given to the cache, without the KEY_PREFIX and
+    version) with the keys of the same use
+    """
+    if key.endswith(":lock"):
+        return f"{key_prefix(key[:-len(':lock')])}:lock"
+    match = CACHE_PAGE_KEY.match(key)
+    if match:
+        kind, prefix = match.group(1, 2)
+        return f"cache_{kind}:{prefix}" if prefix else f"cache_{kind}"
+    match = TEMPLATE_KEY.match(key)
+    if match:
+        return f"template:{match.group(1)}"
+    return key.split(":", 1)[0]
+
+
+class MeteredCache(TieredCache):
+    def _original_key(self, key: str) -> str:
+        if self.key_func is default_key_func:
+            # "<KEY_PREFIX>:<version>:<key>"
+            return key.split(":", 2)[-1]
+        return key
+
+    def _record(self, event: str, key: str, size: int = 0) -> None:
+        super()._record(event, key, size)
+        store = get_store()
+        prefix = key_prefix(self._original_key(key))
+        metric, labels = EVENTS[event]
+        # may be called with the L1 lock held: flushing waits for a get
+        store.inc(metric, {"prefix": prefix, **labels}, flush=False)
+        if event in BYTES:
+            store.inc(BYTES[event], {"prefix": prefix}, size, flush=False)
+
+    def get(self, key, default=None, version=None):
+        start = perf_counter()
+        value = super().get(key, default, version)
+        get_store().observe("cache_get_duration_seconds", {"prefix": key_prefix(key)}, perf_counter() - start)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        start = perf_counter()
+        found = super().get_many(keys, version)
+        if keys:
+            duration = (perf_counter() - start) / len(keys)
+            for key in keys:
+                get_store().observe("cache_get_duration_seconds", {"prefix": key_prefix(key)}, duration)
+        return found
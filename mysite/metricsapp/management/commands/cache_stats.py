@@ -0,0 +1,80 @@
+from collections import defaultdict
+from time import sleep
+
+from django.core.management import BaseCommand
+
+from metricsapp.metrics import get_store, histogram_quantile
+
+COLUMNS = ("prefix", "l1 hits", "l2 hits", "misses", "hit %", "sets", "evictions", "hit KiB", "set KiB", "p50 ms", "p95 ms")
+
+
+class Command(BaseCommand):
+    """
+    Prints the cache metrics of every worker of the host, per key prefix
+    """
+    help = "Live summary of cache hits, misses, sets, evictions, sizes and get latency per key prefix"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=5.0, help="seconds between refreshes")
+        parser.add_argument("--once", action="store_true", help="print the summary once and exit")
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                self.stdout.write(self.format_table(self.summarize()))
+                if options["once"]:
+                    return
+                sleep(options["interval"])
+                self.stdout.write("")
+        except KeyboardInterrupt:
+            pass
+
+    def summarize(self) -> dict[str, dict]:
+        rows = defaultdict(lambda: defaultdict(float))
+        latencies = defaultdict(list)
+        for name, labels, value in get_store().collect("cache_"):
+            prefix = labels.get("prefix", "")
+            if name == "cache_get_duration_seconds_bucket":
+                latencies[prefix].append((float(labels["le"]), value))
+            elif name == "cache_hits_total":
+                rows[prefix][f"{labels['tier']} hits"] += value
+            elif name == "cache_evictions_total":
+                rows[prefix]["evictions"] += value
+            else:
+                rows[prefix][name] += value
+        for prefix, buckets in latencies.items():
+            rows[prefix]["p50"] = histogram_quantile(0.5, buckets)
+            rows[prefix]["p95"] = histogram_quantile(0.95, buckets)
+        return rows
+
+    def format_table(self, rows: dict[str, dict]) -> str:
+        lines = ["  ".join(f"{column:>10}" if i else f"{column:<40}" for i, column in enumerate(COLUMNS))]
+        for prefix, row in sorted(rows.items()):
+            hits = row["l1 hits"] + row["l2 hits"]
+            lookups = hits + row["cache_misses_total"]
+            values = [
+                row["l1 hits"],
+                row["l2 hits"],
+                row["cache_misses_total"],
+                f"{100 * hits / lookups:.1f}" if lookups else "-",
+                row["cache_sets_total"],
+                row["evictions"],
+                f"{row['cache_hit_bytes_total'] / 1024:.1f}",
+                f"{row['cache_set_bytes_total'] / 1024:.1f}",
+                format_ms(row.get("p50")),
+                format_ms(row.get("p95")),
+            ]
+            lines.append("  ".join(
+                [f"{prefix:<40}"] + [f"{value:>10.0f}" if isinstance(value, float) else f"{value:>10}" for value in values]
+            ))
+        if not rows:
+            lines.append("no cache metrics yet")
+        return "\n".join(lines)
+
+
+def format_ms(seconds) -> str:
+    if seconds is None:
+        return "-"
+    if seconds == float("inf"):
+        return "inf"
+    return f"{seconds * 1000:.2f}"
@@ -0,0 +1,247 @@
+"""
+Counters and histograms shared by the workers of the host.
+
+Each process adds up its increments in memory and, at most every
+METRICS_FLUSH_INTERVAL seconds, adds them to the totals kept in an
+SQLite file (METRICS_LOCATION) in one transaction. Reading flushes the
+process' own increments first, the other workers' are at most one
+interval late.
+
+    store = get_store()
+    store.inc("cache_hits_total", {"prefix": "generation"})
+    store.observe("cache_get_duration_seconds", {"prefix": "generation"}, 0.0002)
+"""
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from time import monotonic
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+DEFAULT_FLUSH_INTERVAL = 5.0
+SQLITE_TIMEOUT = 5
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# name -> (type, help), for the exposition format
+METRICS: dict[str, tuple[str, str]] = {}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metric (
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (name, labels)
+) WITHOUT ROWID;
+"""
+
+log = logging.getLogger(__name__)
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def describe(name: str, type: str, help: str) -> None:
+    METRICS[name] = (type, help)
+
+
+class MetricsStore:
+    def __init__(self, location: str, flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        self.location = str(location)
+        self.flush_interval = flush_interval
+        # (name, sorted label items) -> increment not flushed yet
+        self._pending = defaultdict(float)
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._connection_pid = None
+        self._pid = os.getpid()
+        self._flushed_at = monotonic()
+
+    def _connection(self) -> sqlite3.Connection:
+        # the caller holds _db_lock
+        if self._connection_pid != os.getpid():
+            # ":memory:" (for tests) only lives as long as this connection,
+            # hence one per process rather than per thread
+            self._db = sqlite3.connect(
+                self.location, timeout=SQLITE_TIMEOUT, isolation_level=None, check_same_thread=False
+            )
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute("PRAGMA synchronous = OFF")
+            self._db.executescript(SCHEMA)
+            self._connection_pid = os.getpid()
+        return self._db
+
+    def inc(self, name: str, labels: dict, value: float = 1, flush: bool = True) -> None:
+        """
+        Adds `value` to counter `name`. With `flush=False` the increments
+        are only written by the next call that may flush.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # increments made before the fork belong to the parent
+                self._pending.clear()
+                self._pid = os.getpid()
+            self._pending[name, tuple(sorted(labels.items()))] += value
+        if flush:
+            self.flush_if_due()
+
+    def flush_if_due(self) -> None:
+        if monotonic() - self._flushed_at >= self.flush_interval:
+            try:
+                self.flush()
+            except sqlite3.Error:
+                # metrics must not fail the request, they go with the next flush
+                log.warning("Could not flush metrics to %s", self.location, exc_info=True)
+
+    def observe(self, name: str, labels: dict, value: float, buckets: Iterable[float] = LATENCY_BUCKETS) -> None:
+        """
+        Records `value` in histogram `name`. Buckets are stored
+        non-cumulative, collect() adds them up.
+        """
+        buckets = tuple(buckets)
+        index = bisect_left(buckets, value)
+        le = str(buckets[index]) if index < len(buckets) else "+Inf"
+        self.inc(f"{name}_bucket", {**labels, "le": le})
+        self.inc(f"{name}_sum", labels, value)
+        self.inc(f"{name}_count", labels)
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(float)
+            self._flushed_at = monotonic()
+        if not pending:
+            return
+        with self._db_lock:
+            self._write(pending)
+
+    def _write(self, pending: dict) -> None:
+        connection = self._connection()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany(
+                "INSERT INTO metric (name, labels, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+                [(name, json.dumps(labels, separators=(",", ":")), value) for (name, labels), value in pending.items()],
+            )
+            connection.execute("COMMIT")
+        except sqlite3.Error:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            # keep them for the next flush rather than losing them
+            with self._lock:
+                for key, value in pending.items():
+                    self._pending[key] += value
+            raise
+
+    def collect(self, prefix: str = "") -> list[tuple[str, dict, float]]:
+        """
+        Every sample of the host as (name, labels, value), histogram
+        buckets made cumulative
+        """
+        self.flush()
+        with self._db_lock:
+            rows = self._connection().execute(
+                "SELECT name, labels, value FROM metric WHERE name LIKE ? ORDER BY name, labels",
+                (f"{prefix}%",),
+            ).fetchall()
+        samples = [(name, dict(json.loads(labels)), value) for name, labels, value in rows]
+        return cumulate_buckets(samples)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pending.clear()
+        with self._db_lock:
+            self._connection().execute("DELETE FROM metric")
+
+
+def cumulate_buckets(samples: list[tuple[str, dict, float]]) -> list[tuple[str, dict, float]]:
+    series = defaultdict(list)
+    others = []
+    for name, labels, value in samples:
+        if name.endswith("_bucket"):
+            key = (name, tuple(sorted((k, v) for k, v in labels.items() if k != "le")))
+            series[key].append((float(labels["le"]), labels, value))
+        else:
+            others.append((name, labels, value))
+    buckets = []
+    for (name, _), values in series.items():
+        total = 0
+        for _, labels, value in sorted(values, key=lambda item: item[0]):
+            total += value
+            buckets.append((name, labels, total))
+        if labels["le"] != "+Inf":
+            # nothing above the last bucket yet, the exposition needs it anyway
+            buckets.append((name, {**labels, "le": "+Inf"}, total))
+    return sorted(others + buckets, key=lambda sample: sample[0])
+
+
+def histogram_quantile(quantile: float, buckets: list[tuple[float, float]]) -> Optional[float]:
+    """
+    Upper bound of the bucket holding `quantile`,
+    from cumulative (le, count) pairs
+    """
+    buckets = sorted(buckets)
+    if not buckets or not buckets[-1][1]:
+        return None
+    rank = quantile * buckets[-1][1]
+    for le, count in buckets:
+        if count >= rank:
+            return le
+    return buckets[-1][0]
+
+
+def format_prometheus(samples: list[tuple[str, dict, float]]) -> str:
+    lines = []
+    described = set()
+    for name, labels, value in samples:
+        family = name
+        for suffix in ("_bucket", "_sum", "_count"):
+            if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+                family = name[:-len(suffix)]
+        if family in METRICS and family not in described:
+            type, help = METRICS[family]
+            lines.append(f"# HELP {family} {help}")
+            lines.append(f"# TYPE {family} {type}")
+            described.add(family)
+        label_text = ",".join(
+            '{}="{}"'.format(key, str(label).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for key, label in labels.items()
+        )
+        lines.append(f"{name}{{{label_text}}} {value:g}" if label_text else f"{name} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+def get_store() -> MetricsStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MetricsStore(
+                    settings.METRICS_LOCATION,
+                    getattr(settings, "METRICS_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL),
+                )
+    return _store
+
+
+@receiver(setting_changed)
+def reset_store(setting, **kwargs):
+    global _store
+    if setting in ("METRICS_LOCATION", "METRICS_FLUSH_INTERVAL"):
+        _store = None
+
+
+@atexit.register
+def flush_at_exit():
+    if _store is not None:
+        try:
+            _store.flush()
+        except sqlite3.Error:
+            pass
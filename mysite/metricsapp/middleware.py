@@ -0,0 +1,141 @@
+"""
+Request metrics per resolved URL name ("shopapp:products_list",
+"shopapp:product-list", ...): latency, number of queries and time spent
+in the database, response size. They go to the metrics store shared by
+the workers (see metricsapp.metrics) and are served by /metrics/.
+
+Requests slower than SLOW_REQUEST_THRESHOLD seconds are logged to
+"metricsapp.slow_requests" with the SQL they ran.
+"""
+import logging
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+
+from .metrics import describe, get_store
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+# SQL kept for the slow request log, the others are only counted
+MAX_LOGGED_QUERIES = 200
+
+describe("http_requests_total", "counter", "Requests, by view, method and status class.")
+describe("http_request_duration_seconds", "histogram", "Time taken to respond, middleware included.")
+describe("http_request_db_queries", "histogram", "Queries run per request.")
+describe("http_request_db_duration_seconds_total", "counter", "Time spent running queries.")
+describe("http_response_size_bytes", "histogram", "Size of the response bodies, streaming ones excepted.")
+
+slow_log = logging.getLogger("metricsapp.slow_requests")
+
+# the RequestStats of the request being served, copied into the threads
+# running sync code for async views
+current_request: ContextVar[Optional["RequestStats"]] = ContextVar("current_request", default=None)
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time", "sql")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        # (alias, sql, seconds) of the first MAX_LOGGED_QUERIES queries
+        self.sql = []
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every connection,
+    counts the queries of the current request
+    """
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = perf_counter() - start
+        stats.queries += 1
+        stats.db_time += duration
+        if len(stats.sql) < MAX_LOGGED_QUERIES:
+            stats.sql.append((context["connection"].alias, sql, duration))
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    # connections are reopened on every request, their wrappers stay
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class RequestMetricsMiddleware:
+    """
+    Should come first, so the time spent in the other middleware counts
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.record(request, response, stats, perf_counter() - start)
+        return response
+
+    async def __acall__(self, request: HttpRequest):
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.record(request, response, stats, perf_counter() - start)
+        return response
+
+    def record(self, request: HttpRequest, response: HttpResponse, stats: RequestStats, duration: float) -> None:
+        # unresolved requests (404s) would each make their own series
+        view = request.resolver_match.view_name if request.resolver_match else "unresolved"
+        store = get_store()
+        labels = {"view": view, "method": request.method}
+        store.inc("http_requests_total", {**labels, "status": f"{response.status_code // 100}xx"})
+        store.observe("http_request_duration_seconds", labels, duration, REQUEST_BUCKETS)
+        store.observe("http_request_db_queries", labels, stats.queries, QUERY_COUNT_BUCKETS)
+        store.inc("http_request_db_duration_seconds_total", labels, stats.db_time)
+        if not response.streaming:
+            store.observe("http_response_size_bytes", labels, len(response.content), SIZE_BUCKETS)
+        if duration >= settings.SLOW_REQUEST_THRESHOLD:
+            self.log_slow_request(request, view, stats, duration)
+
+    def log_slow_request(self, request: HttpRequest, view: str, stats: RequestStats, duration: float) -> None:
+        queries = "\n".join(
+            f"  {number}. [{alias}] {seconds * 1000:.1f}ms {sql}"
+            for number, (alias, sql, seconds) in enumerate(stats.sql, start=1)
+        )
+        if stats.queries > len(stats.sql):
+            queries += f"\n  ... {stats.queries - len(stats.sql)} more"
+        slow_log.warning(
+            "Slow request %s %s (%s): %.0fms, %d queries in %.0fms\n%s",
+            request.method,
+            request.get_full_path(),
+            view,
+            duration * 1000,
+            stats.queries,
+            stats.db_time * 1000,
+            queries,
+        )
@@ -0,0 +1,195 @@
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from metricsapp.cache import MeteredCache, key_prefix
+from metricsapp.metrics import MetricsStore, format_prometheus, get_store, histogram_quantile
+
+
+class MetricsStoreTestCase(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = Path(directory.name) / "metrics.sqlite3"
+
+    def test_workers_add_up(self):
+        # two stores on one file stand for two workers
+        first = MetricsStore(self.location, flush_interval=60)
+        second = MetricsStore(self.location, flush_interval=60)
+        first.inc("requests_total", {"view": "index"})
+        second.inc("requests_total", {"view": "index"}, 2)
+        second.inc("requests_total", {"view": "other"})
+        self.assertEqual(first.collect(), [("requests_total", {"view": "index"}, 1)])
+        self.assertEqual(
+            second.collect(),
+            [("requests_total", {"view": "index"}, 3), ("requests_total", {"view": "other"}, 1)],
+        )
+
+    def test_increments_are_flushed_after_the_interval(self):
+        writer = MetricsStore(self.location, flush_interval=0)
+        reader = MetricsStore(self.location)
+        writer.inc("requests_total", {})
+        self.assertEqual(reader.collect(), [("requests_total", {}, 1)])
+
+    def test_histogram_buckets_are_cumulative(self):
+        store = MetricsStore(self.location)
+        for value in (0.001, 0.002, 0.02, 5):
+            store.observe("duration_seconds", {}, value, buckets=(0.001, 0.01, 0.1))
+        samples = {(name, labels.get("le")): value for name, labels, value in store.collect()}
+        self.assertEqual(samples[("duration_seconds_bucket", "0.001")], 1)
+        self.assertEqual(samples[("duration_seconds_bucket", "0.01")], 2)
+        self.assertEqual(samples[("duration_seconds_bucket", "0.1")], 3)
+        self.assertEqual(samples[("duration_seconds_bucket", "+Inf")], 4)
+        self.assertEqual(samples[("duration_seconds_count", None)], 4)
+        self.assertAlmostEqual(samples[("duration_seconds_sum", None)], 5.023)
+        self.assertEqual(histogram_quantile(0.5, [(0.001, 1), (0.01, 2), (0.1, 3), (float("inf"), 4)]), 0.01)
+
+    def test_prometheus_format(self):
+        text = format_prometheus([
+            ("cache_hits_total", {"prefix": 'a"b', "tier": "l1"}, 3.0),
+            ("cache_get_duration_seconds_count", {"prefix": "a"}, 1.0),
+        ])
+        self.assertIn("# TYPE cache_hits_total counter\n", text)
+        self.assertIn('cache_hits_total{prefix="a\\"b",tier="l1"} 3\n', text)
+        self.assertIn("# TYPE cache_get_duration_seconds histogram\n", text)
+
+
+class MeteredCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(METRICS_LOCATION=Path(directory.name) / "metrics.sqlite3")
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.cache = MeteredCache(
+            Path(directory.name) / "cache.sqlite3",
+            {"KEY_PREFIX": "site", "OPTIONS": {"VERSION_CHECK_INTERVAL": 0}},
+        )
+
+    def collect(self) -> dict:
+        return {
+            (name, labels["prefix"], labels.get("tier")): value
+            for name, labels, value in get_store().collect("cache_")
+            if not name.startswith("cache_get_duration_seconds_bucket")
+        }
+
+    def test_events_are_counted_per_prefix(self):
+        self.cache.set("generation:shopapp.product", 1)
+        self.cache.get("generation:shopapp.product")
+        self.cache.get_many(["generation:blogapp.article"])
+        self.cache.set("products_data_export", "x" * 100)
+        self.cache.delete("products_data_export")
+        samples = self.collect()
+        self.assertEqual(samples["cache_sets_total", "generation", None], 1)
+        self.assertEqual(samples["cache_hits_total", "generation", "l1"], 1)
+        self.assertNotIn(("cache_hits_total", "generation", "l2"), samples)
+        self.assertEqual(samples["cache_misses_total", "generation", None], 1)
+        self.assertEqual(samples["cache_get_duration_seconds_count", "generation", None], 2)
+        self.assertEqual(samples["cache_deletes_total", "products_data_export", None], 1)
+        self.assertGreater(samples["cache_set_bytes_total", "products_data_export", None], 100)
+
+    def test_key_prefixes(self):
+        self.assertEqual(key_prefix("generation:shopapp.product"), "generation")
+        self.assertEqual(key_prefix("products_data_export"), "products_data_export")
+        self.assertEqual(key_prefix("products_data_export:lock"), "products_data_export:lock")
+        md5 = "d41d8cd98f00b204e9800998ecf8427e"
+        self.assertEqual(
+            key_prefix(f"views.decorators.cache.cache_page.shop-index-key-prefix.GET.{md5}.{md5}.en-us"),
+            "cache_page:shop-index-key-prefix",
+        )
+        self.assertEqual(
+            key_prefix(f"views.decorators.cache.cache_header.get-cookie-view-cache.{md5}.en-us"),
+            "cache_header:get-cookie-view-cache",
+        )
+        self.assertEqual(key_prefix(f"views.decorators.cache.cache_page..GET.{md5}.{md5}"), "cache_page")
+        self.assertEqual(
+            key_prefix(f"views.decorators.cache.cache_page.products.single_flight.{md5}:lock"),
+            "cache_page:products:lock",
+        )
+        self.assertEqual(key_prefix(f"template.cache.product-list-item.{md5}"), "template:product-list-item")
+
+    def test_cache_stats_command(self):
+        self.cache.set("generation:shopapp.product", 1)
+        self.cache.get("generation:shopapp.product")
+        self.cache.get("generation:shopapp.product")
+        self.cache.get("generation:blogapp.article")
+        out = StringIO()
+        call_command("cache_stats", once=True, stdout=out)
+        row = next(line for line in out.getvalue().splitlines() if line.startswith("generation "))
+        self.assertEqual(row.split()[1:6], ["2", "0", "1", "66.7", "1"])
+
+
+class MetricsViewTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(METRICS_LOCATION=Path(directory.name) / "metrics.sqlite3")
+        settings.enable()
+        self.addCleanup(settings.disable)
+        get_store().inc("cache_hits_total", {"prefix": "generation", "tier": "l1"})
+
+    def test_scraper_ip_is_allowed(self):
+        response = self.client.get(reverse("metricsapp:metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        self.assertIn(b'cache_hits_total{prefix="generation",tier="l1"} 1', response.content)
+
+    def test_empty_remote_addr_needs_staff(self):
+        url = reverse("metricsapp:metrics")
+        self.assertEqual(self.client.get(url, REMOTE_ADDR="").status_code, 403)
+        with self.settings(METRICS_ALLOWED_IPS=["127.0.0.1", ""]):
+            self.assertEqual(self.client.get(url, REMOTE_ADDR="").status_code, 403)
+
+    def test_other_ips_need_staff(self):
+        url = reverse("metricsapp:metrics")
+        self.assertEqual(self.client.get(url, REMOTE_ADDR="203.0.113.7").status_code, 403)
+        self.client.force_login(User.objects.create_user(username="staff", is_staff=True))
+        self.assertEqual(self.client.get(url, REMOTE_ADDR="203.0.113.7").status_code, 200)
+
+
+class RequestMetricsMiddlewareTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(METRICS_LOCATION=Path(directory.name) / "metrics.sqlite3")
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def collect(self, view: str) -> dict:
+        return {
+            name: value
+            for name, labels, value in get_store().collect("http_")
+            if labels.get("view") == view and "le" not in labels
+        }
+
+    def test_sync_view(self):
+        self.client.get(reverse("shopapp:products_list"))
+        samples = self.collect("shopapp:products_list")
+        self.assertEqual(samples["http_requests_total"], 1)
+        self.assertEqual(samples["http_request_duration_seconds_count"], 1)
+        self.assertGreater(samples["http_request_db_queries_sum"], 0)
+        self.assertGreater(samples["http_response_size_bytes_sum"], 0)
+
+    async def test_async_view_queries_are_counted(self):
+        await self.async_client.get(reverse("blogapp:articles"))
+        samples = self.collect("blogapp:articles")
+        self.assertEqual(samples["http_requests_total"], 1)
+        self.assertEqual(samples["http_request_db_queries_sum"], 1)
+
+    def test_unresolved_requests_share_a_series(self):
+        self.client.get("/nowhere/")
+        self.client.get("/elsewhere/")
+        self.assertEqual(self.collect("unresolved")["http_requests_total"], 2)
+
+    @override_settings(SLOW_REQUEST_THRESHOLD=0)
+    def test_slow_requests_are_logged_with_their_sql(self):
+        with self.assertLogs("metricsapp.slow_requests", "WARNING") as logs:
+            self.client.get(reverse("shopapp:products_list"))
+        self.assertIn("Slow request GET /", logs.output[0])
+        self.assertIn("(shopapp:products_list)", logs.output[0])
+        self.assertIn("SELECT", logs.output[0])
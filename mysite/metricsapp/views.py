@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpRequest, HttpResponse
+
+from .metrics import format_prometheus, get_store
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """
+    Every metric of the host in the Prometheus text format, for the
+    scraper (from METRICS_ALLOWED_IPS) or staff
+    """
+    # gunicorn leaves REMOTE_ADDR empty behind a unix socket
+    remote_addr = request.META.get("REMOTE_ADDR")
+    if not (remote_addr and remote_addr in settings.METRICS_ALLOWED_IPS) and not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(format_prometheus(get_store().collect()), content_type=PROMETHEUS_CONTENT_TYPE)
@@ -17,3 +17,7 @@ class FooBarViewTest(TestCase):
         self.assertEqual(response.headers['content-type'], 'application/json')
         expected_data = {"foo": "bar", "spam": "eggs"}
         self.assertJSONEqual(response.content, expected_data)
+
+    async def test_foo_bar_view_async(self):
+        response = await self.async_client.get(reverse('myauth:foo-bar'))
+        self.assertJSONEqual(response.content, {"foo": "bar", "spam": "eggs"})
@@ -1,3 +1,4 @@
+import logging
 from random import random
 
 from django.contrib.auth.decorators import login_required, permission_required, user_passes_test
@@ -15,6 +16,8 @@ from django.utils.cache import get_cache_key
 
 from .models import Profile
 
+log = logging.getLogger(__name__)
+
 
 class AboutMeView(TemplateView):
     template_name = "myauth/about-me.html"
@@ -53,9 +56,7 @@ def set_cookie_view(request: HttpRequest) -> HttpResponse:
     response = HttpResponse("Cookie set")
     response.set_cookie("fizz", "buzz", max_age=3600)
     cache_key = get_cache_key(request, key_prefix=get_cookie_view_cache_key_prefix, cache=cache)
-    print("key", cache_key)
-    val = cache.get(cache_key)
-    print("val", val)
+    log.debug("get_cookie_view cache key %s, cached: %s", cache_key, cache.get(cache_key) is not None)
     # cache.delete(get_cookie_view_cache_key_prefix)
     return response
 
@@ -79,5 +80,5 @@ def get_session_view(request: HttpRequest) -> HttpResponse:
 
 
 class FooBarView(View):
-    def get(self, request: HttpRequest) -> JsonResponse:
+    async def get(self, request: HttpRequest) -> JsonResponse:
         return JsonResponse({"foo": "bar", "spam": "eggs"})
@@ -0,0 +1,404 @@
+"""
+Two-level cache: a per-process LRU in front of an SQLite file shared by
+all the workers of the host.
+
+    CACHES = {
+        "default": {
+            "BACKEND": "mysite.backends.cache.TieredCache",
+            "LOCATION": "/var/tmp/mysite-cache.sqlite3",
+            "OPTIONS": {
+                "MAX_ENTRIES": 100_000,
+                "L1_MAX_BYTES": 64 * 1024 * 1024,
+                "L1_MAX_ENTRY_BYTES": 8 * 1024 * 1024,
+                "VERSION_CHECK_INTERVAL": 1.0,
+            },
+        },
+    }
+
+L1 is bounded by the pickled size of its values, not their count. Hits
+never touch the disk; values other than immutable scalars are still
+unpickled on every get, like LocMemCache, so callers can't share and
+mutate one object (cache_page responses get headers added).
+
+L2 is the source of truth. Every write appends the key to a journal
+table whose row id is the version stamp. At most every
+VERSION_CHECK_INTERVAL seconds a process reads the journal past the
+last stamp it saw and drops those keys from its L1, so a value changed
+by another worker is served stale for at most that long. Writes made by
+the process itself are visible right away, their stamps are remembered
+so that the check keeps what they put in L1. A process that fell behind
+the pruned part of the journal clears its whole L1.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from time import monotonic, time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+DEFAULT_L1_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_VERSION_CHECK_INTERVAL = 1.0
+# the journal only needs to cover one check interval of writes
+JOURNAL_SIZE = 10_000
+CULL_EVERY = 100
+SQLITE_TIMEOUT = 5
+# kept in L1 as is: nothing to copy, nothing to unpickle
+IMMUTABLE_TYPES = (str, bytes, int, float, bool, type(None))
+
+MISSING = object()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires);
+CREATE TABLE IF NOT EXISTS journal (
+    stamp INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT
+);
+"""
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.location = str(location)
+        self.l1_max_bytes = options.get("L1_MAX_BYTES", DEFAULT_L1_MAX_BYTES)
+        self.l1_max_entry_bytes = options.get("L1_MAX_ENTRY_BYTES", self.l1_max_bytes // 4)
+        self.version_check_interval = options.get("VERSION_CHECK_INTERVAL", DEFAULT_VERSION_CHECK_INTERVAL)
+
+        # key -> (value or pickled value, pickled, expires, size)
+        self._l1 = OrderedDict()
+        self._l1_bytes = 0
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        self._stamp = None
+        # journal stamps of this process' writes not checked yet
+        self._own_stamps = set()
+        self._checked_at = None
+        self._sets = 0
+        self.stats = dict.fromkeys(
+            ("l1_hits", "l2_hits", "misses", "sets", "deletes", "l1_evictions", "l2_evictions", "l1_invalidations"),
+            0,
+        )
+
+    # L2
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        # a forked worker must not reuse its parent's connection
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.location, timeout=SQLITE_TIMEOUT, isolation_level=None)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+            if self._stamp is None:
+                # L1 is empty, only later writes can make it stale
+                self._stamp = connection.execute("SELECT coalesce(max(stamp), 0) FROM journal").fetchone()[0]
+        return connection
+
+    def _write(self, keys, statements, changed_only: bool = False) -> list:
+        """
+        Runs `statements` ((sql, params) pairs) in one transaction, journals
+        `keys` (None stands for every key) and returns their rowcounts.
+        With `changed_only`, `keys` are only journaled if a row changed.
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            counts = [connection.execute(sql, params).rowcount for sql, params in statements]
+            if changed_only and not any(counts):
+                keys = []
+            connection.executemany("INSERT INTO journal (key) VALUES (?)", [(key,) for key in keys])
+            # no other writer in the transaction, the stamps follow each other
+            last, = connection.execute("SELECT last_insert_rowid()").fetchone()
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        self._add_own_stamps(range(last - len(keys) + 1, last + 1))
+        return counts
+
+    def _add_own_stamps(self, stamps) -> None:
+        with self._lock:
+            self._own_stamps.update(stamps)
+
+    def _upsert(self, key: str, blob: bytes, expires) -> tuple:
+        return (
+            "INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires",
+            (key, blob, expires),
+        )
+
+    def _cull(self) -> None:
+        self._sets += 1
+        if self._sets % CULL_EVERY:
+            return
+        connection = self._connection()
+        now = time()
+        connection.execute("DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?", (now,))
+        count = connection.execute("SELECT count(*) FROM cache").fetchone()[0]
+        if count > self._max_entries:
+            # drop the entries closest to expiring, those without timeout last
+            evicted = connection.execute(
+                "DELETE FROM cache WHERE key IN "
+                "(SELECT key FROM cache ORDER BY expires IS NULL, expires LIMIT ?) RETURNING key",
+                (count // self._cull_frequency if self._cull_frequency else count,),
+            ).fetchall()
+            for key, in evicted:
+                self._record("l2_evictions", key)
+        connection.execute(
+            "DELETE FROM journal WHERE stamp <= (SELECT max(stamp) FROM journal) - ?",
+            (JOURNAL_SIZE,),
+        )
+
+    # L1
+
+    def _sync_l1(self) -> None:
+        if self._checked_at is not None and monotonic() - self._checked_at < self.version_check_interval:
+            return
+        self._checked_at = monotonic()
+        connection = self._connection()
+        first, last = connection.execute(
+            "SELECT (SELECT min(stamp) FROM journal), (SELECT max(stamp) FROM journal)"
+        ).fetchone()
+        last = last or 0
+        if self._stamp == last:
+            return
+        if first is None or first > self._stamp + 1 or self._stamp > last:
+            # the journal was pruned (or recreated) past what we saw
+            entries = [(None, None)]
+        else:
+            entries = connection.execute(
+                "SELECT stamp, key FROM journal WHERE stamp > ? AND stamp <= ?", (self._stamp, last)
+            ).fetchall()
+        with self._lock:
+            # L1 already holds what this process wrote
+            keys = [key for stamp, key in entries if stamp not in self._own_stamps]
+            self._own_stamps = {stamp for stamp in self._own_stamps if stamp > last}
+            for key in keys:
+                if key is None:
+                    for invalidated in self._l1:
+                        self._record("l1_invalidations", invalidated)
+                    self._l1.clear()
+                    self._l1_bytes = 0
+                    break
+                if self._l1_pop(key):
+                    self._record("l1_invalidations", key)
+        self._stamp = last
+
+    def _l1_get(self, key: str):
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                return MISSING
+            value, pickled, expires, size = entry
+            if expires is not None and expires <= time():
+                self._l1_pop(key)
+                return MISSING
+            self._l1.move_to_end(key)
+            self._record("l1_hits", key, size)
+        return pickle.loads(value) if pickled else value
+
+    def _l1_set(self, key: str, value, blob: bytes, expires) -> None:
+        size = len(blob)
+        with self._lock:
+            self._l1_pop(key)
+            if size > self.l1_max_entry_bytes:
+                return
+            if isinstance(value, IMMUTABLE_TYPES):
+                self._l1[key] = (value, False, expires, size)
+            else:
+                self._l1[key] = (blob, True, expires, size)
+            self._l1_bytes += size
+            while self._l1_bytes > self.l1_max_bytes:
+                evicted, (_, _, _, evicted_size) = self._l1.popitem(last=False)
+                self._l1_bytes -= evicted_size
+                self._record("l1_evictions", evicted, evicted_size)
+
+    def _l1_pop(self, key: str) -> bool:
+        # the caller holds the lock
+        entry = self._l1.pop(key, None)
+        if entry is None:
+            return False
+        self._l1_bytes -= entry[3]
+        return True
+
+    def _record(self, event: str, key: str, size: int = 0) -> None:
+        """
+        Counts `event` (a key of `stats`) for `key`, `size` is the
+        pickled size of the value if any. May be called with the L1 lock
+        held, so it must not touch L1 nor block.
+        """
+        with self._stats_lock:
+            self.stats[event] += 1
+
+    def _l1_discard(self, keys) -> None:
+        with self._lock:
+            for key in keys:
+                self._l1_pop(key)
+
+    # cache API
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._sync_l1()
+        value = self._l1_get(key)
+        if value is not MISSING:
+            return value
+        row = self._connection().execute(
+            "SELECT value, expires FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time()):
+            self._record("misses", key)
+            return default
+        blob, expires = row
+        value = pickle.loads(blob)
+        self._l1_set(key, value, blob, expires)
+        self._record("l2_hits", key, len(blob))
+        return value
+
+    def get_many(self, keys, version=None):
+        keys_by_key = {self.make_and_validate_key(key, version=version): key for key in keys}
+        self._sync_l1()
+        found = {}
+        for key, original in keys_by_key.items():
+            value = self._l1_get(key)
+            if value is not MISSING:
+                found[original] = value
+        missing = [key for key, original in keys_by_key.items() if original not in found]
+        if missing:
+            now = time()
+            rows = self._connection().execute(
+                f"SELECT key, value, expires FROM cache WHERE key IN ({', '.join('?' * len(missing))})",
+                missing,
+            ).fetchall()
+            for key, blob, expires in rows:
+                if expires is not None and expires <= now:
+                    continue
+                value = pickle.loads(blob)
+                self._l1_set(key, value, blob, expires)
+                found[keys_by_key[key]] = value
+                self._record("l2_hits", key, len(blob))
+            for key in missing:
+                if keys_by_key[key] not in found:
+                    self._record("misses", key)
+        return found
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._sync_l1()
+        with self._lock:
+            entry = self._l1.get(key)
+        if entry is not None and (entry[2] is None or entry[2] > time()):
+            return True
+        row = self._connection().execute(
+            "SELECT 1 FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)", (key, time())
+        ).fetchone()
+        return row is not None
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        expires = self.get_backend_timeout(timeout)
+        self._write([key], [self._upsert(key, blob, expires)])
+        self._l1_set(key, value, blob, expires)
+        self._record("sets", key, len(blob))
+        self._cull()
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        entries = [
+            (self.make_and_validate_key(key, version=version), value, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+            for key, value in data.items()
+        ]
+        self._write(
+            [key for key, _, _ in entries],
+            [self._upsert(key, blob, expires) for key, _, blob in entries],
+        )
+        for key, value, blob in entries:
+            self._l1_set(key, value, blob, expires)
+            self._record("sets", key, len(blob))
+        self._cull()
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        expires = self.get_backend_timeout(timeout)
+        added, = self._write([key], [(
+            "INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires "
+            "WHERE cache.expires IS NOT NULL AND cache.expires <= ?",
+            (key, blob, expires, time()),
+        )], changed_only=True)
+        if added:
+            self._l1_set(key, value, blob, expires)
+            self._record("sets", key, len(blob))
+            self._cull()
+        return bool(added)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        touched, = self._write([key], [(
+            "UPDATE cache SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)",
+            (self.get_backend_timeout(timeout), key, time()),
+        )], changed_only=True)
+        self._l1_discard([key])
+        return bool(touched)
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        # read and write in one transaction: other workers increment too
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)", (key, time())
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found.")
+            value = pickle.loads(row[0]) + delta
+            connection.execute(
+                "UPDATE cache SET value = ? WHERE key = ?", (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), key)
+            )
+            stamp = connection.execute("INSERT INTO journal (key) VALUES (?)", (key,)).lastrowid
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        self._add_own_stamps([stamp])
+        self._l1_discard([key])
+        return value
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        deleted, = self._write([key], [("DELETE FROM cache WHERE key = ?", (key,))])
+        self._l1_discard([key])
+        self._record("deletes", key)
+        return bool(deleted)
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_and_validate_key(key, version=version) for key in keys]
+        self._write(keys, [("DELETE FROM cache WHERE key = ?", (key,)) for key in keys])
+        self._l1_discard(keys)
+        for key in keys:
+            self._record("deletes", key)
+
+    def clear(self):
+        self._write([None], [("DELETE FROM cache", ())])
+        with self._lock:
+            self._l1.clear()
+            self._l1_bytes = 0
+
+    def get_stats(self) -> dict:
+        with self._lock, self._stats_lock:
+            return {**self.stats, "l1_entries": len(self._l1), "l1_bytes": self._l1_bytes}
@@ -0,0 +1,44 @@
+"""
+SQLite backend applying PRAGMAs to every new connection.
+
+    DATABASES = {
+        "default": {
+            "ENGINE": "mysite.backends.sqlite3",
+            "NAME": "db.sqlite3",
+            "OPTIONS": {
+                "pragmas": {"journal_mode": "WAL", "synchronous": "NORMAL"},
+                "transaction_mode": "IMMEDIATE",
+            },
+        },
+    }
+
+`pragmas` and `transaction_mode` are removed from OPTIONS before they
+are passed to sqlite3.connect(). Pragmas are applied in order, so
+`busy_timeout` should come first: switching to WAL needs a lock another
+connection may hold.
+
+With the default DEFERRED mode a transaction that reads before writing
+fails at once with "database is locked" when another connection wrote
+in between, busy_timeout doesn't help. IMMEDIATE takes the write lock
+at BEGIN, where busy_timeout applies; don't use it on a read-only alias.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.pragmas = params.pop("pragmas", {})
+        self.transaction_mode = params.pop("transaction_mode", None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for pragma, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode is None:
+            return super()._start_transaction_under_autocommit()
+        self.cursor().execute(f"BEGIN {self.transaction_mode}")
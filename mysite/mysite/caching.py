@@ -0,0 +1,258 @@
+"""
+Cache recomputation without stampedes.
+
+Values are stored with the time they expire, the time it took to compute
+them and an optional version, and kept `stale_timeout` seconds longer
+than their timeout:
+
+- a little before it expires (the more expensive the value, the earlier)
+  a request may decide to refresh it ("probabilistic early expiration",
+  Vattani et al., XFetch), so most values are renewed before anyone
+  sees them expire;
+- only the request winning a lock shared through the cache recomputes
+  an expired value or one of an older version, the others keep getting
+  the stale one meanwhile;
+- when there is nothing to serve yet, the others wait for the lock
+  holder's result rather than computing it too.
+
+`get_or_recompute()` (and `aget_or_recompute()` in async code) is for
+hand-rolled caches, `cache_page_single_flight` can be used in place of
+`cache_page`.
+"""
+import asyncio
+import hashlib
+import math
+import random
+from functools import wraps
+from time import monotonic, sleep, time
+from typing import Any, Awaitable, Callable, Optional
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import BaseCache, caches
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import get_cache_key, get_max_age, learn_cache_key, patch_response_headers
+
+# how long a lock holder may take before someone else recomputes
+DEFAULT_LOCK_TIMEOUT = 30
+# 1 is what XFetch suggests, more refreshes earlier
+DEFAULT_BETA = 1.0
+LOCK_POLL_INTERVAL = 0.05
+
+
+class CachedValue:
+    __slots__ = ("value", "expires", "delta", "version")
+
+    def __init__(self, value, expires: float, delta: float, version: Optional[str]):
+        self.value = value
+        self.expires = expires
+        self.delta = delta
+        self.version = version
+
+    def __getstate__(self):
+        return self.value, self.expires, self.delta, self.version
+
+    def __setstate__(self, state):
+        self.value, self.expires, self.delta, self.version = state
+
+    def is_fresh(self, version: Optional[str], beta: float) -> bool:
+        if self.version != version:
+            return False
+        # 1 - random() is never 0
+        return time() - self.delta * beta * math.log(1.0 - random.random()) < self.expires
+
+
+def lock_key(key: str) -> str:
+    return f"{key}:lock"
+
+
+def store(cache: BaseCache, key: str, value, delta: float, timeout: int, stale_timeout: int, version) -> None:
+    cache.set(key, CachedValue(value, time() + timeout, delta, version), timeout + stale_timeout)
+
+
+def release(cache: BaseCache, key: str, token: str) -> None:
+    # not atomic: at worst a lock that had already timed out is dropped
+    if cache.get(lock_key(key)) == token:
+        cache.delete(lock_key(key))
+
+
+def get_or_recompute(
+    key: str,
+    compute: Callable[[], Any],
+    timeout: int,
+    stale_timeout: Optional[int] = None,
+    version: Optional[str] = None,
+    cacheable: Callable[[Any], bool] = None,
+    lock_timeout: int = DEFAULT_LOCK_TIMEOUT,
+    beta: float = DEFAULT_BETA,
+    cache: BaseCache = None,
+):
+    """
+    Returns the cached value of `key`, calling `compute()` in at most one
+    process at a time when it's missing, expired or of another `version`.
+    Values for which `cacheable(value)` is false are returned unsaved.
+    """
+    cache = cache or caches["default"]
+    stale_timeout = timeout if stale_timeout is None else stale_timeout
+    cached = cache.get(key)
+    if cached is not None and cached.is_fresh(version, beta):
+        return cached.value
+
+    token = uuid4().hex
+    deadline = monotonic() + lock_timeout
+    while not cache.add(lock_key(key), token, lock_timeout):
+        if cached is not None:
+            # someone is refreshing it
+            return cached.value
+        if monotonic() > deadline:
+            # the lock holder is too slow or died, don't wait forever
+            return compute()
+        sleep(LOCK_POLL_INTERVAL)
+        cached = cache.get(key)
+        if cached is not None and cached.version == version:
+            return cached.value
+        cached = None
+
+    try:
+        start = monotonic()
+        value = compute()
+        if cacheable is None or cacheable(value):
+            store(cache, key, value, monotonic() - start, timeout, stale_timeout, version)
+    finally:
+        release(cache, key, token)
+    return value
+
+
+async def aget_or_recompute(
+    key: str,
+    compute: Callable[[], Awaitable[Any]],
+    timeout: int,
+    stale_timeout: Optional[int] = None,
+    version: Optional[str] = None,
+    cacheable: Callable[[Any], bool] = None,
+    lock_timeout: int = DEFAULT_LOCK_TIMEOUT,
+    beta: float = DEFAULT_BETA,
+    cache: BaseCache = None,
+):
+    """
+    get_or_recompute() for async code, `compute` is a coroutine function
+    """
+    cache = cache or caches["default"]
+    stale_timeout = timeout if stale_timeout is None else stale_timeout
+    cached = await cache.aget(key)
+    if cached is not None and cached.is_fresh(version, beta):
+        return cached.value
+
+    token = uuid4().hex
+    deadline = monotonic() + lock_timeout
+    while not await cache.aadd(lock_key(key), token, lock_timeout):
+        if cached is not None:
+            return cached.value
+        if monotonic() > deadline:
+            return await compute()
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+        cached = await cache.aget(key)
+        if cached is not None and cached.version == version:
+            return cached.value
+        cached = None
+
+    try:
+        start = monotonic()
+        value = await compute()
+        if cacheable is None or cacheable(value):
+            await cache.aset(
+                key,
+                CachedValue(value, time() + timeout, monotonic() - start, version),
+                timeout + stale_timeout,
+            )
+    finally:
+        if await cache.aget(lock_key(key)) == token:
+            await cache.adelete(lock_key(key))
+    return value
+
+
+def is_cacheable_response(response: HttpResponse) -> bool:
+    cache_control = response.get("Cache-Control", "")
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not any(directive in cache_control for directive in ("private", "no-store", "no-cache"))
+        and get_max_age(response) != 0
+    )
+
+
+def cache_page_single_flight(
+    timeout: int,
+    key_prefix: str = "",
+    stale_timeout: Optional[int] = None,
+    version: Callable[[HttpRequest], str] = None,
+    cache_alias: str = None,
+):
+    """
+    Same as `cache_page` (and honouring Vary the same way), with the
+    stampede protection of get_or_recompute(). `version(request)` can
+    tell a stored page is outdated: it's still served while one request
+    renders the new one.
+    """
+    stale_timeout = timeout if stale_timeout is None else stale_timeout
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request: HttpRequest, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view_func(request, *args, **kwargs)
+            cache = caches[cache_alias or settings.CACHE_MIDDLEWARE_ALIAS]
+            page_version = version(request) if version else None
+
+            def get_cached() -> Optional[CachedValue]:
+                key = get_cache_key(request, key_prefix, "GET", cache)
+                return cache.get(key) if key is not None else None
+
+            cached = get_cached()
+            if cached is not None and cached.is_fresh(page_version, DEFAULT_BETA):
+                return cached.value
+
+            # the page key depends on the response's Vary header,
+            # so the lock is taken on the URL
+            url = hashlib.md5(request.build_absolute_uri().encode(), usedforsecurity=False).hexdigest()
+            url_key = f"views.decorators.cache.cache_page.{key_prefix}.single_flight.{url}"
+            token = uuid4().hex
+            deadline = monotonic() + DEFAULT_LOCK_TIMEOUT
+            while not cache.add(lock_key(url_key), token, DEFAULT_LOCK_TIMEOUT):
+                if cached is not None:
+                    return cached.value
+                if monotonic() > deadline:
+                    return view_func(request, *args, **kwargs)
+                sleep(LOCK_POLL_INTERVAL)
+                cached = get_cached()
+                if cached is not None and cached.version == page_version:
+                    return cached.value
+                cached = None
+
+            start = monotonic()
+
+            def save(response: HttpResponse) -> None:
+                try:
+                    if request.method == "GET" and is_cacheable_response(response):
+                        patch_response_headers(response, timeout)
+                        key = learn_cache_key(request, response, timeout + stale_timeout, key_prefix, cache)
+                        store(cache, key, response, monotonic() - start, timeout, stale_timeout, page_version)
+                finally:
+                    release(cache, url_key, token)
+
+            try:
+                response = view_func(request, *args, **kwargs)
+            except BaseException:
+                release(cache, url_key, token)
+                raise
+            if hasattr(response, "render") and callable(response.render) and not response.is_rendered:
+                # e.g. DRF responses, rendered once the view returns
+                response.add_post_render_callback(save)
+            else:
+                save(response)
+            return response
+
+        return wrapper
+
+    return decorator
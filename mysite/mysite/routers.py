@@ -0,0 +1,68 @@
+"""
+Database routing for the read-only SQLite connection.
+
+Requests that can't change anything (GET, HEAD, OPTIONS) read through the
+`replica` alias, a second connection to the same file opened with
+`query_only`: with WAL, these readers never wait for the writers that
+save CSV imports, orders and sessions on `default`.
+
+mysite.test_runner removes the router: the test runner only mirrors the
+replica's NAME, so it would open a second connection that can't see the
+data of the test transaction.
+"""
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import DEFAULT_DB_ALIAS
+
+READ_ONLY_ALIAS = "replica"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+read_only_request = ContextVar("read_only_request", default=False)
+
+
+class ReadOnlyRequestRouter:
+    def db_for_read(self, model, **hints):
+        if read_only_request.get():
+            return READ_ONLY_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # instances read from the replica must still be saved to default
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, READ_ONLY_ALIAS}
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != READ_ONLY_ALIAS
+
+
+class ReadOnlyRequestMiddleware:
+    """
+    Marks safe requests so ReadOnlyRequestRouter sends their reads
+    to the read-only connection
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = read_only_request.set(request.method in SAFE_METHODS)
+        try:
+            return self.get_response(request)
+        finally:
+            read_only_request.reset(token)
+
+    async def __acall__(self, request):
+        token = read_only_request.set(request.method in SAFE_METHODS)
+        try:
+            return await self.get_response(request)
+        finally:
+            read_only_request.reset(token)
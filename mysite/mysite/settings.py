@@ -31,8 +31,7 @@ SECRET_KEY = getenv(
 )
 
 # SECURITY WARNING: don't run with debug turned on in production!
-# DEBUG = getenv('DJANGO_DEBUG', '1') == 1
-DEBUG = True
+DEBUG = getenv('DJANGO_DEBUG', '1') == '1'
 
 ALLOWED_HOSTS = [
     "127.0.0.1",
@@ -64,28 +63,35 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'django.contrib.sitemaps',
 
-    'debug_toolbar',
     'rest_framework',
     'django_filters',
 
     'shopapp.apps.ShopappConfig',
     'myauth.apps.MyauthConfig',
     'blogapp.apps.BlogappConfig',
+    'jobsapp.apps.JobsappConfig',
+    'metricsapp.apps.MetricsappConfig',
 ]
 
 MIDDLEWARE = [
+    # first, so it times the whole chain
+    'metricsapp.middleware.RequestMetricsMiddleware',
     # "django.middleware.cache.UpdateCacheMiddleware",
     'django.middleware.security.SecurityMiddleware',
+    'mysite.routers.ReadOnlyRequestMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
     # "django.middleware.cache.FetchFromCacheMiddleware",
 ]
 
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
@@ -109,13 +115,48 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# applied to every new connection by mysite.backends.sqlite3,
+# busy_timeout first since switching to WAL may have to wait for a lock
+SQLITE_PRAGMAS = {
+    'busy_timeout': 5000,
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'mysite.backends.sqlite3',
         'NAME': DATABASE_DIR / 'db.sqlite3',
-    }
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'pragmas': SQLITE_PRAGMAS,
+            'transaction_mode': 'IMMEDIATE',
+        },
+    },
+    # same file, read by GET/HEAD requests (see mysite.routers)
+    'replica': {
+        'ENGINE': 'mysite.backends.sqlite3',
+        'NAME': DATABASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'pragmas': {**SQLITE_PRAGMAS, 'query_only': 'ON'},
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
 }
 
+DATABASE_ROUTERS = ['mysite.routers.ReadOnlyRequestRouter']
+
+# caches, metrics and routing for the tests, see mysite.test_runner
+TEST_RUNNER = 'mysite.test_runner.TestRunner'
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -136,13 +177,34 @@ AUTH_PASSWORD_VALIDATORS = [
 
 CACHES = {
     "default": {
-        # "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
-        # "LOCATION": "/var/tmp/django_cache",
-        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+        # per-process LRU in front of an SQLite file shared by the workers,
+        # counting hits, misses and sizes per key prefix (see `cache_stats`)
+        "BACKEND": "metricsapp.cache.MeteredCache",
+        "LOCATION": DATABASE_DIR / "cache.sqlite3",
+        "OPTIONS": {
+            "MAX_ENTRIES": 100_000,
+            "L1_MAX_BYTES": 64 * 1024 * 1024,
+            "L1_MAX_ENTRY_BYTES": 16 * 1024 * 1024,
+            # seconds a value changed by another worker may still be served
+            "VERSION_CHECK_INTERVAL": 1.0,
+        },
     }
 }
 CACHE_MIDDLEWARE_SECONDS = 200
 
+# metrics of all the workers of the host, see metricsapp.metrics and /metrics/
+METRICS_LOCATION = DATABASE_DIR / 'metrics.sqlite3'
+# seconds a worker may keep its increments before adding them to the totals
+METRICS_FLUSH_INTERVAL = 5
+# the Prometheus scraper, staff can read /metrics/ from anywhere
+METRICS_ALLOWED_IPS = [
+    "127.0.0.1",
+    "::1",
+] + [ip for ip in getenv('DJANGO_METRICS_ALLOWED_IPS', '').split(',') if ip]
+# requests slower than this (seconds) are logged with their SQL,
+# see metricsapp.middleware
+SLOW_REQUEST_THRESHOLD = float(getenv('DJANGO_SLOW_REQUEST_THRESHOLD', '1.0'))
+
 # REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
@@ -168,6 +230,27 @@ STATIC_URL = 'static/'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'uploads'
+
+# same as the default handlers, plus a `sha256` attribute on uploaded files
+FILE_UPLOAD_HANDLERS = [
+    'shopapp.upload_handlers.HashingMemoryFileUploadHandler',
+    'shopapp.upload_handlers.HashingTemporaryFileUploadHandler',
+]
+
+# see shopapp.thumbnails
+THUMBNAIL_SIZES = {
+    'small': (200, 200),
+    'large': (800, 800),
+}
+# processes rendering the thumbnails, 0 renders them in the request
+THUMBNAIL_WORKERS = 2
+
+# background jobs, see jobsapp.jobs and `manage.py run_jobs`
+JOBS_WORKERS = 2
+JOBS_FILES_ROOT = DATABASE_DIR / 'jobs'
+
+# threads writing the files of a multi-image upload to storage
+PRODUCT_IMAGE_UPLOAD_THREADS = 8
 # DEFAULT_FILE_STORAGE =
 
 # Default primary key field type
@@ -0,0 +1,30 @@
+"""
+Test runner applying the settings the tests run with, whatever starts
+them (manage.py test, django-admin test, an IDE):
+
+- no cache, tests that need one override it with LocMemCache
+- metrics kept in memory
+- no database router: the test runner only mirrors the replica's NAME,
+  its second connection can't see the data of the test transaction.
+  Tests of the routing enable it with override_settings, on committed
+  data (TransactionTestCase).
+"""
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+TEST_SETTINGS = {
+    "CACHES": {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}},
+    "METRICS_LOCATION": ":memory:",
+    "DATABASE_ROUTERS": [],
+}
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.test_settings = override_settings(**TEST_SETTINGS)
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        super().teardown_test_environment(**kwargs)
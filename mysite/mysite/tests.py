@@ -0,0 +1,326 @@
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from mysite.backends.cache import TieredCache
+from mysite.caching import (
+    CachedValue,
+    aget_or_recompute,
+    cache_page_single_flight,
+    get_or_recompute,
+    lock_key,
+)
+from mysite.routers import ReadOnlyRequestMiddleware, ReadOnlyRequestRouter
+from shopapp.models import Product
+
+
+class SQLiteBackendTestCase(TestCase):
+    def test_pragmas_are_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute("PRAGMA synchronous")
+            # NORMAL
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+
+class ReadOnlyRequestRouterTestCase(SimpleTestCase):
+    def setUp(self):
+        self.router = ReadOnlyRequestRouter()
+        self.factory = RequestFactory()
+
+    def test_safe_requests_read_from_replica(self):
+        databases = {}
+
+        def view(request):
+            databases[request.method] = self.router.db_for_read(Product)
+            return HttpResponse()
+
+        middleware = ReadOnlyRequestMiddleware(view)
+        middleware(self.factory.get("/"))
+        middleware(self.factory.head("/"))
+        middleware(self.factory.post("/"))
+
+        self.assertEqual(databases, {"GET": "replica", "HEAD": "replica", "POST": "default"})
+        self.assertEqual(self.router.db_for_read(Product), "default")
+
+    async def test_async_requests_read_from_replica(self):
+        databases = {}
+
+        async def view(request):
+            databases[request.method] = self.router.db_for_read(Product)
+            return HttpResponse()
+
+        middleware = ReadOnlyRequestMiddleware(view)
+        await middleware(self.factory.get("/"))
+        await middleware(self.factory.post("/"))
+
+        self.assertEqual(databases, {"GET": "replica", "POST": "default"})
+
+    def test_writes_and_migrations_use_default(self):
+        product = Product(name="Replica")
+        product._state.db = "replica"
+        self.assertEqual(self.router.db_for_write(Product, instance=product), "default")
+        self.assertTrue(self.router.allow_migrate("default", "shopapp"))
+        self.assertFalse(self.router.allow_migrate("replica", "shopapp"))
+
+
+@override_settings(DATABASE_ROUTERS=["mysite.routers.ReadOnlyRequestRouter"])
+class ReadOnlyRequestRoutingTestCase(TransactionTestCase):
+    # committed data, the replica's connection can't see a test transaction
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        self.product = Product.objects.create(name="Replica")
+
+    def request(self, method: str, url: str) -> tuple[CaptureQueriesContext, CaptureQueriesContext]:
+        with CaptureQueriesContext(connections["default"]) as default:
+            with CaptureQueriesContext(connections["replica"]) as replica:
+                response = getattr(self.client, method)(url)
+        self.assertLess(response.status_code, 400)
+        return default, replica
+
+    def test_get_reads_from_the_replica(self):
+        default, replica = self.request("get", reverse("shopapp:product_details", kwargs={"pk": self.product.pk}))
+        self.assertEqual(len(default), 0)
+        self.assertGreater(len(replica), 0)
+
+    def test_post_uses_default(self):
+        default, replica = self.request("post", reverse("shopapp:product_delete", kwargs={"pk": self.product.pk}))
+        self.assertEqual(len(replica), 0)
+        self.assertTrue(any(query["sql"].startswith("UPDATE") for query in default))
+        self.product.refresh_from_db()
+        self.assertTrue(self.product.archived)
+
+
+class TieredCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = Path(directory.name) / "cache.sqlite3"
+        # two caches on one file stand for two workers
+        self.cache = self.make_cache()
+        self.other = self.make_cache()
+
+    def make_cache(self, **options) -> TieredCache:
+        return TieredCache(self.location, {"OPTIONS": {"VERSION_CHECK_INTERVAL": 0, **options}})
+
+    def test_values_are_shared_through_l2(self):
+        self.cache.set("answer", {"value": 42})
+        self.assertEqual(self.other.get("answer"), {"value": 42})
+        self.assertEqual(self.other.get("answer"), {"value": 42})
+        self.assertEqual(self.other.get_stats()["l2_hits"], 1)
+        self.assertEqual(self.other.get_stats()["l1_hits"], 1)
+        self.assertIsNone(self.other.get("question"))
+        self.assertEqual(self.other.get_stats()["misses"], 1)
+
+    def test_l1_values_are_not_shared_objects(self):
+        self.cache.set("list", [1, 2])
+        self.cache.get("list").append(3)
+        self.assertEqual(self.cache.get("list"), [1, 2])
+
+    def test_writes_invalidate_other_l1(self):
+        self.cache.set("key", "old")
+        self.assertEqual(self.other.get("key"), "old")
+        self.cache.set("key", "new")
+        self.assertEqual(self.other.get("key"), "new")
+        self.cache.delete("key")
+        self.assertIsNone(self.other.get("key"))
+        self.assertEqual(self.other.get_stats()["l1_invalidations"], 2)
+
+    def test_own_writes_stay_in_l1(self):
+        self.cache.set("key", "value")
+        self.cache.set_many({"a": 1, "b": 2})
+        self.cache.incr("a")
+        self.other.set("b", 3)
+        self.assertEqual(self.cache.get_many(["key", "a", "b"]), {"key": "value", "a": 2, "b": 3})
+        stats = self.cache.get_stats()
+        self.assertEqual(stats["l1_hits"], 1)
+        # "a" left L1 when incremented, "b" was written by the other worker
+        self.assertEqual(stats["l2_hits"], 2)
+        self.assertEqual(stats["l1_invalidations"], 1)
+        self.assertEqual(self.cache._own_stamps, set())
+
+    def test_failed_add_and_touch_are_not_journaled(self):
+        self.cache.set("lock", "owner")
+        self.assertEqual(self.other.get("lock"), "owner")
+        journal = self.cache._connection().execute("SELECT count(*) FROM journal").fetchone()[0]
+        for _ in range(3):
+            self.assertFalse(self.cache.add("lock", "waiter"))
+            self.assertFalse(self.cache.touch("missing"))
+        self.assertEqual(self.cache._connection().execute("SELECT count(*) FROM journal").fetchone()[0], journal)
+        self.assertEqual(self.other.get("lock"), "owner")
+        self.assertEqual(self.other.get_stats()["l1_invalidations"], 0)
+        self.assertTrue(self.cache.touch("lock"))
+        self.assertEqual(
+            self.cache._connection().execute("SELECT count(*) FROM journal").fetchone()[0], journal + 1,
+        )
+
+    def test_l1_is_stale_until_the_next_version_check(self):
+        lazy = self.make_cache(VERSION_CHECK_INTERVAL=60)
+        self.cache.set("key", "old")
+        self.assertEqual(lazy.get("key"), "old")
+        self.cache.set("key", "new")
+        self.assertEqual(lazy.get("key"), "old")
+        lazy._checked_at -= 60
+        self.assertEqual(lazy.get("key"), "new")
+
+    def test_clear_empties_every_l1(self):
+        self.cache.set_many({"a": 1, "b": 2})
+        self.assertEqual(self.other.get_many(["a", "b", "c"]), {"a": 1, "b": 2})
+        self.cache.clear()
+        self.assertEqual(self.other.get_many(["a", "b"]), {})
+        self.assertEqual(self.other.get_stats()["l1_entries"], 0)
+
+    def test_l1_is_bounded_by_size(self):
+        cache = self.make_cache(L1_MAX_BYTES=1000, L1_MAX_ENTRY_BYTES=500)
+        for i in range(10):
+            cache.set(f"key{i}", "x" * 200)
+        stats = cache.get_stats()
+        self.assertLessEqual(stats["l1_bytes"], 1000)
+        self.assertGreater(stats["l1_evictions"], 0)
+        # evicted entries are still in L2
+        self.assertEqual(cache.get("key0"), "x" * 200)
+        cache.set("big", "x" * 600)
+        self.assertNotIn(cache.make_key("big"), cache._l1)
+        self.assertEqual(cache.get("big"), "x" * 600)
+
+    def test_per_key_timeout(self):
+        self.cache.set("short", 1, timeout=10)
+        self.cache.set("long", 2, timeout=100)
+        self.cache.set("forever", 3, timeout=None)
+        self.assertEqual(self.other.get("short"), 1)
+        later = time.time() + 50
+        with mock.patch("mysite.backends.cache.time", return_value=later):
+            for cache in (self.cache, self.other):
+                self.assertIsNone(cache.get("short"))
+                self.assertEqual(cache.get("long"), 2)
+                self.assertEqual(cache.get("forever"), 3)
+
+    def test_add_and_incr(self):
+        self.assertTrue(self.cache.add("counter", 1))
+        self.assertFalse(self.other.add("counter", 5))
+        self.assertEqual(self.other.incr("counter"), 2)
+        self.assertEqual(self.cache.incr("counter", 10), 12)
+        self.assertEqual(self.other.get("counter"), 12)
+        with self.assertRaises(ValueError):
+            self.cache.incr("missing")
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    def setUp(self):
+        self.cache = LocMemCache("single-flight", {})
+        self.cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return f"value {self.calls}"
+
+    def get(self, **kwargs):
+        return get_or_recompute("key", self.compute, 60, cache=self.cache, **kwargs)
+
+    def test_value_is_computed_once(self):
+        self.assertEqual(self.get(), "value 1")
+        self.assertEqual(self.get(), "value 1")
+        self.assertEqual(self.calls, 1)
+        self.assertFalse(self.cache.has_key(lock_key("key")))
+
+    def test_new_version_is_computed(self):
+        self.assertEqual(self.get(version="1"), "value 1")
+        self.assertEqual(self.get(version="2"), "value 2")
+        self.assertEqual(self.get(version="2"), "value 2")
+
+    def test_stale_value_is_served_while_locked(self):
+        self.cache.set("key", CachedValue("stale", time.time() - 1, 0.1, None), 60)
+        self.cache.add(lock_key("key"), "another worker")
+        self.assertEqual(self.get(), "stale")
+        self.assertEqual(self.calls, 0)
+        self.cache.delete(lock_key("key"))
+        self.assertEqual(self.get(), "value 1")
+
+    def test_outdated_version_is_served_while_locked(self):
+        self.cache.set("key", CachedValue("old", time.time() + 60, 0.1, "1"), 60)
+        self.cache.add(lock_key("key"), "another worker")
+        self.assertEqual(self.get(version="2"), "old")
+
+    def test_expensive_values_expire_early(self):
+        self.cache.set("key", CachedValue("cached", time.time() + 10, 100, None), 60)
+        with mock.patch("random.random", return_value=0.5):
+            # 100 * -ln(0.5) is more than the 10 seconds left
+            self.assertEqual(self.get(), "value 1")
+        self.cache.set("key", CachedValue("cached", time.time() + 10, 0.01, None), 60)
+        with mock.patch("random.random", return_value=0.5):
+            self.assertEqual(self.get(), "cached")
+
+    def test_missing_value_waits_for_the_lock_holder(self):
+        self.cache.add(lock_key("key"), "another worker")
+
+        def lock_holder_done(seconds):
+            self.cache.set("key", CachedValue("theirs", time.time() + 60, 0.1, None), 60)
+
+        with mock.patch("mysite.caching.sleep", side_effect=lock_holder_done) as sleep:
+            self.assertEqual(self.get(), "theirs")
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(self.calls, 0)
+
+    def test_async(self):
+        async def compute():
+            return self.compute()
+
+        async def get():
+            return await aget_or_recompute("key", compute, 60, version="1", cache=self.cache)
+
+        self.assertEqual(async_to_sync(get)(), "value 1")
+        self.assertEqual(async_to_sync(get)(), "value 1")
+        self.assertEqual(self.calls, 1)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class CachePageSingleFlightTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.calls = 0
+        self.version = "1"
+
+        @cache_page_single_flight(60, key_prefix="test", version=lambda request: self.version)
+        def view(request):
+            self.calls += 1
+            response = HttpResponse(f"page {self.calls}")
+            response["Vary"] = "Accept"
+            return response
+
+        self.view = view
+
+    def get(self, accept="text/html"):
+        return self.view(self.factory.get("/page/", HTTP_ACCEPT=accept)).content
+
+    def test_page_is_cached_per_vary_header(self):
+        self.assertEqual(self.get(), b"page 1")
+        self.assertEqual(self.get(), b"page 1")
+        self.assertEqual(self.get("text/plain"), b"page 2")
+        self.assertEqual(self.get("text/plain"), b"page 2")
+
+    def test_outdated_page_is_served_while_one_request_renders(self):
+        self.assertEqual(self.get(), b"page 1")
+        self.version = "2"
+        # another request holds the lock
+        with mock.patch.object(cache, "add", return_value=False):
+            self.assertEqual(self.get(), b"page 1")
+        self.assertEqual(self.get(), b"page 2")
+
+    def test_posts_are_not_cached(self):
+        self.view(self.factory.post("/page/"))
+        self.view(self.factory.post("/page/"))
+        self.assertEqual(self.calls, 2)
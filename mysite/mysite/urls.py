@@ -26,6 +26,8 @@ urlpatterns = [
     path('shop/', include('shopapp.urls')),
     path('myauth/', include('myauth.urls')),
     path('blog/', include('blogapp.urls')),
+    path('jobs/', include('jobsapp.urls')),
+    path('metrics/', include('metricsapp.urls')),
 
     path(
         "sitemap.xml",
@@ -1,13 +1,25 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR, PAGE_VAR, ChangeList
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.db.models import QuerySet
-from django.http import HttpRequest, HttpResponse
-from django.shortcuts import render, redirect
-from django.urls import path
+from django.http import HttpRequest, HttpResponse, QueryDict
+from django.shortcuts import get_object_or_404, render, redirect
+from django.urls import path, reverse
+from django.utils.html import format_html
 
-from .common import save_csv_products
+from jobsapp.jobs import enqueue
+from jobsapp.models import Job
+
+from .common import check_csv_header
 from .models import Product, Order, ProductImage
 from .admin_mixins import ExportAsCSVMixin
 from .forms import CSVImportForm
+from .search import fts_enabled, search_products
+from .tasks import enqueue_products_import
+
+# bigger selections are updated by a background job
+ADMIN_ACTION_JOB_THRESHOLD = 1000
 
 
 class OrderInline(admin.TabularInline):
@@ -18,14 +30,63 @@ class ProductInline(admin.StackedInline):
     model = ProductImage
 
 
+def get_changelist_queryset(model, user: User, query: str) -> QuerySet:
+    """
+    The objects of the admin changelist at `?query` (filters and search)
+    as `user` sees them
+    """
+    request = HttpRequest()
+    request.method = "GET"
+    request.user = user
+    request.GET = QueryDict(query, mutable=True)
+    request.GET.pop(PAGE_VAR, None)
+    return admin.site._registry[model].get_changelist_instance(request).queryset
+
+
+def set_archived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet, archived: bool):
+    if queryset.count() <= ADMIN_ACTION_JOB_THRESHOLD:
+        queryset.update(archived=archived)
+        return
+    if request.POST.get("select_across") == "1":
+        # "select all": the job finds the products again from the
+        # changelist filters rather than storing every pk in its row
+        selection = {"changelist_query": request.GET.urlencode()}
+    else:
+        # at most a page of products
+        selection = {"product_ids": list(queryset.values_list("pk", flat=True))}
+    job = enqueue(
+        "shopapp.set_products_archived",
+        user=request.user,
+        archived=archived,
+        **selection,
+    )
+    modeladmin.message_user(
+        request,
+        format_html(
+            'Products are updated in the background, see <a href="{}">job {}</a>',
+            reverse("admin:jobsapp_job_change", args=[job.pk]),
+            job.pk,
+        ),
+    )
+
+
+class ProductChangeList(ChangeList):
+    def get_ordering(self, request: HttpRequest, queryset: QuerySet) -> list:
+        ordering = super().get_ordering(request, queryset)
+        # search results are ranked by search_products(), unless a column is sorted
+        if "search_rank" in queryset.query.extra_select and ORDER_VAR not in self.params:
+            return ["search_rank", *ordering]
+        return ordering
+
+
 @admin.action(description="Archive products")
 def mark_archived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
-    queryset.update(archived=True)
+    set_archived(modeladmin, request, queryset, archived=True)
 
 
 @admin.action(description="Unarchive products")
 def mark_unarchived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
-    queryset.update(archived=False)
+    set_archived(modeladmin, request, queryset, archived=False)
 
 
 @admin.register(Product)
@@ -34,7 +95,7 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
     actions = [
         mark_archived,
         mark_unarchived,
-        "export_csv",
+        "export_as_csv",
     ]
     inlines = [
         OrderInline,
@@ -63,6 +124,14 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
         })
     ]
 
+    def get_changelist(self, request: HttpRequest, **kwargs):
+        return ProductChangeList
+
+    def get_search_results(self, request: HttpRequest, queryset: QuerySet, search_term: str):
+        if not search_term or not fts_enabled(queryset.db):
+            return super().get_search_results(request, queryset, search_term)
+        return search_products(queryset, search_term.split()), False
+
     def description_short(self, obj: Product) -> str:
         if len(obj.description) < 48:
             return obj.description
@@ -82,12 +151,37 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
             }
             return render(request, "admin/csv_form.html", context, status=400)
 
-        save_csv_products(
-            file=form.files["csv_file"].file,
+        upload = form.files["csv_file"]
+        key = form.cleaned_data["key"] or None
+        try:
+            check_csv_header(upload.file, encoding=request.encoding, key=key)
+        except ValidationError as exc:
+            form.add_error("csv_file", exc)
+            context = {
+                "form": form,
+            }
+            return render(request, "admin/csv_form.html", context, status=400)
+
+        job = enqueue_products_import(
+            upload,
             encoding=request.encoding,
+            key=key,
+            dry_run=form.cleaned_data["dry_run"],
+            user=request.user,
         )
-        self.message_user(request, "Data from CSV was imported")
-        return redirect("..")
+        return redirect("admin:import_products_csv_status", job_id=job.pk)
+
+    def import_csv_status(self, request: HttpRequest, job_id) -> HttpResponse:
+        jobs = Job.objects.filter(task="shopapp.import_products_csv")
+        # as JobViewSet: the result is for the user who started the import
+        if not request.user.is_superuser:
+            jobs = jobs.filter(user=request.user)
+        job = get_object_or_404(jobs, pk=job_id)
+        context = {
+            "job": job,
+            "result": job.result,
+        }
+        return render(request, "admin/csv_import_status.html", context)
 
     def get_urls(self):
         urls = super().get_urls()
@@ -97,6 +191,11 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
                 self.import_csv,
                 name="import_products_csv",
             ),
+            path(
+                "import-products-csv/<uuid:job_id>/",
+                self.admin_site.admin_view(self.import_csv_status),
+                name="import_products_csv_status",
+            ),
         ]
         return new_urls + urls
 
@@ -110,12 +209,26 @@ class ProductInline(admin.StackedInline):
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
-
+class OrderAdmin(admin.ModelAdmin, ExportAsCSVMixin):
+    actions = [
+        "export_as_csv",
+    ]
+    export_csv_related = {
+        "user": "username",
+        "products": "name",
+    }
     inlines = [
         ProductInline,
     ]
-    list_display = "delivery_address", "promocode", "created_at", "user_verbose"
+    list_display = (
+        "delivery_address",
+        "promocode",
+        "created_at",
+        "user_verbose",
+        "products_count",
+        "total",
+        "discounted_total",
+    )
 
     def get_queryset(self, request):
         return Order.objects.select_related("user").prefetch_related("products")
@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ShopappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shopapp'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        post_migrate.connect(ensure_product_fts_after_migrate, sender=self)
+
+
+def ensure_product_fts_after_migrate(sender, using, **kwargs):
+    from .search import ensure_product_fts
+
+    ensure_product_fts(using)
@@ -1,19 +1,316 @@
-from csv import DictReader
+import logging
+from csv import DictReader, writer as csv_writer
+from functools import partial
 from io import TextIOWrapper
+from typing import Callable, Iterable, Iterator, Optional, Sequence
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
 
 from shopapp.models import Product
 
+log = logging.getLogger(__name__)
+
+CSV_IMPORT_BATCH_SIZE = 1000
+CSV_IMPORT_MAX_REPORTED_ERRORS = 100
+CSV_IMPORT_MAX_REPORTED_CHANGES = 100
+CSV_IMPORT_FIELDS = (
+    "name",
+    "description",
+    "price",
+    "discount",
+    "archived",
+)
+CSV_IMPORT_KEYS = (
+    "name",
+)
+
+
+class CSVImportResult:
+    """
+    Summary of a CSV import: how many rows were created, updated or left
+    unchanged, and which lines were rejected. Only the first few errors
+    and changes are kept, so the summary stays small for huge files.
+    """
+
+    def __init__(self, dry_run: bool = False):
+        self.dry_run = dry_run
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.batches = 0
+        self.error_count = 0
+        self.errors = []
+        self.changes = []
+
+    def add_error(self, line: int, messages: Sequence[str]) -> None:
+        self.error_count += 1
+        if len(self.errors) < CSV_IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "errors": list(messages)})
+
+    def add_change(self, line: int, action: str, key, fields: dict) -> None:
+        if len(self.changes) < CSV_IMPORT_MAX_REPORTED_CHANGES:
+            self.changes.append({
+                "line": line,
+                "action": action,
+                "key": key,
+                "fields": fields,
+            })
+
+    def as_dict(self) -> dict:
+        return {
+            "dry_run": self.dry_run,
+            "created": self.created,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "batches": self.batches,
+            "error_count": self.error_count,
+            "errors": self.errors,
+            "changes": self.changes,
+        }
+
+
+def check_csv_columns(columns: Optional[Sequence[str]], key: Optional[str] = None) -> None:
+    if not columns:
+        raise ValidationError("CSV file has no header row")
+    unknown = [column for column in columns if column not in CSV_IMPORT_FIELDS]
+    if unknown:
+        raise ValidationError(
+            "Unknown columns: %(columns)s",
+            params={"columns": ", ".join(unknown)},
+        )
+    if key is None:
+        return
+    if key not in CSV_IMPORT_KEYS:
+        raise ValidationError(
+            "Products can't be matched by %(key)r",
+            params={"key": key},
+        )
+    if key not in columns:
+        raise ValidationError(
+            "Key column %(key)r is missing from the CSV file",
+            params={"key": key},
+        )
+
+
+def check_csv_header(file, encoding: str, key: Optional[str] = None) -> None:
+    """
+    Checks the columns of a CSV file before it is imported,
+    the file is rewound afterwards
+    """
+    csv_file = TextIOWrapper(file, encoding=encoding, newline="")
+    try:
+        check_csv_columns(DictReader(csv_file).fieldnames, key=key)
+    except UnicodeDecodeError:
+        raise ValidationError("The file is not valid %(encoding)s text", params={"encoding": encoding})
+    finally:
+        # don't let the wrapper close the file
+        csv_file.detach()
+        file.seek(0)
+
+
+def get_csv_form_fields() -> dict:
+    return {
+        name: Product._meta.get_field(name).formfield()
+        for name in CSV_IMPORT_FIELDS
+    }
+
+
+def clean_csv_row(row: dict, form_fields: dict) -> dict:
+    if None in row:
+        raise ValidationError("Row has more values than the header")
+
+    data = {}
+    errors = []
+    for name, value in row.items():
+        if value is None:
+            value = ""
+        value = value.strip()
+        if value == "" and Product._meta.get_field(name).has_default():
+            continue
+        try:
+            data[name] = form_fields[name].clean(value)
+        except ValidationError as exc:
+            errors.extend(f"{name}: {message}" for message in exc.messages)
+    if errors:
+        raise ValidationError(errors)
+    return data
+
+
+def iter_csv_rows_data(reader: DictReader, result: CSVImportResult) -> Iterator[tuple[int, dict]]:
+    form_fields = get_csv_form_fields()
+    for row in reader:
+        try:
+            data = clean_csv_row(row, form_fields)
+        except ValidationError as exc:
+            result.add_error(reader.line_num, exc.messages)
+            continue
+        yield reader.line_num, data
+
 
-def save_csv_products(file, encoding):
+def save_csv_products(
+    file,
+    encoding,
+    key: Optional[str] = None,
+    dry_run: bool = False,
+    batch_size: int = CSV_IMPORT_BATCH_SIZE,
+    on_batch: Optional[Callable[[CSVImportResult], None]] = None,
+) -> CSVImportResult:
+    """
+    Reads products from a CSV file row by row and saves them
+    in batches of `batch_size`, each batch in its own transaction.
+
+    Without `key` every row becomes a new product. With `key` (e.g. "name")
+    rows matching an existing product by that column update it in bulk
+    and only the remaining rows are inserted; a key repeated in the file
+    updates what its earlier row saved. `dry_run` computes the same
+    summary without writing anything.
+
+    Rows that fail validation (or belong to a batch the database rejects)
+    are reported in the result instead of aborting the whole import.
+    `on_batch` is called with the running result after every batch.
+    """
     csv_file = TextIOWrapper(
         file,
         encoding=encoding,
+        newline="",
     )
     reader = DictReader(csv_file)
+    check_csv_columns(reader.fieldnames, key=key)
+
+    result = CSVImportResult(dry_run=dry_run)
+    if key is None:
+        flush = partial(flush_insert_batch, dry_run=dry_run)
+    else:
+        update_fields = [column for column in reader.fieldnames if column != key]
+        flush = partial(
+            flush_upsert_batch,
+            key=key,
+            update_fields=update_fields,
+            dry_run=dry_run,
+            planned={},
+        )
+
+    batch = []
+    for line, data in iter_csv_rows_data(reader, result):
+        batch.append((line, data))
+        if len(batch) >= batch_size:
+            run_batch(flush, batch, result, on_batch)
+            batch = []
+    if batch:
+        run_batch(flush, batch, result, on_batch)
+    return result
+
+
+def run_batch(
+    flush: Callable,
+    batch: Sequence[tuple[int, dict]],
+    result: CSVImportResult,
+    on_batch: Optional[Callable[[CSVImportResult], None]] = None,
+) -> None:
+    first_line, last_line = batch[0][0], batch[-1][0]
+    try:
+        with transaction.atomic():
+            flush(batch, result)
+    except DatabaseError as exc:
+        log.warning("CSV batch (lines %s-%s) was rejected: %s", first_line, last_line, exc)
+        for line, _ in batch:
+            result.add_error(line, [str(exc)])
+
+    result.batches += 1
+    log.debug(
+        "CSV import batch %s done (lines %s-%s): %s created, %s updated so far",
+        result.batches, first_line, last_line, result.created, result.updated,
+    )
+    if on_batch is not None:
+        on_batch(result)
+
+
+def flush_insert_batch(batch: Sequence[tuple[int, dict]], result: CSVImportResult, dry_run: bool) -> None:
+    if not dry_run:
+        Product.objects.bulk_create([Product(**data) for _, data in batch])
+    result.created += len(batch)
+
+
+def flush_upsert_batch(
+    batch: Sequence[tuple[int, dict]],
+    result: CSVImportResult,
+    key: str,
+    update_fields: Sequence[str],
+    dry_run: bool,
+    planned: dict,
+) -> None:
+    # rows are applied in order: a key repeated within the batch
+    # updates the product its earlier row created or changed
+    values = {data[key] for _, data in batch}
+    # a dry run saves nothing, the products as earlier batches left
+    # them are kept by key in `planned`
+    current = {value: planned[value] for value in values if value in planned}
+    for product in (
+        Product.objects
+        .filter(**{f"{key}__in": [value for value in values if value not in current]})
+        .only("pk", key, *update_fields)
+    ):
+        current.setdefault(getattr(product, key), []).append(product)
+
+    to_create = []
+    to_update = {}
+    created = updated = unchanged = 0
+    for line, data in batch:
+        value = data[key]
+        products = current.get(value)
+        if not products:
+            product = Product(**data)
+            current[value] = [product]
+            to_create.append(product)
+            created += 1
+            result.add_change(line, "create", value, {
+                field: [None, str(new_value)]
+                for field, new_value in data.items()
+                if field != key
+            })
+            continue
+
+        for product in products:
+            changes = {}
+            for field, new_value in data.items():
+                old_value = getattr(product, field)
+                if field != key and old_value != new_value:
+                    changes[field] = [str(old_value), str(new_value)]
+                    setattr(product, field, new_value)
+            if changes:
+                if product.pk is not None:
+                    to_update[product.pk] = product
+                updated += 1
+                result.add_change(line, "update", value, changes)
+            else:
+                unchanged += 1
+
+    if dry_run:
+        planned.update(current)
+    else:
+        if to_update:
+            Product.objects.bulk_update(to_update.values(), update_fields)
+        if to_create:
+            Product.objects.bulk_create(to_create)
+
+    result.created += created
+    result.updated += updated
+    result.unchanged += unchanged
+
+
+class Echo:
+    """
+    File-like object that hands back whatever is written to it,
+    so csv.writer can be used to produce lines one at a time
+    """
+
+    def write(self, value: str) -> str:
+        return value
+
 
-    products = [
-        Product(**row)
-        for row in reader
-    ]
-    Product.objects.bulk_create(products)
-    return products
+def iter_csv_rows(header: Sequence[str], rows: Iterable[Sequence]) -> Iterator[str]:
+    writer = csv_writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
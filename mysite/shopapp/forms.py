@@ -3,15 +3,52 @@ from django import forms
 from shopapp.models import Product
 
 
+class MultipleFileInput(forms.ClearableFileInput):
+    allow_multiple_selected = True
+
+    def value_from_datadict(self, data, files, name):
+        return files.getlist(name)
+
+
+class MultipleImageField(forms.ImageField):
+    """
+    ImageField accepting several files, each one is validated
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("widget", MultipleFileInput())
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data, initial=None):
+        clean_file = super().clean
+        if not data:
+            # raises when the field is required
+            clean_file(None)
+            return []
+        if not isinstance(data, (list, tuple)):
+            data = [data]
+        return [clean_file(file, initial) for file in data]
+
+
 class ProductForm(forms.ModelForm):
     class Meta:
         model = Product
         fields = "name", "price", "description", "discount", "preview"
 
-    images = forms.ImageField(
-        widget=forms.ClearableFileInput(attrs={"multiple": True}),
-    )
+    images = MultipleImageField()
 
 
 class CSVImportForm(forms.Form):
     csv_file = forms.FileField()
+    key = forms.ChoiceField(
+        label="Existing products",
+        choices=[
+            ("", "Always add new products"),
+            ("name", "Update products with the same name"),
+        ],
+        required=False,
+    )
+    dry_run = forms.BooleanField(
+        label="Dry run (only show what would change)",
+        required=False,
+    )
@@ -0,0 +1,94 @@
+"""
+Per-model cache generations.
+
+Every change to a tracked model bumps its generation counter, and cache
+keys or versions built from `get_generations()` change with it. Stale
+entries are never read again (or only while their replacement is being
+computed, see mysite.caching) and simply expire, so cached views can use
+long timeouts without explicit invalidation.
+"""
+from time import time
+
+from django.core.cache import cache
+from django.db import models, transaction
+
+from mysite.caching import cache_page_single_flight
+
+
+def generation_key(model) -> str:
+    return f"generation:{model._meta.label_lower}"
+
+
+def initial_generation() -> int:
+    # Start from the clock rather than 1: if the counter gets evicted it
+    # must not restart at a value some old cache entry was stored under
+    return int(time() * 1000)
+
+
+def get_generations(*models) -> str:
+    keys = [generation_key(model) for model in models]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, initial_generation(), None)
+            generations[key] = cache.get(key, 0)
+    return ".".join(str(generations[key]) for key in keys)
+
+
+async def aget_generations(*models) -> str:
+    keys = [generation_key(model) for model in models]
+    generations = await cache.aget_many(keys)
+    for key in keys:
+        if key not in generations:
+            await cache.aadd(key, initial_generation(), None)
+            generations[key] = await cache.aget(key, 0)
+    return ".".join(str(generations[key]) for key in keys)
+
+
+def bump_generation(model) -> None:
+    key = generation_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, initial_generation(), None)
+
+
+def bump_generation_on_commit(model, using=None) -> None:
+    # bumping before commit would let another request cache the old rows
+    # under the new generation
+    transaction.on_commit(lambda: bump_generation(model), using=using)
+
+
+class GenerationQuerySet(models.QuerySet):
+    """
+    QuerySet bumping the model generation on bulk writes,
+    which don't send post_save signals
+    """
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        bump_generation_on_commit(self.model, using=self.db)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        bump_generation_on_commit(self.model, using=self.db)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        bump_generation_on_commit(self.model, using=self.db)
+        return rows
+
+
+def cache_page_per_generation(timeout: int, *models, key_prefix: str = ""):
+    """
+    Same as `cache_page`, outdated by any change to `models`. The
+    generations are the page version: after a change the old page is
+    still served while one request renders the new one.
+    """
+    return cache_page_single_flight(
+        timeout,
+        key_prefix=key_prefix,
+        version=lambda request: get_generations(*models),
+    )
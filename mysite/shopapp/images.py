@@ -0,0 +1,101 @@
+"""
+Saving the images of a multi-image upload.
+
+Files are identified by their SHA-256 (computed while the upload was
+received, see shopapp.upload_handlers), so re-uploading a photo doesn't
+store another copy. New files are written to storage concurrently, then
+all rows are inserted with a single bulk_create().
+"""
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+
+from .models import Product, ProductImage
+from .signals import mark_image_thumbnails_rendered
+from .thumbnails import schedule_thumbnails
+
+log = logging.getLogger(__name__)
+
+DEFAULT_UPLOAD_THREADS = 8
+
+
+def get_checksum(file: File) -> str:
+    checksum = getattr(file, "sha256", None)
+    if checksum is None:
+        hash = hashlib.sha256()
+        for chunk in file.chunks():
+            hash.update(chunk)
+        checksum = hash.hexdigest()
+    return checksum
+
+
+def save_product_images(product: Product, files: Iterable[File]) -> list[ProductImage]:
+    """
+    Stores the files not already uploaded for `product`
+    and returns the created images
+    """
+    files_by_checksum = {}
+    for file in files:
+        files_by_checksum.setdefault(get_checksum(file), file)
+    existing = set(
+        ProductImage.objects
+        .filter(product=product, checksum__in=files_by_checksum)
+        .values_list("checksum", flat=True)
+    )
+    images = [
+        (ProductImage(product=product, checksum=checksum), file)
+        for checksum, file in files_by_checksum.items()
+        if checksum not in existing
+    ]
+    if not images:
+        return []
+
+    store_files(images)
+    images = [image for image, _ in images]
+    stored = {image.image.name for image in images}
+    try:
+        with transaction.atomic():
+            # a concurrent upload of the same file may have won the race
+            ProductImage.objects.bulk_create(images, ignore_conflicts=True)
+            saved = dict(
+                ProductImage.objects
+                .filter(product=product, checksum__in=[image.checksum for image in images])
+                .values_list("checksum", "image")
+            )
+    except Exception:
+        delete_files(stored)
+        raise
+
+    delete_files(stored - set(saved.values()))
+    created = [image for image in images if saved.get(image.checksum) == image.image.name]
+    for image in created:
+        schedule_thumbnails(image.image.name, mark_image_thumbnails_rendered)
+    return created
+
+
+def store_files(images: list[tuple[ProductImage, File]]) -> None:
+    # storage writes are I/O bound, threads are enough
+    threads = getattr(settings, "PRODUCT_IMAGE_UPLOAD_THREADS", DEFAULT_UPLOAD_THREADS)
+    with ThreadPoolExecutor(max_workers=max(1, min(threads, len(images)))) as executor:
+        futures = [
+            executor.submit(image.image.save, file.name, file, save=False)
+            for image, file in images
+        ]
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if errors:
+        delete_files(image.image.name for image, _ in images if image.image.name)
+        raise errors[0]
+
+
+def delete_files(names: Iterable[str]) -> None:
+    storage = ProductImage._meta.get_field("image").storage
+    for name in names:
+        try:
+            storage.delete(name)
+        except OSError:
+            log.warning("Could not delete %s", name, exc_info=True)
@@ -19,10 +19,12 @@ class Command(BaseCommand):
         #     count=Count("id"),
         # )
         # print(result)
-        orders = Order.objects.annotate(
-            total=Sum("products__price", default=0),
-            products_count=Count("products"),
-        )
+        # orders = Order.objects.annotate(
+        #     total=Sum("products__price", default=0),
+        #     products_count=Count("products"),
+        # )
+        # totals are stored on the order, see shopapp.order_totals
+        orders = Order.objects.only("id", "total", "products_count")
         for order in orders:
             print(f"Order #{order.id} "
                   f"with {order.products_count} "
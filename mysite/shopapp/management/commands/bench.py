@@ -0,0 +1,279 @@
+import json
+import platform
+import statistics
+import subprocess
+import tempfile
+import threading
+import tracemalloc
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from pathlib import Path
+from random import Random
+from time import perf_counter
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand
+from django.db import OperationalError, connection, connections, reset_queries, transaction
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext,
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+from mysite.backends.cache import TieredCache
+from mysite.routers import READ_ONLY_ALIAS
+from shopapp.models import Product
+from shopapp.seeding import DataSeeder
+
+# label, url name, whether the endpoint needs a logged in user
+ENDPOINTS = [
+    ("ProductsListView", "shopapp:products_list", False),
+    ("OrdersListView", "shopapp:orders_list", True),
+    ("ProductViewSet.list", "shopapp:product-list", False),
+    ("ProductViewSet.download_csv", "shopapp:product-download-csv", False),
+    ("ArticlesListView", "blogapp:articles", False),
+]
+
+
+class BackgroundWriters:
+    """
+    Threads updating product prices in short transactions until
+    the block exits, to measure readers under write contention
+    """
+
+    def __init__(self, count: int, product_ids: list[int]):
+        self.count = count
+        self.product_ids = product_ids
+        self.stop = threading.Event()
+        self.threads = []
+        self.writes = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        for number in range(self.count):
+            thread = threading.Thread(target=self.write, args=(Random(number),), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop.set()
+        for thread in self.threads:
+            thread.join()
+
+    def write(self, random: Random) -> None:
+        try:
+            while not self.stop.is_set():
+                try:
+                    with transaction.atomic():
+                        Product.objects.filter(pk=random.choice(self.product_ids)).update(
+                            price=round(random.uniform(1, 5000), 2),
+                        )
+                except OperationalError:
+                    with self.lock:
+                        self.errors += 1
+                else:
+                    with self.lock:
+                        self.writes += 1
+        finally:
+            connection.close()
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks views and API endpoints against a throwaway database
+    seeded at increasing scales
+    """
+    help = "Measure endpoint latency, query count and peak memory at several data scales"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scales",
+            nargs="+",
+            type=int,
+            default=[10_000, 100_000],
+            help="number of products to seed for each run, e.g. 10000 100000 1000000",
+        )
+        parser.add_argument("--requests", type=int, default=20, help="timed requests per endpoint")
+        parser.add_argument("--warmup", type=int, default=2, help="untimed requests per endpoint")
+        parser.add_argument(
+            "--endpoints",
+            nargs="+",
+            choices=[label for label, _, _ in ENDPOINTS],
+            help="only benchmark these endpoints",
+        )
+        parser.add_argument("--output", default="bench.json", help="where to write the JSON results")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--writers",
+            type=int,
+            default=0,
+            help="threads updating product prices while the endpoints are timed",
+        )
+        parser.add_argument(
+            "--journal-mode",
+            choices=["wal", "delete"],
+            help="override the journal_mode pragma, e.g. to compare read/write contention with and without WAL",
+        )
+
+    def handle(self, *args, **options):
+        endpoints = [
+            endpoint for endpoint in ENDPOINTS
+            if not options["endpoints"] or endpoint[0] in options["endpoints"]
+        ]
+        results = []
+        with tempfile.TemporaryDirectory() as directory, override_settings(**self.get_settings(Path(directory))):
+            old_name = self.create_database(Path(directory) / "bench.sqlite3", options["journal_mode"])
+            # DEBUG would log every query and enable the debug toolbar
+            setup_test_environment(debug=False)
+            try:
+                user = User.objects.create_superuser(username="bench", password="bench")
+                seeder = DataSeeder(seed=options["seed"])
+                seeded = 0
+                for scale in sorted(options["scales"]):
+                    self.stdout.write(f"Seeding {scale} products")
+                    self.seed(seeder, scale - seeded)
+                    seeded = scale
+                    for label, url_name, login in endpoints:
+                        with BackgroundWriters(options["writers"], seeder.product_ids) as writers:
+                            result = self.measure(url_name, user if login else None, options)
+                        if options["writers"]:
+                            result.update(writes=writers.writes, write_errors=writers.errors)
+                        results.append({"scale": scale, "endpoint": label, **result})
+                        self.write_result(results[-1])
+            finally:
+                teardown_test_environment()
+                self.destroy_database(old_name)
+
+        report = {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "commit": self.get_commit(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "options": {
+                "scales": options["scales"],
+                "requests": options["requests"],
+                "warmup": options["warmup"],
+                "seed": options["seed"],
+                "writers": options["writers"],
+                "journal_mode": options["journal_mode"],
+            },
+            "results": results,
+        }
+        Path(options["output"]).write_text(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def create_database(self, path: Path, journal_mode: str = None) -> str:
+        if journal_mode:
+            for alias in connections:
+                options = connections[alias].settings_dict["OPTIONS"]
+                options["pragmas"] = {**options.get("pragmas", {}), "journal_mode": journal_mode}
+        old_name = connection.settings_dict["NAME"]
+        connection.settings_dict["TEST"]["NAME"] = str(path)
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        # GET requests read through the replica alias, point it to the same file
+        if READ_ONLY_ALIAS in connections:
+            connections[READ_ONLY_ALIAS].close()
+            connections[READ_ONLY_ALIAS].settings_dict["NAME"] = str(path)
+        return old_name
+
+    def get_settings(self, directory: Path) -> dict:
+        """
+        Settings of the run: the same cache backends, but not the pages
+        cached from the real database, and metrics kept apart
+        """
+        caches = {
+            alias: {**config, "LOCATION": directory / f"cache-{alias}.sqlite3"}
+            if issubclass(import_string(config["BACKEND"]), TieredCache) else config
+            for alias, config in settings.CACHES.items()
+        }
+        return {"CACHES": caches, "METRICS_LOCATION": directory / "metrics.sqlite3"}
+
+    def destroy_database(self, old_name: str) -> None:
+        if READ_ONLY_ALIAS in connections:
+            connections[READ_ONLY_ALIAS].close()
+            connections[READ_ONLY_ALIAS].settings_dict["NAME"] = old_name
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self, seeder: DataSeeder, count: int) -> None:
+        seeder.run(
+            users=max(count // 100, 1),
+            products=count,
+            orders=max(count // 10, 1),
+            articles=max(count // 10, 1),
+        )
+
+    def request(self, client: Client, url: str) -> None:
+        response = client.get(url)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+
+    def measure(self, url_name: str, user, options) -> dict:
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        url = reverse(url_name)
+
+        for _ in range(options["warmup"]):
+            self.request(client, url)
+
+        timings = []
+        for _ in range(options["requests"]):
+            start = perf_counter()
+            self.request(client, url)
+            timings.append((perf_counter() - start) * 1000)
+
+        reset_queries()
+        with ExitStack() as stack:
+            queries = [
+                stack.enter_context(CaptureQueriesContext(connections[alias]))
+                for alias in connections
+            ]
+            self.request(client, url)
+        # the next request resets the query log, count them now
+        query_count = sum(len(captured) for captured in queries)
+
+        tracemalloc.start()
+        try:
+            self.request(client, url)
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        percentiles = statistics.quantiles(timings, n=100, method="inclusive")
+        return {
+            "p50_ms": round(percentiles[49], 3),
+            "p95_ms": round(percentiles[94], 3),
+            "p99_ms": round(percentiles[98], 3),
+            "mean_ms": round(statistics.fmean(timings), 3),
+            "queries": query_count,
+            "peak_memory_kb": round(peak_memory / 1024, 1),
+        }
+
+    def write_result(self, result: dict) -> None:
+        self.stdout.write(
+            f"{result['scale']:>9} {result['endpoint']:<28} "
+            f"p50 {result['p50_ms']:>9.2f}ms  p95 {result['p95_ms']:>9.2f}ms  "
+            f"p99 {result['p99_ms']:>9.2f}ms  {result['queries']:>3} queries  "
+            f"{result['peak_memory_kb']:>10.1f} KiB"
+            + (f"  {result['writes']} writes, {result['write_errors']} failed" if "writes" in result else "")
+        )
+
+    def get_commit(self):
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "HEAD"],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
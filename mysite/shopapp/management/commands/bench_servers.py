@@ -0,0 +1,218 @@
+import asyncio
+import json
+import platform
+import statistics
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from io import BytesIO
+from pathlib import Path
+from time import perf_counter
+from wsgiref.util import setup_testing_defaults
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from blogapp.models import Article
+from shopapp.management.commands.bench import Command as BenchCommand
+from shopapp.models import Product
+from shopapp.seeding import DataSeeder
+
+# label, url name, pk needed by the url
+ENDPOINTS = [
+    ("ProductsDataExportView", "shopapp:products-export", None),
+    ("ProductDetailsView", "shopapp:product_details", "product"),
+    ("ArticlesListView", "blogapp:articles", None),
+    ("ArticleDetailView", "blogapp:article", "article"),
+    ("LatestArticlesFeed", "blogapp:articles-feed", None),
+    ("FooBarView", "myauth:foo-bar", None),
+]
+SERVERS = ("wsgi", "asgi")
+
+
+class Command(BenchCommand):
+    """
+    Serves the async read endpoints through Django's WSGI handler from a
+    thread pool, like a gunicorn gthread worker, and through its ASGI
+    handler on an event loop, both in this process, many requests at once
+    """
+    help = "Compare WSGI threads and ASGI throughput and latency at high concurrency"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scale", type=int, default=10_000, help="number of products to seed")
+        parser.add_argument("--requests", type=int, default=500, help="timed requests per endpoint and server")
+        parser.add_argument("--concurrency", type=int, default=100, help="requests in flight at once")
+        parser.add_argument("--threads", type=int, default=8, help="WSGI threads, as gunicorn --threads")
+        parser.add_argument("--servers", nargs="+", choices=SERVERS, default=list(SERVERS))
+        parser.add_argument(
+            "--endpoints",
+            nargs="+",
+            choices=[label for label, _, _ in ENDPOINTS],
+            help="only benchmark these endpoints",
+        )
+        parser.add_argument("--output", default="bench_servers.json", help="where to write the JSON results")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        endpoints = [
+            endpoint for endpoint in ENDPOINTS
+            if not options["endpoints"] or endpoint[0] in options["endpoints"]
+        ]
+        # the toolbar middleware is sync only and would put every ASGI
+        # request back on a thread, it's never enabled in production
+        middleware = [name for name in settings.MIDDLEWARE if not name.startswith("debug_toolbar.")]
+        results = []
+        with tempfile.TemporaryDirectory() as directory, override_settings(**self.get_settings(Path(directory))):
+            old_name = self.create_database(Path(directory) / "bench.sqlite3")
+            setup_test_environment(debug=False)
+            try:
+                with override_settings(MIDDLEWARE=middleware):
+                    User.objects.create_superuser(username="bench", password="bench")
+                    self.stdout.write(f"Seeding {options['scale']} products")
+                    self.seed(DataSeeder(seed=options["seed"]), options["scale"])
+                    pks = {
+                        "product": Product.objects.order_by("pk").values_list("pk", flat=True).first(),
+                        "article": Article.objects.order_by("pk").values_list("pk", flat=True).first(),
+                    }
+                    for label, url_name, pk in endpoints:
+                        url = reverse(url_name, kwargs={"pk": pks[pk]} if pk else {})
+                        for server in options["servers"]:
+                            result = self.measure_server(server, url, options)
+                            results.append({"endpoint": label, "server": server, **result})
+                            self.write_result(results[-1])
+            finally:
+                teardown_test_environment()
+                self.destroy_database(old_name)
+
+        report = {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "commit": self.get_commit(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "options": {
+                "scale": options["scale"],
+                "requests": options["requests"],
+                "concurrency": options["concurrency"],
+                "threads": options["threads"],
+                "seed": options["seed"],
+            },
+            "results": results,
+        }
+        Path(options["output"]).write_text(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def measure_server(self, server: str, url: str, options) -> dict:
+        if server == "wsgi":
+            timings, errors, elapsed = self.run_wsgi(url, options)
+        else:
+            timings, errors, elapsed = asyncio.run(self.run_asgi(url, options))
+        percentiles = statistics.quantiles(timings, n=100, method="inclusive")
+        return {
+            "requests_per_second": round(len(timings) / elapsed, 1),
+            "p50_ms": round(percentiles[49], 3),
+            "p95_ms": round(percentiles[94], 3),
+            "p99_ms": round(percentiles[98], 3),
+            "errors": errors,
+        }
+
+    def run_wsgi(self, url: str, options) -> tuple[list[float], int, float]:
+        handler = WSGIHandler()
+        in_flight = threading.Semaphore(options["concurrency"])
+        timings = []
+        errors = 0
+        lock = threading.Lock()
+
+        def request(queued_at: float) -> None:
+            nonlocal errors
+            status = wsgi_request(handler, url)
+            with lock:
+                # time spent waiting for a free thread counts, as behind gunicorn
+                timings.append((perf_counter() - queued_at) * 1000)
+                if status != 200:
+                    errors += 1
+
+        start = perf_counter()
+        with ThreadPoolExecutor(max_workers=options["threads"]) as executor:
+            for _ in range(options["requests"]):
+                in_flight.acquire()
+                future = executor.submit(request, perf_counter())
+                future.add_done_callback(lambda _: in_flight.release())
+        return timings, errors, perf_counter() - start
+
+    async def run_asgi(self, url: str, options) -> tuple[list[float], int, float]:
+        handler = ASGIHandler()
+        in_flight = asyncio.Semaphore(options["concurrency"])
+
+        async def request() -> tuple[float, int]:
+            async with in_flight:
+                started_at = perf_counter()
+                status = await asgi_request(handler, url)
+                return (perf_counter() - started_at) * 1000, status
+
+        start = perf_counter()
+        responses = await asyncio.gather(*(request() for _ in range(options["requests"])))
+        elapsed = perf_counter() - start
+        return [timing for timing, _ in responses], sum(status != 200 for _, status in responses), elapsed
+
+    def write_result(self, result: dict) -> None:
+        self.stdout.write(
+            f"{result['endpoint']:<24} {result['server']:<5} "
+            f"{result['requests_per_second']:>9.1f} req/s  p50 {result['p50_ms']:>9.2f}ms  "
+            f"p95 {result['p95_ms']:>9.2f}ms  p99 {result['p99_ms']:>9.2f}ms  {result['errors']} errors"
+        )
+
+
+def wsgi_request(handler: WSGIHandler, url: str) -> int:
+    environ = {}
+    setup_testing_defaults(environ)
+    environ.update(PATH_INFO=url, HTTP_HOST="testserver", SERVER_NAME="testserver", **{"wsgi.input": BytesIO()})
+    statuses = []
+
+    def start_response(status, headers, exc_info=None):
+        statuses.append(int(status.split()[0]))
+
+    response = handler(environ, start_response)
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    return statuses[0]
+
+
+async def asgi_request(handler: ASGIHandler, url: str) -> int:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": url,
+        "raw_path": url.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"testserver")],
+        "client": ("127.0.0.1", 0),
+        "server": ("testserver", 80),
+    }
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+    statuses = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # the client never disconnects
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    await handler(scope, receive, send)
+    return statuses[0]
@@ -24,6 +24,5 @@ class Command(BaseCommand):
             promocode="promo5",
             user=user,
         )
-        for product in products:
-            order.products.add(product)
+        order.add_products(products.values_list("pk", flat=True))
         self.stdout.write(f"Created order {order}")
@@ -0,0 +1,65 @@
+from django.core.management import BaseCommand, CommandError
+
+from shopapp.models import Order
+from shopapp.order_totals import annotate_computed_totals, refresh_order_totals
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the stored order totals and checks them against the products
+    """
+    help = "Rebuild and verify products_count/total/discounted_total of orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="only verify the stored totals, don't rebuild them",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if not options["check"]:
+            self.stdout.write("Rebuild order totals")
+            updated = 0
+            for first_pk, last_pk in self.iter_pk_ranges(batch_size):
+                updated += refresh_order_totals(
+                    Order.objects.filter(pk__gte=first_pk, pk__lte=last_pk),
+                )
+            self.stdout.write(f"Updated {updated} orders")
+
+        self.stdout.write("Verify order totals")
+        mismatches = 0
+        orders = annotate_computed_totals(Order.objects.order_by("pk")).values(
+            "pk",
+            "products_count",
+            "total",
+            "discounted_total",
+            "computed_products_count",
+            "computed_total",
+            "computed_discounted_total",
+        )
+        for order in orders.iterator(chunk_size=batch_size):
+            for field in ("products_count", "total", "discounted_total"):
+                if order[field] != order[f"computed_{field}"]:
+                    mismatches += 1
+                    self.stdout.write(
+                        f"Order #{order['pk']}: {field} is {order[field]}, "
+                        f"expected {order[f'computed_{field}']}"
+                    )
+                    break
+
+        if mismatches:
+            raise CommandError(f"{mismatches} orders have stale totals")
+        self.stdout.write(self.style.SUCCESS("Order totals are consistent"))
+
+    def iter_pk_ranges(self, batch_size: int):
+        pks = Order.objects.order_by("pk").values_list("pk", flat=True)
+        last_pk = 0
+        while True:
+            batch = list(pks.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return
+            yield batch[0], batch[-1]
+            last_pk = batch[-1]
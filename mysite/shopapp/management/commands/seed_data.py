@@ -0,0 +1,64 @@
+from datetime import timezone
+from time import perf_counter
+
+from django.core.management import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware
+
+from shopapp.seeding import SEED_BATCH_SIZE, SEED_REFERENCE_TIME, DataSeeder
+
+
+class Command(BaseCommand):
+    """
+    Fills the database with reproducible synthetic users, products,
+    orders and articles
+    """
+    help = "Generate large amounts of deterministic test data"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--products", type=int, default=10_000)
+        parser.add_argument("--orders", type=int, default=10_000)
+        parser.add_argument("--articles", type=int, default=1000)
+        parser.add_argument("--max-products-per-order", type=int, default=10)
+        parser.add_argument("--seed", type=int, default=0, help="same seed, same data")
+        parser.add_argument("--batch-size", type=int, default=SEED_BATCH_SIZE)
+        parser.add_argument(
+            "--password",
+            help="password of the generated users, they can't log in without one",
+        )
+        parser.add_argument("--database", default="default")
+        parser.add_argument(
+            "--reference-time",
+            default=SEED_REFERENCE_TIME.isoformat(),
+            help="ISO 8601 date and time the seeded dates go back from, UTC if no offset is given",
+        )
+
+    def handle(self, *args, **options):
+        reference_time = parse_datetime(options["reference_time"])
+        if reference_time is None:
+            raise CommandError(f"Invalid --reference-time: {options['reference_time']}")
+        if is_naive(reference_time):
+            reference_time = make_aware(reference_time, timezone.utc)
+        seeder = DataSeeder(
+            seed=options["seed"],
+            batch_size=options["batch_size"],
+            using=options["database"],
+            password=options["password"],
+            on_progress=self.write_progress if options["verbosity"] > 1 else None,
+            reference_time=reference_time,
+        )
+        start = perf_counter()
+        created = seeder.run(
+            users=options["users"],
+            products=options["products"],
+            orders=options["orders"],
+            articles=options["articles"],
+            max_products_per_order=options["max_products_per_order"],
+        )
+        for name, count in created.items():
+            self.stdout.write(f"Created {count} {name}")
+        self.stdout.write(self.style.SUCCESS(f"Data seeded in {perf_counter() - start:.1f}s"))
+
+    def write_progress(self, label: str, count: int) -> None:
+        self.stdout.write(f"  {count} {label}")
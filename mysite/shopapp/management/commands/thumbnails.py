@@ -0,0 +1,72 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from shopapp.models import Product, ProductImage
+from shopapp.thumbnails import has_thumbnails, init_worker, render_thumbnails
+from shopapp.utils import iter_chunks
+
+
+def render_thumbnails_or_error(name: str) -> tuple[str, Optional[str]]:
+    try:
+        render_thumbnails(name)
+    except Exception as exc:
+        return name, f"{type(exc).__name__}: {exc}"
+    return name, None
+
+
+class Command(BaseCommand):
+    """
+    Renders the missing thumbnails of product previews and images
+    """
+    help = "Backfill thumbnails of existing product images in parallel"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=getattr(settings, "THUMBNAIL_WORKERS", None) or None,
+            help="worker processes, defaults to THUMBNAIL_WORKERS",
+        )
+        parser.add_argument("--force", action="store_true", help="render existing thumbnails again")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        # names whose thumbnails exist but aren't flagged are only marked
+        marked = []
+        names = self.iter_names(options["force"], marked)
+        rendered = []
+        errors = 0
+        with ProcessPoolExecutor(max_workers=options["workers"], initializer=init_worker) as executor:
+            for name, error in executor.map(render_thumbnails_or_error, names, chunksize=8):
+                if error is None:
+                    rendered.append(name)
+                    if options["verbosity"] > 1:
+                        self.stdout.write(f"Rendered {name}")
+                else:
+                    errors += 1
+                    self.stderr.write(f"Could not render {name}: {error}")
+
+        # also expires the cached pages showing them
+        for batch in iter_chunks(rendered + marked, options["batch_size"]):
+            Product.objects.filter(preview__in=batch).update(preview_thumbnails_rendered=True)
+            ProductImage.objects.filter(image__in=batch).update(image_thumbnails_rendered=True)
+
+        self.stdout.write(self.style.SUCCESS(f"Rendered thumbnails of {len(rendered)} images, {errors} failed"))
+
+    def iter_names(self, force: bool, marked: list) -> Iterator[str]:
+        previews = (
+            Product.objects
+            .exclude(preview="")
+            .exclude(preview=None)
+            .values_list("preview", "preview_thumbnails_rendered")
+        )
+        images = ProductImage.objects.values_list("image", "image_thumbnails_rendered")
+        for queryset in (previews, images):
+            for name, flagged in queryset.order_by("pk").iterator():
+                if force or not has_thumbnails(name):
+                    yield name
+                elif not flagged:
+                    marked.append(name)
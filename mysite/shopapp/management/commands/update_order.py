@@ -12,8 +12,7 @@ class Command(BaseCommand):
 
         products = Product.objects.all()
 
-        for product in products:
-            order.products.add(product)
+        order.add_products(products.values_list("pk", flat=True))
 
         order.save()
 
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+FTS_TABLE = "shopapp_product_fts"
+
+
+def create_product_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    from shopapp.search import ensure_product_fts, rebuild_product_fts
+
+    if ensure_product_fts(schema_editor.connection.alias):
+        rebuild_product_fts(schema_editor.connection.alias)
+
+
+def drop_product_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for suffix in ("ai", "ad", "au"):
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+    schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0012_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_product_fts, drop_product_fts),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2 on 2026-10-18 10:27
+
+from django.db import migrations, models
+from django.db.models import (
+    Count,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    IntegerField,
+    OuterRef,
+    Subquery,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Cast, Coalesce, Round
+
+
+def fill_order_totals(apps, schema_editor):
+    Order = apps.get_model("shopapp", "Order")
+    Product = apps.get_model("shopapp", "Product")
+    total_field = DecimalField(max_digits=12, decimal_places=2)
+    products = Product.objects.filter(orders=OuterRef("pk")).order_by().values("orders")
+    # whole cents and integer sums as shopapp.order_totals does
+    price_cents = Cast(Round(F("price") * 100), IntegerField())
+    discounted_cents = (Sum(price_cents * (100 - F("discount"))) + 50) / 100
+    Order.objects.update(
+        products_count=Coalesce(Subquery(products.annotate(value=Count("pk")).values("value")), 0),
+        total=Coalesce(
+            Subquery(products.annotate(value=Sum("price")).values("value"), output_field=total_field),
+            Value(0),
+            output_field=total_field,
+        ),
+        discounted_total=Coalesce(
+            ExpressionWrapper(
+                Subquery(products.annotate(value=discounted_cents).values("value")) / 100.0,
+                output_field=total_field,
+            ),
+            Value(0),
+            output_field=total_field,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0013_product_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='discounted_total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='products_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.RunPython(fill_order_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2 on 2026-10-18 10:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0015_product_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='checksum',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='productimage',
+            constraint=models.UniqueConstraint(condition=models.Q(('checksum', ''), _negated=True), fields=('product', 'checksum'), name='productimage_product_checksum_uniq'),
+        ),
+    ]
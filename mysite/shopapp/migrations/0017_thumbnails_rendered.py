@@ -0,0 +1,40 @@
+# Generated by Django 4.2 on 2026-10-18 11:15
+
+from django.db import migrations, models
+
+
+def flag_rendered_thumbnails(apps, schema_editor):
+    from shopapp.thumbnails import has_thumbnails
+
+    Product = apps.get_model("shopapp", "Product")
+    ProductImage = apps.get_model("shopapp", "ProductImage")
+    using = schema_editor.connection.alias
+    previews = Product.objects.using(using).exclude(preview="").exclude(preview=None)
+    for name in set(previews.values_list("preview", flat=True)):
+        if has_thumbnails(name):
+            previews.filter(preview=name).update(preview_thumbnails_rendered=True)
+    images = ProductImage.objects.using(using)
+    for name in set(images.values_list("image", flat=True)):
+        if has_thumbnails(name):
+            images.filter(image=name).update(image_thumbnails_rendered=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0016_productimage_checksum'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='preview_thumbnails_rendered',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='image_thumbnails_rendered',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(flag_rendered_thumbnails, migrations.RunPython.noop),
+    ]
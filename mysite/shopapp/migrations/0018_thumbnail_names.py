@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-18 12:05
+
+from django.db import migrations
+
+
+def unflag_renamed_thumbnails(apps, schema_editor):
+    # thumbnail names now keep the extension of the original, those
+    # rendered before are missing until `manage.py thumbnails` runs
+    from shopapp.thumbnails import has_thumbnails
+
+    Product = apps.get_model("shopapp", "Product")
+    ProductImage = apps.get_model("shopapp", "ProductImage")
+    using = schema_editor.connection.alias
+    previews = Product.objects.using(using).filter(preview_thumbnails_rendered=True)
+    for name in set(previews.values_list("preview", flat=True)):
+        if not has_thumbnails(name):
+            previews.filter(preview=name).update(preview_thumbnails_rendered=False)
+    images = ProductImage.objects.using(using).filter(image_thumbnails_rendered=True)
+    for name in set(images.values_list("image", flat=True)):
+        if not has_thumbnails(name):
+            images.filter(image=name).update(image_thumbnails_rendered=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0017_thumbnails_rendered'),
+    ]
+
+    operations = [
+        migrations.RunPython(unflag_renamed_thumbnails, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,14 @@
-from typing import TYPE_CHECKING
+from typing import Iterable
 
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models import Manager
+from django.db import models, transaction
+from django.db.models.signals import m2m_changed
+from django.utils import timezone
+
+from .generations import GenerationQuerySet
+from .utils import iter_chunks
+
+ORDER_PRODUCTS_BATCH_SIZE = 500
 
 
 def product_preview_directory_path(instance: "Product", filename: str) -> str:
@@ -12,24 +18,66 @@ def product_preview_directory_path(instance: "Product", filename: str) -> str:
     )
 
 
+class ProductQuerySet(GenerationQuerySet):
+    """
+    Keeps `updated_at` current and refreshes the totals of affected
+    orders when products change in bulk
+    """
+    price_fields = {"price", "discount"}
+
+    def update(self, **kwargs):
+        kwargs.setdefault("updated_at", timezone.now())
+        if self.price_fields.isdisjoint(kwargs):
+            return super().update(**kwargs)
+        product_ids = list(self.values_list("pk", flat=True))
+        rows = super().update(**kwargs)
+        from .order_totals import refresh_orders_with_products
+
+        refresh_orders_with_products(product_ids)
+        return rows
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        # auto_now is only applied by save()
+        objs = list(objs)
+        now = timezone.now()
+        for obj in objs:
+            obj.updated_at = now
+        fields = [*fields, "updated_at"] if "updated_at" not in fields else fields
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        if not self.price_fields.isdisjoint(fields):
+            from .order_totals import refresh_orders_with_products
+
+            refresh_orders_with_products([obj.pk for obj in objs])
+        return rows
+
+
 class Product(models.Model):
     class Meta:
         ordering = ["name", "price"]
+        indexes = [
+            # keyset pagination seeks on the ordering fields plus pk
+            models.Index(fields=["name", "price", "id"], name="product_name_price_id_idx"),
+            models.Index(fields=["price", "id"], name="product_price_id_idx"),
+            models.Index(fields=["discount", "id"], name="product_discount_id_idx"),
+        ]
 
     name = models.CharField(max_length=100, db_index=True)
     description = models.TextField(null=False, blank=True, db_index=True)
     price = models.DecimalField(default=0, max_digits=8, decimal_places=2)
     discount = models.SmallIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    # versions the cached template fragments of the product
+    updated_at = models.DateTimeField(auto_now=True)
     archived = models.BooleanField(default=False)
     preview = models.ImageField(null=True, blank=True, upload_to=product_preview_directory_path)
+    # set once the thumbnails of the preview are stored, see shopapp.thumbnails
+    preview_thumbnails_rendered = models.BooleanField(default=False, editable=False)
+
+    objects = ProductQuerySet.as_manager()
 
     def __str__(self):
         return f"Product(pk={self.pk}, name={self.name!r})"
 
-    if TYPE_CHECKING:
-        objects: Manager
-
 def product_images_directory_path(instance: "ProductImage", filename: str) -> str:
     return "products/product_{pk}/images/{filename}".format(
         pk=instance.product.pk,
@@ -38,9 +86,25 @@ def product_images_directory_path(instance: "ProductImage", filename: str) -> st
 
 
 class ProductImage(models.Model):
+    class Meta:
+        constraints = [
+            # the same file is stored once per product, images saved
+            # before checksums existed have an empty one
+            models.UniqueConstraint(
+                fields=["product", "checksum"],
+                condition=~models.Q(checksum=""),
+                name="productimage_product_checksum_uniq",
+            ),
+        ]
+
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="images")
     image = models.ImageField(upload_to=product_images_directory_path)
     description = models.CharField(max_length=200, null=False, blank=True)
+    # SHA-256 of the file, see shopapp.images
+    checksum = models.CharField(max_length=64, blank=True, editable=False)
+    image_thumbnails_rendered = models.BooleanField(default=False, editable=False)
+
+    objects = GenerationQuerySet.as_manager()
 
 
 class Order(models.Model):
@@ -50,3 +114,52 @@ class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.PROTECT)
     products = models.ManyToManyField(Product, related_name="orders")
     receipt = models.FileField(null=True, upload_to='orders/receipts/')
+    # kept up to date by shopapp.order_totals
+    products_count = models.PositiveIntegerField(default=0, editable=False)
+    total = models.DecimalField(default=0, max_digits=12, decimal_places=2, editable=False)
+    discounted_total = models.DecimalField(default=0, max_digits=12, decimal_places=2, editable=False)
+
+    def add_products(self, product_ids: Iterable[int], batch_size: int = ORDER_PRODUCTS_BATCH_SIZE) -> None:
+        """
+        Links many products at once: the through rows are inserted
+        in batches, existing links are skipped, and a single
+        pre_add/post_add m2m_changed pair is sent for the products
+        actually added
+        """
+        self._change_products("add", product_ids, batch_size)
+
+    def remove_products(self, product_ids: Iterable[int], batch_size: int = ORDER_PRODUCTS_BATCH_SIZE) -> None:
+        self._change_products("remove", product_ids, batch_size)
+
+    def _change_products(self, action: str, product_ids: Iterable[int], batch_size: int) -> None:
+        requested = set(product_ids)
+        if not requested:
+            return
+        through = Order.products.through
+        links = through.objects.using(self._state.db).filter(order_id=self.pk)
+        with transaction.atomic(using=self._state.db):
+            # like ManyRelatedManager.add(), receivers only get the real change
+            linked = set()
+            for batch in iter_chunks(sorted(requested), batch_size):
+                linked.update(links.filter(product_id__in=batch).values_list("product_id", flat=True))
+            pk_set = requested - linked if action == "add" else requested & linked
+            if not pk_set:
+                return
+            signal_kwargs = {
+                "sender": through,
+                "instance": self,
+                "reverse": False,
+                "model": Product,
+                "pk_set": pk_set,
+                "using": self._state.db,
+            }
+            m2m_changed.send(action=f"pre_{action}", **signal_kwargs)
+            for batch in iter_chunks(sorted(pk_set), batch_size):
+                if action == "add":
+                    through.objects.using(self._state.db).bulk_create(
+                        [through(order_id=self.pk, product_id=product_id) for product_id in batch],
+                        ignore_conflicts=True,
+                    )
+                else:
+                    links.filter(product_id__in=batch).delete()
+            m2m_changed.send(action=f"post_{action}", **signal_kwargs)
@@ -0,0 +1,73 @@
+"""
+Denormalized order totals.
+
+`Order.products_count`, `Order.total` and `Order.discounted_total` are
+stored on the order and refreshed with a single UPDATE whenever the
+order's products or their prices change (see shopapp.signals), so order
+lists don't have to join and aggregate the whole M2M table.
+"""
+from django.db.models import (
+    Count,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    IntegerField,
+    OuterRef,
+    QuerySet,
+    Subquery,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Cast, Coalesce, Round
+
+from .models import Order, Product
+
+TOTAL_FIELD = DecimalField(max_digits=12, decimal_places=2)
+
+
+def order_totals_expressions() -> dict:
+    products = (
+        Product.objects
+        .filter(orders=OuterRef("pk"))
+        .order_by()
+        .values("orders")
+    )
+    # SQLite has no decimal arithmetic: prices become whole cents, the
+    # discounted prices whole hundredths of a cent, and the sum is
+    # rounded half up to cents on integers, so floats never add up money
+    price_cents = Cast(Round(F("price") * 100), IntegerField())
+    discounted_cents = (Sum(price_cents * (100 - F("discount"))) + 50) / 100
+    return {
+        "products_count": Coalesce(
+            Subquery(products.annotate(value=Count("pk")).values("value")),
+            0,
+        ),
+        "total": Coalesce(
+            Subquery(products.annotate(value=Sum("price")).values("value"), output_field=TOTAL_FIELD),
+            Value(0),
+            output_field=TOTAL_FIELD,
+        ),
+        "discounted_total": Coalesce(
+            ExpressionWrapper(
+                Subquery(products.annotate(value=discounted_cents).values("value")) / 100.0,
+                output_field=TOTAL_FIELD,
+            ),
+            Value(0),
+            output_field=TOTAL_FIELD,
+        ),
+    }
+
+
+def refresh_order_totals(orders: QuerySet) -> int:
+    return orders.order_by().update(**order_totals_expressions())
+
+
+def refresh_orders_with_products(product_ids) -> int:
+    return refresh_order_totals(Order.objects.filter(products__in=product_ids).distinct())
+
+
+def annotate_computed_totals(orders: QuerySet) -> QuerySet:
+    return orders.annotate(**{
+        f"computed_{name}": expression
+        for name, expression in order_totals_expressions().items()
+    })
@@ -0,0 +1,166 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from functools import reduce
+from operator import and_, or_
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def get_item_value(item, field: str):
+    if isinstance(item, dict):
+        return item[field]
+    return getattr(item, field)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination: the cursor holds the ordering values
+    of the last item on the page, and the next page is fetched with
+    a WHERE on those values instead of an OFFSET.
+
+    The ordering comes from the view's OrderingFilter (or the model's
+    Meta.ordering) and always ends with `pk`, so rows sharing the same
+    values are never skipped or repeated. The total count is only
+    computed when `?count=1` is passed.
+    """
+    page_size = PageNumberPagination.page_size
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset: QuerySet, request: Request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.page_size = self.get_page_size(request)
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ("1", "true"):
+            self.count = queryset.count()
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(position))
+
+        items = list(queryset[:self.page_size + 1])
+        self.has_next = len(items) > self.page_size
+        self.page = items[:self.page_size]
+        return self.page
+
+    def get_ordering(self, request: Request, queryset: QuerySet, view) -> list[str]:
+        ordering = None
+        for backend in getattr(view, "filter_backends", ()):
+            if issubclass(backend, OrderingFilter):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+        if not ordering:
+            ordering = queryset.model._meta.ordering
+        ordering = [
+            field for field in ordering
+            if field.lstrip("-") not in ("pk", queryset.model._meta.pk.name)
+        ]
+        return [*ordering, "pk"]
+
+    def get_page_size(self, request: Request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_position_filter(self, position: list) -> Q:
+        # (a, b, pk) > (x, y, z) is expanded into
+        # a > x OR (a = x AND b > y) OR (a = x AND b = y AND pk > z)
+        # with ">" flipped to "<" for descending fields
+        conditions = []
+        for index, field in enumerate(self.ordering):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            equal = [
+                Q(**{previous.lstrip("-"): value})
+                for previous, value in zip(self.ordering[:index], position)
+            ]
+            conditions.append(reduce(and_, equal, Q(**{f"{name}__{lookup}": position[index]})))
+        return reduce(or_, conditions)
+
+    def decode_cursor(self, request: Request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode()))
+            ordering, position = cursor["o"], cursor["v"]
+        except (BinasciiError, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if ordering != self.ordering or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, item) -> str:
+        position = [
+            get_item_value(item, field.lstrip("-"))
+            for field in self.ordering
+        ]
+        cursor = json.dumps({"o": self.ordering, "v": position}, cls=DjangoJSONEncoder)
+        return urlsafe_b64encode(cursor.encode()).decode()
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.count_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        response = {
+            "next": self.get_next_link(),
+            "results": data,
+        }
+        if self.count is not None:
+            response = {"count": self.count, **response}
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "count": {"type": "integer"},
+                "next": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
+
+
+class ProductPagination(PageNumberPagination):
+    """
+    Page number pagination by default, keyset pagination as soon as
+    the `cursor` query parameter is present (an empty value starts
+    from the first page)
+    """
+    keyset_pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset: QuerySet, request: Request, view=None):
+        self.keyset = None
+        if self.keyset_pagination_class.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_pagination_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class OrderPagination(PageNumberPagination):
+    page_size_query_param = "page_size"
+    max_page_size = 100
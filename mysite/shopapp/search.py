@@ -0,0 +1,128 @@
+"""
+Full-text search for products backed by an SQLite FTS5 table.
+
+`shopapp_product_fts` is an external-content FTS5 index over
+`shopapp_product.name` and `shopapp_product.description`, kept in sync
+by triggers, so bulk_create() and queryset.update() are indexed too.
+On other databases (or SQLite builds without FTS5) callers fall back
+to the regular `icontains` search.
+"""
+import re
+from typing import Sequence
+
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.db.models import QuerySet
+from rest_framework.filters import SearchFilter
+
+PRODUCT_FTS_TABLE = "shopapp_product_fts"
+
+PRODUCT_FTS_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {PRODUCT_FTS_TABLE} USING fts5(
+        name,
+        description,
+        content='shopapp_product',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {PRODUCT_FTS_TABLE}_ai AFTER INSERT ON shopapp_product BEGIN
+        INSERT INTO {PRODUCT_FTS_TABLE}(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {PRODUCT_FTS_TABLE}_ad AFTER DELETE ON shopapp_product BEGIN
+        INSERT INTO {PRODUCT_FTS_TABLE}({PRODUCT_FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {PRODUCT_FTS_TABLE}_au AFTER UPDATE OF name, description ON shopapp_product BEGIN
+        INSERT INTO {PRODUCT_FTS_TABLE}({PRODUCT_FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {PRODUCT_FTS_TABLE}(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+]
+
+_fts_enabled = {}
+
+
+def ensure_product_fts(using: str = DEFAULT_DB_ALIAS) -> bool:
+    """
+    Creates the FTS table and its triggers if they are missing.
+
+    SQLite migrations that rebuild `shopapp_product` drop its triggers,
+    so this runs after every migrate. Returns False when FTS5 can't be used.
+    """
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return False
+    try:
+        with connection.cursor() as cursor:
+            for sql in PRODUCT_FTS_SQL:
+                cursor.execute(sql)
+    except OperationalError:
+        return False
+    return True
+
+
+def rebuild_product_fts(using: str = DEFAULT_DB_ALIAS) -> None:
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"INSERT INTO {PRODUCT_FTS_TABLE}({PRODUCT_FTS_TABLE}) VALUES ('rebuild')")
+
+
+def fts_enabled(using: str = DEFAULT_DB_ALIAS) -> bool:
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return False
+    cache_key = (using, str(connection.settings_dict["NAME"]))
+    if cache_key not in _fts_enabled:
+        _fts_enabled[cache_key] = PRODUCT_FTS_TABLE in connection.introspection.table_names()
+    return _fts_enabled[cache_key]
+
+
+def build_match_query(terms: Sequence[str]) -> str:
+    # every word must match, each one as a prefix: "lapt" finds "laptop"
+    words = [
+        word
+        for term in terms
+        for word in re.findall(r"\w+", term)
+    ]
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search_products(queryset: QuerySet, terms: Sequence[str]) -> QuerySet:
+    """
+    Filters products matching all `terms` and orders them by relevance
+    (exposed as the `search_rank` attribute, lower is better)
+    """
+    match = build_match_query(terms)
+    if not match:
+        return queryset
+    table = queryset.model._meta.db_table
+    return queryset.extra(
+        tables=[PRODUCT_FTS_TABLE],
+        where=[
+            f"{PRODUCT_FTS_TABLE}.rowid = {table}.id",
+            f"{PRODUCT_FTS_TABLE} MATCH %s",
+        ],
+        params=[match],
+        select={"search_rank": f"bm25({PRODUCT_FTS_TABLE})"},
+        order_by=["search_rank"],
+    )
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    SearchFilter using the FTS index when it is available
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms or not fts_enabled(queryset.db):
+            return super().filter_queryset(request, queryset, view)
+        return search_products(queryset, terms)
@@ -0,0 +1,305 @@
+"""
+Deterministic synthetic data for load testing and benchmarks.
+
+`DataSeeder` generates users with profiles, products, orders linked to
+products, and articles. Everything is drawn from one `Random(seed)`, so
+the same seed on an empty database always produces the same rows, dates
+included: they are drawn back from a fixed reference time. Rows
+are inserted with batched bulk_create() inside one transaction per
+table. On SQLite, durability pragmas are relaxed for the duration of
+the load (see `sqlite_bulk_load`).
+
+Distributions are skewed like real shop data: a few users place most
+orders, a few products appear in most orders, prices are log-normal and
+most products have no discount.
+"""
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from itertools import accumulate
+from random import Random
+from typing import Callable, Iterable
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from blogapp.models import Article
+from myauth.models import Profile
+
+from .models import Order, Product
+from .order_totals import refresh_order_totals
+from .utils import iter_chunks
+
+log = logging.getLogger(__name__)
+
+SEED_BATCH_SIZE = 5000
+# seeded dates go back from there
+SEED_REFERENCE_TIME = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+# pragmas applied while loading, restored afterwards
+SQLITE_BULK_LOAD_PRAGMAS = {
+    "synchronous": "OFF",
+    "temp_store": "MEMORY",
+    "cache_size": "-262144",
+}
+
+FIRST_NAMES = [
+    "Alex", "Anna", "Boris", "Daria", "Egor", "Elena", "Ivan", "Irina", "Kirill", "Maria",
+    "Nikita", "Olga", "Pavel", "Polina", "Roman", "Sofia", "Timur", "Vera", "Yuri", "Zoya",
+]
+LAST_NAMES = [
+    "Ivanov", "Petrov", "Sidorov", "Smirnov", "Kuznetsov", "Popov", "Volkov", "Sokolov",
+    "Lebedev", "Kozlov", "Novikov", "Morozov", "Pavlov", "Orlov", "Zaitsev", "Belov",
+]
+STREETS = ["Lenina", "Pushkina", "Gagarina", "Mira", "Sadovaya", "Lesnaya", "Ivanova", "Tverskaya"]
+PROMOCODES = ["SALE10", "promo5", "WELCOME", "BLACKFRIDAY", "SUMMER", "VIP25"]
+ADJECTIVES = [
+    "Compact", "Wireless", "Smart", "Portable", "Premium", "Classic", "Ultra", "Pro",
+    "Mini", "Ergonomic", "Silent", "Gaming", "Outdoor", "Vintage", "Modular", "Eco",
+]
+NOUNS = [
+    "Laptop", "Desktop", "Smartphone", "Tablet", "Monitor", "Keyboard", "Mouse", "Headphones",
+    "Speaker", "Camera", "Router", "Printer", "Charger", "Watch", "Backpack", "Lamp",
+    "Kettle", "Blender", "Chair", "Desk", "Jacket", "Sneakers", "Drone", "Projector",
+]
+WORDS = [
+    "quality", "battery", "screen", "design", "light", "fast", "durable", "steel", "glass",
+    "warranty", "color", "size", "delivery", "comfortable", "power", "memory", "storage",
+    "display", "sound", "water", "resistant", "cable", "case", "home", "office", "travel",
+    "premium", "budget", "classic", "modern", "energy", "efficient", "quiet", "compact",
+    "review", "price", "discount", "new", "model", "update", "release", "guide", "tips",
+]
+
+# discount percentages and how often they occur
+DISCOUNTS = [0, 5, 10, 15, 20, 25, 50]
+DISCOUNT_WEIGHTS = [70, 8, 8, 5, 4, 3, 2]
+
+
+def zipf_cum_weights(count: int, exponent: float) -> list[float]:
+    return list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+@contextmanager
+def sqlite_bulk_load(using: str = DEFAULT_DB_ALIAS):
+    """
+    Trades durability for speed on SQLite while the block runs:
+    a crash in the middle of a seed can corrupt the database, which
+    is acceptable for generated data. Does nothing inside a transaction
+    or on other databases.
+    """
+    connection = connections[using]
+    if connection.vendor != "sqlite" or connection.in_atomic_block:
+        yield
+        return
+    with connection.cursor() as cursor:
+        previous = {}
+        for pragma, value in SQLITE_BULK_LOAD_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma}")
+            previous[pragma] = cursor.fetchone()[0]
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            for pragma, value in previous.items():
+                cursor.execute(f"PRAGMA {pragma} = {value}")
+
+
+class DataSeeder:
+    """
+    Generates and inserts synthetic data.
+
+    The seeder remembers the users and products it created, so it can
+    be called several times to grow a dataset step by step (orders only
+    reference users and products created by the same seeder).
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        batch_size: int = SEED_BATCH_SIZE,
+        using: str = DEFAULT_DB_ALIAS,
+        password: str = None,
+        on_progress: Callable[[str, int], None] = None,
+        reference_time: datetime = SEED_REFERENCE_TIME,
+    ):
+        self.random = Random(seed)
+        self.seed = seed
+        self.batch_size = batch_size
+        self.using = using
+        self.password = password
+        self.on_progress = on_progress
+        self.user_ids = []
+        self.product_ids = []
+        self.reference_time = reference_time
+
+    def run(
+        self,
+        users: int = 0,
+        products: int = 0,
+        orders: int = 0,
+        articles: int = 0,
+        max_products_per_order: int = 10,
+    ) -> dict:
+        with sqlite_bulk_load(self.using):
+            return {
+                "users": len(self.create_users(users)),
+                "products": len(self.create_products(products)),
+                "orders": len(self.create_orders(orders, max_products_per_order)),
+                "articles": len(self.create_articles(articles)),
+            }
+
+    def bulk_create(self, model, objs: Iterable) -> list[int]:
+        pks = []
+        label = model._meta.verbose_name_plural
+        with transaction.atomic(using=self.using):
+            for batch in iter_chunks(objs, self.batch_size):
+                created_at = [getattr(obj, "created_at", None) for obj in batch]
+                created = model.objects.using(self.using).bulk_create(batch)
+                if any(created_at):
+                    # auto_now_add replaced them on insert
+                    for obj, value in zip(created, created_at):
+                        obj.created_at = value
+                    model.objects.using(self.using).bulk_update(created, ["created_at"])
+                pks.extend(obj.pk for obj in created)
+                log.debug("Seeded %s %s", len(pks), label)
+                if self.on_progress is not None:
+                    self.on_progress(str(label), len(pks))
+        return pks
+
+    def create_users(self, count: int) -> list[int]:
+        if not count:
+            return []
+        prefix = f"seed{self.seed}-user"
+        start = User.objects.using(self.using).filter(username__startswith=prefix).count()
+        # hashing is deliberately slow: hash once and share it,
+        # an unusable password when none is given
+        password = make_password(self.password)
+        user_ids = self.bulk_create(
+            User,
+            (self.make_user(f"{prefix}{index}", password) for index in range(start, start + count)),
+        )
+        self.bulk_create(Profile, (self.make_profile(user_id) for user_id in user_ids))
+        self.user_ids.extend(user_ids)
+        return user_ids
+
+    def make_user(self, username: str, password: str) -> User:
+        first_name = self.random.choice(FIRST_NAMES)
+        last_name = self.random.choice(LAST_NAMES)
+        return User(
+            username=username,
+            password=password,
+            first_name=first_name,
+            last_name=last_name,
+            email=f"{username}@example.com",
+            date_joined=self.reference_time - timedelta(days=self.random.uniform(0, 3 * 365)),
+        )
+
+    def make_profile(self, user_id: int) -> Profile:
+        return Profile(
+            user_id=user_id,
+            bio=self.make_text(0, 3) if self.random.random() < 0.3 else "",
+            agreement_accepted=self.random.random() < 0.8,
+        )
+
+    def create_products(self, count: int) -> list[int]:
+        product_ids = self.bulk_create(Product, (self.make_product() for _ in range(count)))
+        self.product_ids.extend(product_ids)
+        return product_ids
+
+    def make_product(self) -> Product:
+        name = " ".join([
+            self.random.choice(ADJECTIVES),
+            self.random.choice(NOUNS),
+            f"{self.random.choice('AXSZ')}{self.random.randrange(100, 10000)}",
+        ])
+        # log-normal prices around a few dozen, mostly ending with .99
+        price = min(self.random.lognormvariate(3.5, 1.2), 999_999)
+        price = Decimal(max(round(price), 1)) - Decimal("0.01")
+        return Product(
+            name=name,
+            description=self.make_text(1, 5),
+            price=price,
+            discount=self.random.choices(DISCOUNTS, DISCOUNT_WEIGHTS)[0],
+            archived=self.random.random() < 0.05,
+            created_at=self.reference_time - timedelta(days=self.random.uniform(0, 3 * 365)),
+        )
+
+    def create_orders(self, count: int, max_products_per_order: int = 10) -> list[int]:
+        if not count:
+            return []
+        if not self.user_ids or not self.product_ids:
+            raise ValueError("Orders need users and products created by the same seeder")
+        # a few users place most of the orders
+        users = self.user_ids[:]
+        self.random.shuffle(users)
+        user_weights = zipf_cum_weights(len(users), 1.1)
+        order_ids = self.bulk_create(
+            Order,
+            (self.make_order(users, user_weights) for _ in range(count)),
+        )
+
+        # and a few products appear in most of them
+        products = self.product_ids[:]
+        self.random.shuffle(products)
+        product_weights = zipf_cum_weights(len(products), 1.0)
+        max_products_per_order = min(max_products_per_order, len(products))
+        through = Order.products.through
+        self.bulk_create(
+            through,
+            (
+                through(order_id=order_id, product_id=product_id)
+                for order_id in order_ids
+                for product_id in self.pick_products(products, product_weights, max_products_per_order)
+            ),
+        )
+
+        with transaction.atomic(using=self.using):
+            for batch in iter_chunks(order_ids, self.batch_size):
+                refresh_order_totals(
+                    Order.objects.using(self.using).filter(pk__gte=batch[0], pk__lte=batch[-1]),
+                )
+        return order_ids
+
+    def make_order(self, users: list[int], user_weights: list[float]) -> Order:
+        return Order(
+            user_id=self.random.choices(users, cum_weights=user_weights)[0],
+            delivery_address="ul {street}, dom {house}, kv {flat}".format(
+                street=self.random.choice(STREETS),
+                house=self.random.randint(1, 120),
+                flat=self.random.randint(1, 300),
+            ),
+            promocode=self.random.choice(PROMOCODES) if self.random.random() < 0.15 else "",
+            created_at=self.reference_time - timedelta(days=self.random.uniform(0, 365)),
+        )
+
+    def pick_products(self, products: list[int], weights: list[float], limit: int) -> set[int]:
+        # 1 product most of the time, rarely more than 5
+        count = min(1 + int(self.random.expovariate(0.6)), limit)
+        picked = set()
+        while len(picked) < count:
+            picked.update(self.random.choices(products, cum_weights=weights, k=count - len(picked)))
+        return picked
+
+    def create_articles(self, count: int) -> list[int]:
+        return self.bulk_create(Article, (self.make_article() for _ in range(count)))
+
+    def make_article(self) -> Article:
+        title = " ".join(self.random.choices(WORDS, k=self.random.randint(3, 8))).capitalize()
+        published_at = None
+        # about one article in ten is a draft
+        if self.random.random() >= 0.1:
+            published_at = self.reference_time - timedelta(days=self.random.uniform(0, 2 * 365))
+        return Article(
+            title=title[:100],
+            body="\n\n".join(self.make_text(3, 8) for _ in range(self.random.randint(1, 5))),
+            published_at=published_at,
+        )
+
+    def make_text(self, min_sentences: int, max_sentences: int) -> str:
+        return " ".join(
+            " ".join(self.random.choices(WORDS, k=self.random.randint(4, 14))).capitalize() + "."
+            for _ in range(self.random.randint(min_sentences, max_sentences))
+        )
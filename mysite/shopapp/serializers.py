@@ -1,9 +1,50 @@
+from typing import Callable, Iterable, Optional
+
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
 from rest_framework import serializers
 
-from .models import Product
+from .models import ORDER_PRODUCTS_BATCH_SIZE, Order, Product
+from .thumbnails import get_thumbnail_sizes, thumbnail_url, thumbnails_flag, thumbnails_rendered
+from .utils import iter_chunks
+
+
+class ThumbnailsField(serializers.Field):
+    """
+    URLs of every thumbnail size of an image field, by size name
+    """
+
+    def __init__(self, **kwargs):
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    @property
+    def flag_source(self) -> str:
+        return thumbnails_flag(self.source)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        return self.get_urls(value.name, thumbnails_rendered(value), value.storage)
+
+    def row_to_representation(self, row: dict):
+        # values() rows hold the stored name and the flag
+        if not row[self.source]:
+            return None
+        return self.get_urls(row[self.source], row[self.flag_source], default_storage)
+
+    def get_urls(self, name: str, rendered: bool, storage) -> dict:
+        request = self.context.get("request")
+        urls = {}
+        for size in get_thumbnail_sizes():
+            url = thumbnail_url(name, size, rendered, storage)
+            urls[size] = request.build_absolute_uri(url) if request is not None else url
+        return urls
 
 
 class ProductSerializer(serializers.ModelSerializer):
+    preview_thumbnails = ThumbnailsField(source="preview")
+
     class Meta:
         model = Product
         fields = (
@@ -15,4 +56,135 @@ class ProductSerializer(serializers.ModelSerializer):
             "created_at",
             "archived",
             "preview",
+            "preview_thumbnails",
+        )
+
+
+class OrderUserSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = (
+            "pk",
+            "username",
+            "first_name",
+        )
+
+
+class OrderProductSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Product
+        fields = (
+            "pk",
+            "name",
+            "price",
+            "discount",
+        )
+
+
+class OrderSerializer(serializers.ModelSerializer):
+    user = OrderUserSerializer(read_only=True)
+    products = OrderProductSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = (
+            "pk",
+            "delivery_address",
+            "promocode",
+            "created_at",
+            "user",
+            "products",
+            "products_count",
+            "total",
+            "discounted_total",
+            "receipt",
         )
+
+
+class OrderProductsSerializer(serializers.Serializer):
+    products = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+    )
+
+    def validate_products(self, value: list[int]) -> set[int]:
+        product_ids = set(value)
+        missing = set(product_ids)
+        for batch in iter_chunks(product_ids, ORDER_PRODUCTS_BATCH_SIZE):
+            missing.difference_update(
+                Product.objects.filter(pk__in=batch).values_list("pk", flat=True)
+            )
+        if missing:
+            raise serializers.ValidationError(
+                f"Unknown products: {', '.join(map(str, sorted(missing)))}"
+            )
+        return product_ids
+
+
+class ValuesSerializer:
+    """
+    Read-only counterpart of a ModelSerializer working on values() rows.
+
+    Converters for every field are prepared once, so serializing a row
+    is a plain loop over (name, source, converter) with no model instances,
+    no get_attribute() lookups and no per-row field binding. The output
+    is the same as the wrapped serializer's for fields with a model
+    column as their source.
+    """
+
+    def __init__(self, serializer_class: type[serializers.ModelSerializer], context: Optional[dict] = None):
+        serializer = serializer_class(context=context or {})
+        self.model = serializer_class.Meta.model
+        # (name, source, converter), fields reading more than one column
+        # have no source and convert the whole row
+        self.fields = []
+        self.sources = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, ThumbnailsField):
+                self.fields.append((name, None, field.row_to_representation))
+                sources = [field.source, field.flag_source]
+            else:
+                self.fields.append((name, field.source, self.get_converter(field)))
+                sources = [field.source]
+            self.sources.extend(source for source in sources if source not in self.sources)
+
+    def get_converter(self, field: serializers.Field) -> Optional[Callable]:
+        if type(field) is serializers.ReadOnlyField:
+            return None
+        if isinstance(field, serializers.FileField):
+            return self.get_file_converter(field)
+        return field.to_representation
+
+    def get_file_converter(self, field: serializers.FileField) -> Callable:
+        # values() returns the stored file name instead of a FieldFile
+        storage = self.model._meta.get_field(field.source).storage
+        request = field.context.get("request")
+        if not getattr(field, "use_url", True):
+            return lambda name: name or None
+
+        def convert(name):
+            if not name:
+                return None
+            url = storage.url(name)
+            if request is not None:
+                return request.build_absolute_uri(url)
+            return url
+
+        return convert
+
+    def to_representation(self, row: dict) -> dict:
+        data = {}
+        for name, source, convert in self.fields:
+            if source is None:
+                data[name] = convert(row)
+                continue
+            value = row[source]
+            if value is not None and convert is not None:
+                value = convert(value)
+            data[name] = value
+        return data
+
+    def serialize(self, rows: Iterable[dict]) -> list[dict]:
+        return [self.to_representation(row) for row in rows]
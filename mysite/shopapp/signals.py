@@ -0,0 +1,78 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .generations import bump_generation_on_commit
+from .models import Order, Product, ProductImage, ProductQuerySet
+from .order_totals import refresh_order_totals, refresh_orders_with_products
+from .thumbnails import has_thumbnails, schedule_thumbnails
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def bump_product_generation(sender, using, **kwargs):
+    bump_generation_on_commit(sender, using=using)
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def refresh_totals_on_products_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == "pre_clear":
+        # the cleared orders aren't known any more once post_clear is sent
+        instance._cleared_order_ids = list(instance.orders.values_list("pk", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if not reverse:
+        refresh_order_totals(Order.objects.filter(pk=instance.pk))
+    elif action == "post_clear":
+        refresh_order_totals(Order.objects.filter(pk__in=instance._cleared_order_ids))
+    else:
+        refresh_order_totals(Order.objects.filter(pk__in=pk_set))
+
+
+@receiver(post_save, sender=Product)
+def refresh_totals_on_price_change(sender, instance, created, update_fields, **kwargs):
+    if created:
+        return
+    if update_fields is not None and ProductQuerySet.price_fields.isdisjoint(update_fields):
+        return
+    refresh_orders_with_products([instance.pk])
+
+
+@receiver(pre_delete, sender=Product)
+def remember_orders_of_deleted_product(sender, instance, **kwargs):
+    instance._order_ids = list(instance.orders.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Product)
+def refresh_totals_on_product_delete(sender, instance, **kwargs):
+    if instance._order_ids:
+        refresh_order_totals(Order.objects.filter(pk__in=instance._order_ids))
+
+
+def mark_preview_thumbnails_rendered(name: str) -> None:
+    # new updated_at and generation: cached fragments and pages pick up the thumbnails
+    Product.objects.filter(preview=name).update(preview_thumbnails_rendered=True)
+
+
+def mark_image_thumbnails_rendered(name: str) -> None:
+    ProductImage.objects.filter(image=name).update(image_thumbnails_rendered=True)
+
+
+@receiver(post_save, sender=Product)
+def render_preview_thumbnails(sender, instance, using, **kwargs):
+    # saves are rare enough to look at the storage, reads only trust the flag
+    rendered = bool(instance.preview) and has_thumbnails(instance.preview.name)
+    if instance.preview_thumbnails_rendered != rendered:
+        instance.preview_thumbnails_rendered = rendered
+        Product.objects.using(using).filter(pk=instance.pk).update(preview_thumbnails_rendered=rendered)
+    if instance.preview and not rendered:
+        schedule_thumbnails(instance.preview.name, mark_preview_thumbnails_rendered, using=using)
+
+
+@receiver(post_save, sender=ProductImage)
+def render_image_thumbnails(sender, instance, created, using, **kwargs):
+    if created:
+        schedule_thumbnails(instance.image.name, mark_image_thumbnails_rendered, using=using)
@@ -0,0 +1,94 @@
+"""
+Background jobs of the shop, run by `manage.py run_jobs`
+"""
+from typing import Optional
+from uuid import uuid4
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import UploadedFile
+
+from jobsapp.jobs import DEFAULT_MAX_ATTEMPTS, enqueue, get_job_files_storage, task
+from jobsapp.models import Job
+
+from .common import save_csv_products
+from .models import Product
+from .utils import iter_chunks
+
+PRODUCTS_UPDATE_BATCH_SIZE = 1000
+
+
+@task("shopapp.import_products_csv")
+def import_products_csv(
+    job: Job,
+    file_name: str,
+    encoding: str,
+    key: Optional[str] = None,
+    dry_run: bool = False,
+) -> dict:
+    storage = get_job_files_storage()
+    done = False
+    try:
+        total = storage.size(file_name)
+        job.set_progress(0, total)
+        with storage.open(file_name, "rb") as file:
+            result = save_csv_products(
+                file.file,
+                encoding=encoding,
+                key=key,
+                dry_run=dry_run,
+                # bytes read so far, close enough for a progress bar
+                on_batch=lambda _: job.set_progress(file.tell()),
+            )
+        job.set_progress(total)
+        done = True
+    finally:
+        # a retry reads it again, after the last attempt nothing will
+        if done or job.attempts >= job.max_attempts:
+            storage.delete(file_name)
+    return result.as_dict()
+
+
+def enqueue_products_import(
+    upload: UploadedFile,
+    encoding: str,
+    key: Optional[str] = None,
+    dry_run: bool = False,
+    user: Optional[User] = None,
+) -> Job:
+    file_name = get_job_files_storage().save(f"imports/{uuid4().hex}.csv", upload)
+    # batches are committed as they go: running a plain import twice
+    # would duplicate products, upserts and dry runs can be retried
+    max_attempts = DEFAULT_MAX_ATTEMPTS if key or dry_run else 1
+    return enqueue(
+        "shopapp.import_products_csv",
+        user=user,
+        max_attempts=max_attempts,
+        file_name=file_name,
+        encoding=encoding,
+        key=key,
+        dry_run=dry_run,
+    )
+
+
+@task("shopapp.set_products_archived")
+def set_products_archived(
+    job: Job,
+    archived: bool,
+    product_ids: Optional[list[int]] = None,
+    changelist_query: Optional[str] = None,
+) -> dict:
+    """
+    Updates `product_ids`, or the products of the admin changelist at
+    `?changelist_query` when the whole selection was archived
+    """
+    if changelist_query is not None:
+        from .admin import get_changelist_queryset
+
+        products = get_changelist_queryset(Product, job.user, changelist_query)
+        product_ids = list(products.order_by("pk").values_list("pk", flat=True))
+    updated = 0
+    job.set_progress(0, len(product_ids))
+    for done, batch in enumerate(iter_chunks(product_ids, PRODUCTS_UPDATE_BATCH_SIZE), start=1):
+        updated += Product.objects.filter(pk__in=batch).update(archived=archived)
+        job.set_progress(min(done * PRODUCTS_UPDATE_BATCH_SIZE, len(product_ids)))
+    return {"updated": updated}
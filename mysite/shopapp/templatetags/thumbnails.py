@@ -0,0 +1,16 @@
+from django import template
+from django.db.models.fields.files import FieldFile
+
+from shopapp.thumbnails import thumbnail_url, thumbnails_rendered
+
+register = template.Library()
+
+
+@register.filter
+def thumbnail(file: FieldFile, size: str):
+    """
+    {{ product.preview|thumbnail:"small" }}
+    """
+    if not file:
+        return ""
+    return thumbnail_url(file.name, size, thumbnails_rendered(file), file.storage)
@@ -1,12 +1,46 @@
+import csv
+import gzip
+import hashlib
+import json
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from importlib import import_module
+from io import BytesIO, StringIO
 from string import ascii_letters
+from unittest import mock
 from random import choices
 
+from django.apps import apps as django_apps
 from django.conf import settings
-from django.contrib.auth.models import User
-from django.test import TestCase
-from django.urls import reverse
+from django.contrib.auth.models import Permission, User
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Count
+from django.db.models.signals import m2m_changed
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver, reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+from rest_framework.renderers import JSONRenderer
 
-from shopapp.models import Product
+from shopapp.common import save_csv_products
+from shopapp.generations import get_generations
+from blogapp.models import Article
+from jobsapp.jobs import claim_jobs, enqueue, get_job_files_storage, run_job
+from jobsapp.models import Job
+from myauth.models import Profile
+from shopapp.models import Product, Order, ProductImage
+from shopapp.search import fts_enabled
+from shopapp.seeding import DataSeeder
+from shopapp.serializers import ProductSerializer
+from shopapp.tasks import enqueue_products_import
+from shopapp.thumbnails import thumbnail_name, thumbnail_url
 from shopapp.utils import add_two_numbers
 
 
@@ -92,6 +126,48 @@ class ProductsListTestCase(TestCase):
         self.assertTemplateUsed(response, 'shopapp/products-list.html')
 
 
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ProductsListPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.bulk_create([
+            Product(name=f"Product {i:02}", description="long description", price=i + 1)
+            for i in range(25)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_pages(self):
+        response = self.client.get(reverse("shopapp:products_list"), {"page": 2})
+        products = response.context["products"]
+        self.assertEqual([p.name for p in products], [f"Product {i:02}" for i in range(20, 25)])
+        self.assertEqual(products[0].get_deferred_fields(), {"description"})
+        self.assertContains(response, "Page 2 of 2")
+
+    def test_fragment_is_rendered_again_after_a_change(self):
+        url = reverse("shopapp:products_list")
+        product = Product.objects.get(name="Product 00")
+        self.assertContains(self.client.get(url), "Name: Product 00")
+
+        # same updated_at: the cached fragment is served
+        Product.objects.filter(pk=product.pk).update(name="Product 00 (new)", updated_at=product.updated_at)
+        self.assertContains(self.client.get(url), "Name: Product 00<")
+
+        Product.objects.filter(pk=product.pk).update(name="Product 00 (newer)")
+        response = self.client.get(url)
+        self.assertContains(response, "Name: Product 00 (newer)")
+        self.assertContains(response, "Name: Product 01")
+
+    def test_bulk_update_changes_updated_at(self):
+        product = Product.objects.get(name="Product 00")
+        updated_at = product.updated_at
+        product.price = 100
+        Product.objects.bulk_update([product], ["price"])
+        product.refresh_from_db()
+        self.assertGreater(product.updated_at, updated_at)
+
+
 class OrdersListViewTestCase(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -138,3 +214,1040 @@ class ProductsExportViewTestCase(TestCase):
             products_data["products"],
             expected_data,
         )
+
+
+class ProductsDownloadCSVTestCase(TestCase):
+    fixtures = [
+        'products-fixture.json',
+    ]
+
+    def test_download_csv_is_streamed(self):
+        response = self.client.get(reverse('shopapp:product-download-csv'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b"".join(response.streaming_content).decode()
+        rows = list(csv.reader(StringIO(content)))
+        self.assertEqual(rows[0], ["name", "description", "price", "discount"])
+        self.assertEqual(
+            [row[0] for row in rows[1:]],
+            list(Product.objects.values_list("name", flat=True)),
+        )
+
+    def test_download_csv_respects_filters(self):
+        response = self.client.get(
+            reverse('shopapp:product-download-csv'),
+            {"search": "Smartphone"},
+        )
+        content = b"".join(response.streaming_content).decode()
+        rows = list(csv.reader(StringIO(content)))
+        self.assertEqual(rows[1:], [["Smartphone", "", "987.00", "25"]])
+
+
+class SaveCSVProductsTestCase(TestCase):
+    def test_rows_are_saved_in_batches(self):
+        content = "name,price,discount\n" + "".join(
+            f"Product {i},{i}.50,{i % 10}\n"
+            for i in range(25)
+        )
+        batches = []
+        result = save_csv_products(
+            BytesIO(content.encode()),
+            encoding="utf-8",
+            batch_size=10,
+            on_batch=lambda r: batches.append(r.created),
+        )
+        self.assertEqual(result.created, 25)
+        self.assertEqual(batches, [10, 20, 25])
+        self.assertEqual(Product.objects.count(), 25)
+        self.assertEqual(Product.objects.get(name="Product 3").price, Decimal("3.50"))
+
+    def test_invalid_rows_are_reported(self):
+        content = (
+            "name,price,archived\n"
+            "Good,10,false\n"
+            "Bad price,ten,false\n"
+            ",5,true\n"
+            "Also good,20,true\n"
+        )
+        result = save_csv_products(BytesIO(content.encode()), encoding="utf-8")
+        self.assertEqual(result.created, 2)
+        self.assertEqual(result.error_count, 2)
+        self.assertEqual([error["line"] for error in result.errors], [3, 4])
+        self.assertTrue(Product.objects.get(name="Also good").archived)
+
+    def test_unknown_columns_are_rejected(self):
+        self.client.force_login(User.objects.create_user(username="importer"))
+        response = self.client.post(
+            reverse('shopapp:product-upload-csv'),
+            {"file": SimpleUploadedFile("products.csv", b"name,colour\nPen,red\n")},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Product.objects.exists())
+
+
+class SaveCSVProductsUpsertTestCase(TestCase):
+    def setUp(self):
+        self.laptop = Product.objects.create(name="Laptop", price="1999.00", discount=5)
+        self.desktop = Product.objects.create(name="Desktop", price="2999.00")
+        self.content = (
+            "name,price\n"
+            "Laptop,1899.00\n"
+            "Desktop,2999.00\n"
+            "Smartphone,999.00\n"
+        ).encode()
+
+    def test_upsert_updates_existing_products(self):
+        result = save_csv_products(BytesIO(self.content), encoding="utf-8", key="name")
+        self.assertEqual((result.created, result.updated, result.unchanged), (1, 1, 1))
+        self.laptop.refresh_from_db()
+        self.assertEqual(self.laptop.price, Decimal("1899.00"))
+        self.assertEqual(self.laptop.discount, 5)
+        self.assertEqual(Product.objects.count(), 3)
+
+    def test_dry_run_reports_changes_without_saving(self):
+        self.client.force_login(User.objects.create_user(username="importer"))
+        with tempfile.TemporaryDirectory() as jobs_root, self.settings(JOBS_FILES_ROOT=jobs_root):
+            response = self.client.post(
+                reverse('shopapp:product-upload-csv'),
+                {
+                    "file": SimpleUploadedFile("prices.csv", self.content),
+                    "key": "name",
+                    "dry_run": "true",
+                },
+            )
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(Job.objects.get().status, Job.Status.PENDING)
+            call_command("run_jobs", once=True, workers=0, stdout=StringIO())
+        response = self.client.get(response.json()["status_url"])
+        self.assertEqual(response.json()["status"], "done")
+        summary = response.json()["result"]
+        self.assertTrue(summary["dry_run"])
+        self.assertEqual((summary["created"], summary["updated"]), (1, 1))
+        self.assertIn(
+            {"line": 2, "action": "update", "key": "Laptop", "fields": {"price": ["1999.00", "1899.00"]}},
+            summary["changes"],
+        )
+        self.assertEqual(Product.objects.count(), 2)
+        self.laptop.refresh_from_db()
+        self.assertEqual(self.laptop.price, Decimal("1999.00"))
+
+    def test_repeated_keys_are_applied_in_order(self):
+        content = (
+            "name,price\n"
+            "Laptop,1899.00\n"
+            "Tablet,499.00\n"
+            "Laptop,1799.00\n"
+            "Tablet,499.00\n"
+            "Laptop,1799.00\n"
+        ).encode()
+        for dry_run in (True, False):
+            for batch_size in (2, 10):
+                with self.subTest(dry_run=dry_run, batch_size=batch_size), transaction.atomic():
+                    result = save_csv_products(
+                        BytesIO(content), encoding="utf-8", key="name", dry_run=dry_run, batch_size=batch_size,
+                    )
+                    self.assertEqual((result.created, result.updated, result.unchanged), (1, 2, 2))
+                    self.assertEqual(
+                        [(change["line"], change["action"]) for change in result.changes],
+                        [(2, "update"), (3, "create"), (4, "update")],
+                    )
+                    self.assertEqual(result.changes[2]["fields"], {"price": ["1899.00", "1799.00"]})
+                    if not dry_run:
+                        self.assertEqual(Product.objects.get(name="Laptop").price, Decimal("1799.00"))
+                        self.assertEqual(Product.objects.filter(name="Tablet").count(), 1)
+                    transaction.set_rollback(True)
+
+
+class OrderAdminExportCSVTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username="admin", password="admin")
+        products = [
+            Product.objects.create(name=f"Product {i}", price=i)
+            for i in range(3)
+        ]
+        for i in range(5):
+            order = Order.objects.create(user=cls.admin, promocode=f"promo{i}")
+            order.products.set(products[:i % 3 + 1])
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_export_streams_flattened_relations(self):
+        orders = Order.objects.order_by("pk")
+        response = self.client.post(
+            reverse("admin:shopapp_order_changelist"),
+            {
+                "action": "export_as_csv",
+                "_selected_action": [order.pk for order in orders],
+            },
+        )
+        self.assertTrue(response.streaming)
+        with self.assertNumQueries(3):
+            content = b"".join(response.streaming_content).decode()
+        rows = list(csv.DictReader(StringIO(content)))
+        self.assertEqual(len(rows), 5)
+        first = next(row for row in rows if row["promocode"] == "promo0")
+        self.assertEqual(first["user"], "admin")
+        self.assertEqual(first["products"], "Product 0")
+        third = next(row for row in rows if row["promocode"] == "promo2")
+        self.assertEqual(sorted(third["products"].split("; ")), ["Product 0", "Product 1", "Product 2"])
+
+
+class ProductAdminJobsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username="admin", password="admin")
+        cls.products = Product.objects.bulk_create([
+            Product(name=f"Product {i}", price=i + 1)
+            for i in range(3)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        jobs_root = tempfile.TemporaryDirectory()
+        self.addCleanup(jobs_root.cleanup)
+        settings_override = self.settings(JOBS_FILES_ROOT=jobs_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_import_redirects_to_job_status(self):
+        response = self.client.post(
+            reverse("admin:import_products_csv"),
+            {"csv_file": SimpleUploadedFile("products.csv", b"name,price\nPen,2.50\n")},
+        )
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse("admin:import_products_csv_status", kwargs={"job_id": job.pk}))
+        response = self.client.get(response.url)
+        self.assertContains(response, 'http-equiv="refresh"')
+
+        call_command("run_jobs", once=True, workers=0, stdout=StringIO())
+        response = self.client.get(reverse("admin:import_products_csv_status", kwargs={"job_id": job.pk}))
+        self.assertNotContains(response, 'http-equiv="refresh"')
+        self.assertContains(response, "Import summary")
+        self.assertTrue(Product.objects.filter(name="Pen").exists())
+
+    def test_upload_is_kept_for_retries_only(self):
+        upload = SimpleUploadedFile("products.csv", b"name,price\nPen,2.50\n")
+        job = enqueue_products_import(upload, encoding="utf-8", key="name")
+        file_name = job.kwargs["file_name"]
+        storage = get_job_files_storage()
+        with self.settings(JOBS_RETRY_DELAY=timedelta(0)), \
+                mock.patch("shopapp.tasks.save_csv_products", side_effect=RuntimeError("broken")):
+            self.assertEqual(run_job(claim_jobs(1)[0]), Job.Status.PENDING)
+            self.assertTrue(storage.exists(file_name))
+            Job.objects.filter(pk=job.pk).update(max_attempts=2)
+            self.assertEqual(run_job(claim_jobs(1)[0]), Job.Status.FAILED)
+        self.assertFalse(storage.exists(file_name))
+
+    def test_large_archive_action_runs_in_background(self):
+        with mock.patch("shopapp.admin.ADMIN_ACTION_JOB_THRESHOLD", 2):
+            self.client.post(
+                reverse("admin:shopapp_product_changelist"),
+                {
+                    "action": "mark_archived",
+                    "_selected_action": [product.pk for product in self.products],
+                },
+            )
+        job = Job.objects.get()
+        self.assertEqual(job.task, "shopapp.set_products_archived")
+        self.assertFalse(Product.objects.filter(archived=True).exists())
+
+        call_command("run_jobs", once=True, workers=0, stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.result, {"updated": 3})
+        self.assertEqual(Product.objects.filter(archived=True).count(), 3)
+
+    def test_archiving_all_results_stores_the_search(self):
+        lamp = Product.objects.create(name="Lamp", price=1)
+        with mock.patch("shopapp.admin.ADMIN_ACTION_JOB_THRESHOLD", 2):
+            self.client.post(
+                reverse("admin:shopapp_product_changelist") + "?q=Product&p=2",
+                {
+                    "action": "mark_archived",
+                    "select_across": "1",
+                    "_selected_action": [self.products[0].pk],
+                },
+            )
+        job = Job.objects.get()
+        self.assertEqual(job.kwargs, {"archived": True, "changelist_query": "q=Product&p=2"})
+
+        call_command("run_jobs", once=True, workers=0, stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.result, {"updated": 3})
+        self.assertEqual(Product.objects.filter(archived=True).count(), 3)
+        lamp.refresh_from_db()
+        self.assertFalse(lamp.archived)
+
+    def test_import_status_is_for_its_user(self):
+        upload = SimpleUploadedFile("products.csv", b"name,price\nPen,2.50\n")
+        job = enqueue_products_import(upload, encoding="utf-8", user=self.admin)
+        url = reverse("admin:import_products_csv_status", kwargs={"job_id": job.pk})
+        self.client.force_login(User.objects.create_user(username="staff", is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 404)
+        job.user = User.objects.get(username="staff")
+        job.save()
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class ProductKeysetPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.bulk_create([
+            Product(name=f"Product {i:02}", price=i % 4, discount=i % 3)
+            for i in range(25)
+        ])
+
+    def walk_pages(self, **params):
+        url = reverse('shopapp:product-list')
+        params = {"cursor": "", **params}
+        pages = []
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.json())
+            url, params = pages[-1]["next"], None
+        return pages
+
+    def test_pages_follow_ordering_with_pk_tie_breaker(self):
+        pages = self.walk_pages(ordering="-price")
+        self.assertEqual(len(pages), 3)
+        pks = [product["pk"] for page in pages for product in page["results"]]
+        self.assertEqual(
+            pks,
+            list(Product.objects.order_by("-price", "pk").values_list("pk", flat=True)),
+        )
+        self.assertNotIn("count", pages[0])
+
+    def test_count_is_optional(self):
+        response = self.client.get(reverse('shopapp:product-list'), {"cursor": "", "count": "1"})
+        self.assertEqual(response.json()["count"], 25)
+
+    def test_deep_pages_cost_the_same_queries(self):
+        pages = self.walk_pages(ordering="discount")
+        with CaptureQueriesContext(connection) as first_page:
+            self.client.get(reverse('shopapp:product-list'), {"cursor": "", "ordering": "discount"})
+        with CaptureQueriesContext(connection) as last_page:
+            self.client.get(pages[-2]["next"])
+        self.assertEqual(len(first_page), len(last_page))
+        self.assertNotIn("OFFSET", last_page[-1]["sql"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('shopapp:product-list'), {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductFullTextSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.laptop = Product.objects.create(name="Gaming laptop", description="Fast laptop with a laptop bag")
+        cls.tablet = Product.objects.create(name="Tablet", description="Lighter than a laptop")
+        Product.objects.bulk_create([
+            Product(name="Desktop", description="Tower computer"),
+        ])
+
+    def search(self, term):
+        response = self.client.get(reverse('shopapp:product-list'), {"search": term})
+        return [product["name"] for product in response.json()["results"]]
+
+    def test_prefix_match_ordered_by_relevance(self):
+        self.assertTrue(fts_enabled())
+        self.assertEqual(self.search("lapt"), ["Gaming laptop", "Tablet"])
+
+    def test_index_follows_updates(self):
+        self.assertEqual(self.search("tower"), ["Desktop"])
+        Product.objects.filter(name="Desktop").update(description="Mini computer")
+        self.assertEqual(self.search("tower"), [])
+        self.assertEqual(self.search("mini comp"), ["Desktop"])
+        self.tablet.delete()
+        self.assertEqual(self.search("laptop"), ["Gaming laptop"])
+
+    def test_admin_search_is_ranked(self):
+        self.client.force_login(User.objects.create_superuser(username="admin"))
+        url = reverse("admin:shopapp_product_changelist")
+        response = self.client.get(url, {"q": "lapt"})
+        self.assertEqual([product.name for product in response.context["cl"].result_list], ["Gaming laptop", "Tablet"])
+        # a sorted column still wins
+        response = self.client.get(url, {"q": "lapt", "o": "-2"})
+        self.assertEqual([product.name for product in response.context["cl"].result_list], ["Tablet", "Gaming laptop"])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ProductCacheGenerationTestCase(TestCase):
+    fixtures = [
+        'products-fixture.json',
+    ]
+
+    def setUp(self):
+        cache.clear()
+
+    def export_names(self):
+        response = self.client.get(reverse('shopapp:products-export'))
+        return [product["name"] for product in response.json()["products"]]
+
+    def test_export_cache_follows_bulk_updates(self):
+        self.assertIn("Smartphone", self.export_names())
+        with self.assertNumQueries(0):
+            self.export_names()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(name="Smartphone").update(name="Phone")
+        self.assertIn("Phone", self.export_names())
+
+    def test_generation_bumped_by_saves_and_bulk_writes(self):
+        generation = get_generations(Product)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name="Tablet")
+        self.assertNotEqual(get_generations(Product), generation)
+
+        generation = get_generations(Product)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.bulk_create([Product(name="Monitor")])
+        self.assertNotEqual(get_generations(Product), generation)
+
+    def test_not_modified_when_etag_matches(self):
+        response = self.client.get(reverse('shopapp:products-export'))
+        etag = response.headers["ETag"]
+        response = self.client.get(reverse('shopapp:products-export'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=2).update(price="10.00")
+        response = self.client.get(reverse('shopapp:products-export'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_gzip_variant(self):
+        response = self.client.get(reverse('shopapp:products-export'), HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        products_data = json.loads(gzip.decompress(response.content))
+        self.assertEqual(len(products_data["products"]), 3)
+
+
+class ProductValuesSerializerTestCase(TestCase):
+    fixtures = [
+        'products-fixture.json',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.create(
+            name="Camera",
+            description="With preview",
+            price="349.99",
+            preview="products/product_4/preview/camera photo.jpg",
+        )
+
+    def test_list_matches_product_serializer(self):
+        response = self.client.get(reverse('shopapp:product-list'), {"ordering": "price"})
+        serializer = ProductSerializer(
+            Product.objects.order_by("price"),
+            many=True,
+            context={"request": response.wsgi_request},
+        )
+        self.assertEqual(
+            JSONRenderer().render(response.data["results"]),
+            JSONRenderer().render(serializer.data),
+        )
+
+    def test_retrieve_matches_product_serializer(self):
+        product = Product.objects.get(name="Camera")
+        response = self.client.get(reverse('shopapp:product-detail', kwargs={"pk": product.pk}))
+        serializer = ProductSerializer(product, context={"request": response.wsgi_request})
+        self.assertEqual(response.content, JSONRenderer().render(serializer.data))
+
+    def test_retrieve_missing_product(self):
+        response = self.client.get(reverse('shopapp:product-detail', kwargs={"pk": 1000}))
+        self.assertEqual(response.status_code, 404)
+
+
+class OrderTotalsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="buyer", password="buyer")
+        cls.laptop = Product.objects.create(name="Laptop", price="1000.00", discount=10)
+        cls.phone = Product.objects.create(name="Phone", price="500.50")
+
+    def setUp(self):
+        self.order = Order.objects.create(user=self.user)
+
+    def assertTotals(self, products_count, total, discounted_total):
+        self.order.refresh_from_db()
+        self.assertEqual(
+            (self.order.products_count, self.order.total, self.order.discounted_total),
+            (products_count, Decimal(total), Decimal(discounted_total)),
+        )
+
+    def test_totals_follow_m2m_changes(self):
+        self.order.products.add(self.laptop, self.phone)
+        self.assertTotals(2, "1500.50", "1400.50")
+        self.order.products.remove(self.phone)
+        self.assertTotals(1, "1000.00", "900.00")
+        self.phone.orders.add(self.order)
+        self.assertTotals(2, "1500.50", "1400.50")
+        self.phone.orders.clear()
+        self.assertTotals(1, "1000.00", "900.00")
+        self.order.products.clear()
+        self.assertTotals(0, "0", "0")
+
+    def test_totals_follow_price_changes(self):
+        self.order.products.set([self.laptop, self.phone])
+        self.laptop.discount = 0
+        self.laptop.save()
+        self.assertTotals(2, "1500.50", "1500.50")
+        Product.objects.filter(pk=self.phone.pk).update(price="100.00")
+        self.assertTotals(2, "1100.00", "1100.00")
+        self.phone.delete()
+        self.assertTotals(1, "1000.00", "1000.00")
+
+    def test_rebuild_command(self):
+        self.order.products.set([self.laptop, self.phone])
+        Order.objects.update(total=0)
+        with self.assertRaises(CommandError):
+            call_command("order_totals", "--check", stdout=StringIO())
+        call_command("order_totals", stdout=StringIO())
+        self.assertTotals(2, "1500.50", "1400.50")
+
+    def test_discounted_total_is_rounded_to_cents(self):
+        mouse = Product.objects.create(name="Mouse", price="19.99", discount=15)
+        self.order.products.add(mouse)
+        self.assertTotals(1, "19.99", "16.99")
+        call_command("order_totals", "--check", stdout=StringIO())
+
+    def test_half_cents_are_rounded_up(self):
+        # 421703.205 + 531005.846 + 36687.744 = 989396.795, summed as floats it was 989396.79
+        self.order.products.add(
+            Product.objects.create(name="Server", price="562270.94", discount=25),
+            Product.objects.create(name="Storage", price="541842.70", discount=2),
+            Product.objects.create(name="Switch", price="38216.40", discount=4),
+        )
+        self.assertTotals(3, "1142330.04", "989396.80")
+        self.assertTrue(Order.objects.filter(pk=self.order.pk, discounted_total=Decimal("989396.80")).exists())
+        Order.objects.update(discounted_total=0)
+        import_module("shopapp.migrations.0014_order_totals").fill_order_totals(django_apps, None)
+        self.assertTotals(3, "1142330.04", "989396.80")
+        self.order.products.add(Product.objects.create(name="Cable", price="0.10", discount=5))
+        self.assertTotals(4, "1142330.14", "989396.89")
+
+    def test_data_migration_matches_order_totals(self):
+        fill_order_totals = import_module("shopapp.migrations.0014_order_totals").fill_order_totals
+        mouse = Product.objects.create(name="Mouse", price="19.99", discount=15)
+        self.order.products.add(mouse, self.laptop)
+        Order.objects.update(products_count=0, total=0, discounted_total=0)
+        fill_order_totals(django_apps, None)
+        self.assertTotals(2, "1019.99", "916.99")
+        # the column keeps what was written, reading it quantizes
+        self.assertTrue(Order.objects.filter(pk=self.order.pk, discounted_total=Decimal("916.99")).exists())
+        call_command("order_totals", "--check", stdout=StringIO())
+
+
+class OrderProductsBulkLinkTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="manager", password="manager")
+        cls.user.user_permissions.add(Permission.objects.get(codename="change_order"))
+        cls.products = Product.objects.bulk_create([
+            Product(name=f"Product {i}", price=10)
+            for i in range(30)
+        ])
+
+    def setUp(self):
+        self.order = Order.objects.create(user=self.user)
+
+    def test_add_products_in_batches_with_one_signal(self):
+        signals = []
+        receiver = lambda action, pk_set, **kwargs: signals.append((action, len(pk_set)))
+        m2m_changed.connect(receiver, sender=Order.products.through)
+        self.addCleanup(m2m_changed.disconnect, receiver, sender=Order.products.through)
+
+        self.order.products.add(self.products[0])
+        signals.clear()
+        # 3 batches of links looked up, 3 of them inserted
+        with self.assertNumQueries(9):
+            self.order.add_products([product.pk for product in self.products], batch_size=10)
+        # the product already linked is not part of the change
+        self.assertEqual(signals, [("pre_add", 29), ("post_add", 29)])
+        self.assertEqual(self.order.products.count(), 30)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total, 300)
+
+        signals.clear()
+        self.order.remove_products([product.pk for product in self.products[:20]])
+        self.order.remove_products([product.pk for product in self.products[15:25]])
+        self.assertEqual(signals, [("pre_remove", 20), ("post_remove", 20), ("pre_remove", 5), ("post_remove", 5)])
+        self.assertEqual(self.order.products.count(), 5)
+        self.order.add_products([product.pk for product in self.products[25:]])
+        self.assertEqual(len(signals), 4)
+
+    def test_endpoint(self):
+        url = reverse('shopapp:order-products', kwargs={"pk": self.order.pk})
+        product_ids = [product.pk for product in self.products[:5]]
+        self.assertEqual(self.client.post(url, {"products": product_ids}, "application/json").status_code, 403)
+
+        self.client.force_login(self.user)
+        response = self.client.post(url, {"products": product_ids}, "application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["products_count"], 5)
+
+        response = self.client.delete(url, {"products": product_ids[:2]}, "application/json")
+        self.assertEqual(response.json()["products_count"], 3)
+
+        response = self.client.post(url, {"products": [100000]}, "application/json")
+        self.assertEqual(response.status_code, 400)
+
+
+class OrderViewSetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="api", password="api", first_name="Api")
+        cls.user.user_permissions.add(Permission.objects.get(codename="view_order"))
+        cls.other = User.objects.create_user(username="other", password="other")
+        cls.products = Product.objects.bulk_create([
+            Product(name=f"Product {i}", price=i + 1)
+            for i in range(5)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def create_orders(self, count, user):
+        for i in range(count):
+            order = Order.objects.create(user=user, promocode=f"promo{i}")
+            order.add_products(product.pk for product in self.products[:i % 5 + 1])
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.create_orders(3, self.user)
+        # session, user, its permissions and groups' permissions, count, page, products
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse('shopapp:order-list'), {"page_size": 3})
+        self.assertEqual(len(response.json()["results"]), 3)
+
+        self.create_orders(20, self.other)
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse('shopapp:order-list'), {"page_size": 20})
+        self.assertEqual(len(response.json()["results"]), 20)
+
+    def test_nested_data_and_filters(self):
+        self.create_orders(2, self.user)
+        self.create_orders(3, self.other)
+        response = self.client.get(reverse('shopapp:order-list'), {"user": self.user.pk})
+        orders = response.json()["results"]
+        self.assertEqual(len(orders), 2)
+        order = next(order for order in orders if order["promocode"] == "promo1")
+        self.assertEqual(order["user"], {"pk": self.user.pk, "username": "api", "first_name": "Api"})
+        self.assertEqual([product["name"] for product in order["products"]], ["Product 0", "Product 1"])
+        self.assertEqual(order["total"], "3.00")
+
+        today = timezone.now().date().isoformat()
+        response = self.client.get(reverse('shopapp:order-list'), {"created_at__date": today})
+        self.assertEqual(response.json()["count"], 5)
+        response = self.client.get(reverse('shopapp:order-list'), {"created_at__date__lte": "2000-01-01"})
+        self.assertEqual(response.json()["count"], 0)
+
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.get(reverse('shopapp:order-list'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_users_without_view_permission_only_see_their_orders(self):
+        self.create_orders(2, self.user)
+        self.create_orders(1, self.other)
+        self.client.force_login(self.other)
+        response = self.client.get(reverse('shopapp:order-list'))
+        self.assertEqual(
+            [order["user"]["pk"] for order in response.json()["results"]],
+            [self.other.pk],
+        )
+        order = Order.objects.filter(user=self.user).first()
+        response = self.client.get(reverse('shopapp:order-detail', kwargs={"pk": order.pk}))
+        self.assertEqual(response.status_code, 404)
+
+
+# Maximum number of queries each route may run for a logged in superuser
+# (views touching request.user also load the session and the user). "pk" names the seeded
+# object used to build the URL. Every GET route of shopapp, blogapp and
+# myauth must be listed here, so new views get a budget too.
+QUERY_BUDGETS = {
+    "shopapp:index": {"queries": 0},
+    "shopapp:api-root": {"queries": 2},
+    "shopapp:product-list": {"queries": 4},
+    "shopapp:product-download-csv": {"queries": 3},
+    "shopapp:product-upload-csv": {"queries": 2},
+    "shopapp:product-detail": {"queries": 3, "pk": "product"},
+    "shopapp:order-list": {"queries": 5},
+    "shopapp:order-detail": {"queries": 4, "pk": "order"},
+    "shopapp:order-products": {"queries": 2, "pk": "order"},
+    "shopapp:products_list": {"queries": 2},
+    "shopapp:products-export": {"queries": 1},
+    "shopapp:product_create": {"queries": 0},
+    "shopapp:product_details": {"queries": 2, "pk": "product"},
+    "shopapp:product_update": {"queries": 1, "pk": "product"},
+    "shopapp:product_delete": {"queries": 1, "pk": "product"},
+    "shopapp:orders_list": {"queries": 4},
+    "shopapp:order_details": {"queries": 4, "pk": "order"},
+    "blogapp:articles": {"queries": 1},
+    "blogapp:article": {"queries": 1, "pk": "article"},
+    "blogapp:articles-feed": {"queries": 1},
+    "myauth:login": {"queries": 2},
+    "myauth:logout": {"queries": 4},
+    "myauth:about-me": {"queries": 3},
+    "myauth:register": {"queries": 0},
+    "myauth:cookie-get": {"queries": 0},
+    "myauth:cookie-set": {"queries": 0},
+    "myauth:session-set": {"queries": 5},
+    "myauth:session-get": {"queries": 2},
+    "myauth:foo-bar": {"queries": 0},
+    "jobsapp:api-root": {"queries": 2},
+    "jobsapp:job-detail": {"queries": 3, "pk": "job"},
+    "jobsapp:job-progress": {"queries": 3, "pk": "job"},
+    "metricsapp:metrics": {"queries": 0},
+}
+
+
+def iter_route_names(urlconf: str, namespace: str):
+    def walk(patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                yield from walk(pattern.url_patterns)
+            elif "format" not in pattern.pattern.regex.groupindex:
+                yield f"{namespace}:{pattern.name}"
+
+    yield from walk(get_resolver(urlconf).url_patterns)
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Requests every route with a small and a larger data set: the number
+    of queries must not grow with the data and must stay within budget
+    """
+    urlconfs = [
+        ("shopapp.urls", "shopapp"),
+        ("blogapp.urls", "blogapp"),
+        ("myauth.urls", "myauth"),
+        ("jobsapp.urls", "jobsapp"),
+        ("metricsapp.urls", "metricsapp"),
+    ]
+    scales = (2, 12)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username="budget", password="budget")
+        Profile.objects.create(user=cls.admin)
+
+    def seed(self, count: int):
+        products = Product.objects.bulk_create([
+            Product(name=f"Product {i}", description="description", price=i + 1, discount=i % 20)
+            for i in range(count)
+        ])
+        for product in products:
+            ProductImage.objects.create(product=product, image=f"products/product_{product.pk}/images/{product.pk}.jpg")
+        for i in range(count):
+            order = Order.objects.create(user=self.admin, promocode=f"promo{i}")
+            order.add_products(product.pk for product in products)
+        Article.objects.bulk_create([
+            Article(title=f"Article {i}", body="body", published_at=timezone.now())
+            for i in range(count)
+        ])
+        job = enqueue("shopapp.set_products_archived", product_ids=[product.pk for product in products], archived=True)
+        return {
+            "product": products[0].pk,
+            "order": Order.objects.first().pk,
+            "article": Article.objects.first().pk,
+            "job": job.pk,
+        }
+
+    def get_route_names(self) -> set:
+        return {
+            name
+            for urlconf, namespace in self.urlconfs
+            for name in iter_route_names(urlconf, namespace)
+        }
+
+    def measure(self, name: str, pks: dict) -> CaptureQueriesContext:
+        budget = QUERY_BUDGETS[name]
+        kwargs = {"pk": pks[budget["pk"]]} if "pk" in budget else {}
+        url = reverse(name, kwargs=kwargs)
+        self.client.force_login(self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+            if response.streaming:
+                b"".join(response.streaming_content)
+        return queries
+
+    def format_queries(self, queries: CaptureQueriesContext) -> str:
+        return "\n".join(
+            f"{number}. {query['sql']}"
+            for number, query in enumerate(queries.captured_queries, start=1)
+        )
+
+    def test_every_route_has_a_budget(self):
+        self.assertEqual(self.get_route_names(), set(QUERY_BUDGETS))
+
+    def test_query_counts_do_not_grow_with_data(self):
+        names = sorted(self.get_route_names() & set(QUERY_BUDGETS))
+        measurements = []
+        seeded = 0
+        for scale in self.scales:
+            pks = self.seed(scale - seeded)
+            seeded = scale
+            measurements.append({name: self.measure(name, pks) for name in names})
+
+        small, large = measurements
+        for name in names:
+            with self.subTest(route=name):
+                self.assertEqual(
+                    len(small[name]),
+                    len(large[name]),
+                    f"{name} runs more queries with more data:\n{self.format_queries(large[name])}",
+                )
+                self.assertLessEqual(
+                    len(large[name]),
+                    QUERY_BUDGETS[name]["queries"],
+                    f"{name} is over its query budget:\n{self.format_queries(large[name])}",
+                )
+
+
+class DataSeederTestCase(TestCase):
+    def seed(self, seed: int) -> dict:
+        return DataSeeder(seed=seed, batch_size=7).run(users=5, products=40, orders=30, articles=10)
+
+    def test_seed_data_command(self):
+        out = StringIO()
+        call_command("seed_data", users=5, products=40, orders=30, articles=10, seed=1, stdout=out)
+
+        self.assertIn("Created 40 products", out.getvalue())
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Profile.objects.count(), 5)
+        self.assertEqual(Product.objects.count(), 40)
+        self.assertEqual(Order.objects.count(), 30)
+        self.assertEqual(Article.objects.count(), 10)
+        self.assertEqual(len(set(User.objects.values_list("password", flat=True))), 1)
+        for order in Order.objects.annotate(links=Count("products")):
+            self.assertGreaterEqual(order.links, 1)
+            self.assertEqual(order.products_count, order.links)
+        call_command("order_totals", check=True, stdout=StringIO())
+
+    def test_same_seed_same_data(self):
+        def snapshot(seed: int) -> list:
+            with transaction.atomic():
+                self.seed(seed)
+                rows = [
+                    list(
+                        Product.objects.order_by("pk")
+                        .values_list("name", "price", "discount", "archived", "created_at")
+                    ),
+                    list(
+                        User.objects.order_by("pk")
+                        .values_list("username", "first_name", "last_name", "date_joined")
+                    ),
+                    [
+                        (order.created_at, sorted(order.products.values_list("name", flat=True)))
+                        for order in Order.objects.order_by("pk")
+                    ],
+                    list(Article.objects.order_by("pk").values_list("title", "body", "published_at")),
+                ]
+                transaction.set_rollback(True)
+            return rows
+
+        self.assertEqual(snapshot(1), snapshot(1))
+        self.assertNotEqual(snapshot(1), snapshot(2))
+
+    def test_dates_go_back_from_the_reference_time(self):
+        call_command(
+            "seed_data", users=5, products=40, orders=30, articles=10,
+            reference_time="2020-06-01T12:00", stdout=StringIO(),
+        )
+        reference_time = datetime(2020, 6, 1, 12, tzinfo=dt_timezone.utc)
+        dates = [
+            *User.objects.values_list("date_joined", flat=True),
+            *Product.objects.values_list("created_at", flat=True),
+            *Order.objects.values_list("created_at", flat=True),
+            *Article.objects.exclude(published_at=None).values_list("published_at", flat=True),
+        ]
+        self.assertLessEqual(max(dates), reference_time)
+        self.assertGreater(min(dates), reference_time - timedelta(days=3 * 365))
+        with self.assertRaises(CommandError):
+            call_command("seed_data", reference_time="yesterday", stdout=StringIO())
+
+
+def make_image(size=(1200, 900), image_format="JPEG") -> bytes:
+    buffer = BytesIO()
+    PILImage.new("RGB", size, "orange").save(buffer, image_format)
+    return buffer.getvalue()
+
+
+class ProductThumbnailsTestCase(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media.name,
+            THUMBNAIL_SIZES={"small": (100, 100), "large": (400, 400)},
+            THUMBNAIL_WORKERS=0,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def create_product(self) -> Product:
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(
+                name="Camera",
+                preview=SimpleUploadedFile("photo.jpg", make_image(), content_type="image/jpeg"),
+            )
+
+    def test_thumbnails_are_rendered_after_upload(self):
+        product = self.create_product()
+        name = product.preview.name
+        self.assertEqual(
+            thumbnail_name("products/product_1/preview/photo.jpeg", "small"),
+            "products/product_1/preview/thumbnails/photo_jpeg_small.jpg",
+        )
+        with default_storage.open(thumbnail_name(name, "small")) as file:
+            self.assertEqual(PILImage.open(file).size, (100, 75))
+        with default_storage.open(thumbnail_name(name, "large")) as file:
+            self.assertEqual(PILImage.open(file).size, (400, 300))
+
+        product.refresh_from_db()
+        response = self.client.get(reverse("shopapp:products_list"))
+        self.assertContains(response, default_storage.url(thumbnail_name(name, "small")))
+
+        data = self.client.get(reverse("shopapp:product-detail", kwargs={"pk": product.pk})).json()
+        self.assertEqual(
+            data["preview_thumbnails"],
+            {
+                size: f"http://testserver{default_storage.url(thumbnail_name(name, size))}"
+                for size in ("small", "large")
+            },
+        )
+
+    def test_originals_with_the_same_stem_have_their_own_thumbnails(self):
+        product = self.create_product()
+        names = []
+        for name, size, image_format in (
+            ("scan.jpeg", (1200, 900), "JPEG"),
+            ("scan.jpg", (900, 1200), "JPEG"),
+            ("scan.png", (1200, 600), "PNG"),
+            ("scan.PNG", (600, 1200), "PNG"),
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                image = ProductImage.objects.create(
+                    product=product,
+                    image=SimpleUploadedFile(name, make_image(size, image_format)),
+                )
+            names.append(image.image.name)
+        thumbnails = [thumbnail_name(name, "small") for name in names]
+        self.assertEqual(len(set(thumbnails)), 4)
+        sizes = []
+        for thumbnail in thumbnails:
+            with default_storage.open(thumbnail) as file:
+                sizes.append(PILImage.open(file).size)
+        self.assertEqual(sizes, [(100, 75), (75, 100), (100, 50), (50, 100)])
+
+    def test_original_is_served_until_rendered(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            product = Product.objects.create(
+                name="Camera",
+                preview=SimpleUploadedFile("photo.jpg", make_image(), content_type="image/jpeg"),
+            )
+        self.assertFalse(product.preview_thumbnails_rendered)
+        self.assertEqual(thumbnail_url(product.preview.name, "small", rendered=False), product.preview.url)
+        response = self.client.get(reverse("shopapp:product-detail", kwargs={"pk": product.pk}))
+        self.assertEqual(response.json()["preview_thumbnails"]["small"], f"http://testserver{product.preview.url}")
+
+    def test_reads_do_not_touch_the_storage(self):
+        product = self.create_product()
+        product.refresh_from_db()
+        self.assertTrue(product.preview_thumbnails_rendered)
+        with mock.patch.object(FileSystemStorage, "exists", side_effect=AssertionError("stat")):
+            response = self.client.get(reverse("shopapp:product-list"))
+            self.assertEqual(
+                response.json()["results"][0]["preview_thumbnails"]["small"],
+                f"http://testserver{default_storage.url(thumbnail_name(product.preview.name, 'small'))}",
+            )
+            self.client.get(reverse("shopapp:products_list"))
+
+    def test_backfill_command(self):
+        product = self.create_product()
+        for size in ("small", "large"):
+            default_storage.delete(thumbnail_name(product.preview.name, size))
+        image = ProductImage(product=product)
+        image.image.save("gallery.png", ContentFile(make_image(image_format="PNG")), save=False)
+        ProductImage.objects.bulk_create([image])
+
+        out = StringIO()
+        call_command("thumbnails", workers=1, stdout=out)
+        self.assertIn("Rendered thumbnails of 2 images, 0 failed", out.getvalue())
+        image.refresh_from_db()
+        self.assertTrue(image.image_thumbnails_rendered)
+        self.assertTrue(default_storage.exists(thumbnail_name(product.preview.name, "large")))
+        self.assertTrue(default_storage.exists(thumbnail_name(image.image.name, "small")))
+        self.assertTrue(thumbnail_name(image.image.name, "small").endswith("_small.png"))
+
+
+class ProductImagesUploadTestCase(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.media.name, THUMBNAIL_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.product = Product.objects.create(name="Camera", price=100)
+        self.photos = [make_image(size=(40 + i, 30)) for i in range(3)]
+
+    def upload(self, *photos: bytes):
+        response = self.client.post(
+            reverse("shopapp:product_update", kwargs={"pk": self.product.pk}),
+            {
+                "name": "Camera",
+                "price": "100",
+                "description": "",
+                "discount": 0,
+                "images": [
+                    SimpleUploadedFile(f"photo{i}.jpg", photo, content_type="image/jpeg")
+                    for i, photo in enumerate(photos)
+                ],
+            },
+        )
+        self.assertRedirects(response, reverse("shopapp:product_details", kwargs={"pk": self.product.pk}))
+
+    def stored_files(self) -> list[str]:
+        _, files = default_storage.listdir(f"products/product_{self.product.pk}/images")
+        return sorted(files)
+
+    def test_duplicates_are_stored_once(self):
+        self.upload(self.photos[0], self.photos[1], self.photos[0])
+        self.assertEqual(self.product.images.count(), 2)
+
+        self.upload(self.photos[1], self.photos[2])
+        self.assertEqual(
+            sorted(self.product.images.values_list("checksum", flat=True)),
+            sorted(hashlib.sha256(photo).hexdigest() for photo in self.photos),
+        )
+        self.assertEqual(len(self.stored_files()), 3)
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0)
+    def test_files_hashed_on_disk(self):
+        self.upload(self.photos[0], self.photos[0])
+        image = self.product.images.get()
+        self.assertEqual(image.checksum, hashlib.sha256(self.photos[0]).hexdigest())
+        with image.image.open() as file:
+            self.assertEqual(file.read(), self.photos[0])
+
+    def test_invalid_image_is_rejected(self):
+        response = self.client.post(
+            reverse("shopapp:product_update", kwargs={"pk": self.product.pk}),
+            {
+                "name": "Camera",
+                "price": "100",
+                "description": "",
+                "discount": 0,
+                "images": [
+                    SimpleUploadedFile("photo.jpg", self.photos[0], content_type="image/jpeg"),
+                    SimpleUploadedFile("notes.jpg", b"not an image", content_type="image/jpeg"),
+                ],
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.product.images.exists())
@@ -0,0 +1,170 @@
+"""
+Thumbnails of product previews and images.
+
+Every size in `settings.THUMBNAIL_SIZES` is rendered with Pillow into a
+`thumbnails/` directory next to the original, e.g.
+
+    products/product_1/preview/photo.jpg
+    products/product_1/preview/thumbnails/photo_jpg_small.jpg
+
+Names are derived from the original, extension included so that
+`photo.jpg` and `photo.png` don't share thumbnails, and URLs are known
+without a database lookup. Rendering is CPU bound and runs in a process pool once
+the upload is committed; until it's done the original is served. Models
+record rendered thumbnails in a `<field>_thumbnails_rendered` flag
+(`Product.preview_thumbnails_rendered`), so serving them needs no
+storage lookup.
+"""
+import logging
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+from threading import Lock
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models.fields.files import FieldFile
+from PIL import Image, ImageOps
+
+log = logging.getLogger(__name__)
+
+DEFAULT_THUMBNAIL_SIZES = {
+    "small": (200, 200),
+    "large": (800, 800),
+}
+THUMBNAIL_JPEG_QUALITY = 85
+
+_executor = None
+_executor_lock = Lock()
+
+
+def get_thumbnail_sizes() -> dict[str, tuple[int, int]]:
+    return getattr(settings, "THUMBNAIL_SIZES", DEFAULT_THUMBNAIL_SIZES)
+
+
+def thumbnail_name(name: str, size: str) -> str:
+    path = PurePosixPath(name)
+    # PNG keeps its transparency, everything else becomes JPEG
+    suffix = ".png" if path.suffix.lower() == ".png" else ".jpg"
+    stem = path.stem + path.suffix.replace(".", "_")
+    return str(path.parent / "thumbnails" / f"{stem}_{size}{suffix}")
+
+
+def thumbnail_url(name: str, size: str, rendered: bool, storage=default_storage) -> Optional[str]:
+    """
+    URL of the `size` thumbnail of `name`, or of the original
+    while the thumbnails aren't `rendered` yet
+    """
+    if not name:
+        return None
+    if rendered and size in get_thumbnail_sizes():
+        return storage.url(thumbnail_name(name, size))
+    return storage.url(name)
+
+
+def thumbnails_flag(field_name: str) -> str:
+    return f"{field_name}_thumbnails_rendered"
+
+
+def thumbnails_rendered(file: FieldFile) -> bool:
+    return getattr(file.instance, thumbnails_flag(file.field.name), False)
+
+
+def render_thumbnails(name: str, sizes: dict[str, tuple[int, int]] = None) -> list[str]:
+    """
+    Renders every thumbnail of `name`, replacing existing ones.
+    Runs in pool workers, so it only touches the storage.
+    """
+    sizes = sizes or get_thumbnail_sizes()
+    with default_storage.open(name) as file, Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+        names = []
+        for size, dimensions in sizes.items():
+            target = thumbnail_name(name, size)
+            thumbnail = image.copy()
+            thumbnail.thumbnail(dimensions, Image.Resampling.LANCZOS)
+            buffer = BytesIO()
+            if target.endswith(".png"):
+                thumbnail.save(buffer, "PNG", optimize=True)
+            else:
+                thumbnail.convert("RGB").save(buffer, "JPEG", quality=THUMBNAIL_JPEG_QUALITY, optimize=True)
+            if default_storage.exists(target):
+                default_storage.delete(target)
+            names.append(default_storage.save(target, ContentFile(buffer.getvalue())))
+    return names
+
+
+def has_thumbnails(name: str) -> bool:
+    return all(
+        default_storage.exists(thumbnail_name(name, size))
+        for size in get_thumbnail_sizes()
+    )
+
+
+def init_worker() -> None:
+    # workers started with spawn/forkserver don't inherit the configured Django
+    import django
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+    django.setup()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=getattr(settings, "THUMBNAIL_WORKERS", None),
+                initializer=init_worker,
+            )
+        return _executor
+
+
+def finish_thumbnails(name: str, future: Future, on_done: Callable[[str], None] = None) -> None:
+    try:
+        future.result()
+    except Exception:
+        log.exception("Could not render thumbnails of %s", name)
+        return
+    if on_done is not None:
+        on_done(name)
+
+
+def submit_thumbnails(name: str, on_done: Callable[[str], None] = None) -> Future:
+    """
+    Renders the thumbnails of `name` in the process pool, or right away
+    when THUMBNAIL_WORKERS is 0. `on_done` is called with `name` once
+    they are stored.
+    """
+    if getattr(settings, "THUMBNAIL_WORKERS", None) == 0:
+        future = Future()
+        try:
+            future.set_result(render_thumbnails(name))
+        except Exception as exc:
+            future.set_exception(exc)
+        finish_thumbnails(name, future, on_done)
+        return future
+
+    def done(future: Future) -> None:
+        try:
+            finish_thumbnails(name, future, on_done)
+        finally:
+            # done callbacks run in a pool thread with its own connection
+            connection.close()
+
+    future = get_executor().submit(render_thumbnails, name)
+    future.add_done_callback(done)
+    return future
+
+
+def schedule_thumbnails(name: str, on_done: Callable[[str], None] = None, using: str = None) -> None:
+    """
+    Renders the thumbnails once the current transaction commits:
+    a rolled back upload has nothing to render
+    """
+    if name:
+        transaction.on_commit(lambda: submit_thumbnails(name, on_done), using=using)
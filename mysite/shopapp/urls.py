@@ -13,12 +13,14 @@ from .views import (
     ProductDeleteView,
     ProductsDataExportView,
     ProductViewSet,
+    OrderViewSet,
 )
 
 app_name = "shopapp"
 
 routers = DefaultRouter()
 routers.register("products", ProductViewSet)
+routers.register("orders", OrderViewSet)
 
 urlpatterns = [
     # path("", cache_page(60 * 3)(ShopIndexView.as_view()), name="index"),
@@ -1,3 +1,12 @@
+from itertools import islice
+from typing import Iterable, Iterator
+
 
 def add_two_numbers(a, b):
     return a + b
+
+
+def iter_chunks(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
@@ -1,35 +1,71 @@
-from csv import DictWriter
+import gzip
+import hashlib
+import json
+import re
 from timeit import default_timer
 
-from django.http import HttpResponse, HttpRequest, HttpResponseRedirect, JsonResponse
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpRequest,
+    HttpResponseNotModified,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
 from django.shortcuts import render, reverse
+from django.template.response import TemplateResponse
 from django.urls import reverse_lazy
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
 from django.views.decorators.cache import cache_page
-from django.core.cache import cache
+from django.db.models import Prefetch
+from django.core.exceptions import ValidationError as DjangoValidationError
 
+from rest_framework import status
 from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import DjangoModelPermissions, IsAuthenticated
 from rest_framework.request import Request
 from rest_framework.response import Response
-from rest_framework.filters import SearchFilter, OrderingFilter
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.filters import OrderingFilter
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 
-from .common import save_csv_products
+from mysite.caching import aget_or_recompute
+
+from .common import check_csv_header, iter_csv_rows
 from .forms import ProductForm
-from .models import Product, Order, ProductImage
-from .serializers import ProductSerializer
+from .generations import aget_generations, cache_page_per_generation
+from .images import save_product_images
+from .models import Product, Order
+from .pagination import OrderPagination, ProductPagination
+from .search import ProductSearchFilter
+from .serializers import OrderProductsSerializer, OrderSerializer, ProductSerializer, ValuesSerializer
+from .tasks import enqueue_products_import
+
+CSV_EXPORT_CHUNK_SIZE = 2000
+PRODUCTS_CACHE_TIMEOUT = 60 * 60
+PRODUCTS_PAGE_SIZE = 20
+# fragments are keyed by pk and updated_at, an edit never serves a stale one
+PRODUCT_FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+accepts_gzip_re = re.compile(r"\bgzip\b")
 
 
 class ProductViewSet(ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = ProductPagination
     filter_backends = [
-        SearchFilter,
+        ProductSearchFilter,
         DjangoFilterBackend,
         OrderingFilter,
     ]
@@ -47,16 +83,33 @@ class ProductViewSet(ModelViewSet):
         "discount",
     ]
 
-    @method_decorator(cache_page(60 * 2))
-    def list(self, *args, **kwargs):
-        print("list")
-        return super().list(*args, **kwargs)
+    def get_values_serializer(self) -> ValuesSerializer:
+        return ValuesSerializer(
+            self.get_serializer_class(),
+            context=self.get_serializer_context(),
+        )
+
+    @method_decorator(cache_page_per_generation(PRODUCTS_CACHE_TIMEOUT, Product))
+    def list(self, request: Request, *args, **kwargs):
+        values_serializer = self.get_values_serializer()
+        queryset = self.filter_queryset(self.get_queryset()).values(*values_serializer.sources)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(values_serializer.serialize(page))
+        return Response(values_serializer.serialize(queryset))
+
+    def retrieve(self, request: Request, *args, **kwargs):
+        # ProductViewSet has no object level permissions to check,
+        # so the row can be fetched without building the instance
+        values_serializer = self.get_values_serializer()
+        queryset = self.filter_queryset(self.get_queryset()).values(*values_serializer.sources)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(queryset, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return Response(values_serializer.to_representation(row))
 
     @action(methods=["get"], detail=False)
     def download_csv(self, request: Request):
-        response = HttpResponse(content_type="text/csv")
-        filename = "products-export.csv"
-        response["Content-Disposition"] = f"attachment; filename={filename}"
         queryset = self.filter_queryset(self.get_queryset())
         fields = [
             "name",
@@ -64,30 +117,133 @@ class ProductViewSet(ModelViewSet):
             "price",
             "discount",
         ]
-        queryset = queryset.only(*fields)
-        writer = DictWriter(response, fieldnames=fields)
-        writer.writeheader()
-
-        for product in queryset:
-            writer.writerow({
-                field: getattr(product, field)
-                for field in fields
-            })
-
+        rows = queryset.values_list(*fields).iterator(chunk_size=CSV_EXPORT_CHUNK_SIZE)
+        response = StreamingHttpResponse(
+            iter_csv_rows(fields, rows),
+            content_type="text/csv",
+        )
+        filename = "products-export.csv"
+        response["Content-Disposition"] = f"attachment; filename={filename}"
         return response
 
     @action(
         detail=False,
         methods=["post"],
         parser_classes=[MultiPartParser],
+        # only the uploader (or staff) can follow the job
+        permission_classes=[IsAuthenticated],
     )
     def upload_csv(self, request: Request):
-        products = save_csv_products(
-            request.FILES["file"].file,
+        upload = request.FILES["file"]
+        key = request.data.get("key") or None
+        try:
+            check_csv_header(upload.file, encoding=request.encoding, key=key)
+        except DjangoValidationError as exc:
+            raise ValidationError({"file": exc.messages})
+        job = enqueue_products_import(
+            upload,
             encoding=request.encoding,
+            key=key,
+            dry_run=request.data.get("dry_run", "").lower() in ("1", "true", "yes"),
+            user=request.user,
         )
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        return Response(
+            {
+                "job": str(job.pk),
+                "status": job.status,
+                "status_url": request.build_absolute_uri(reverse("jobsapp:job-detail", kwargs={"pk": job.pk})),
+                "progress_url": request.build_absolute_uri(reverse("jobsapp:job-progress", kwargs={"pk": job.pk})),
+            },
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+
+class OrderChangePermissions(DjangoModelPermissions):
+    perms_map = {
+        **DjangoModelPermissions.perms_map,
+        "POST": ["%(app_label)s.change_%(model_name)s"],
+        "DELETE": ["%(app_label)s.change_%(model_name)s"],
+    }
+
+
+class OrderViewSet(ReadOnlyModelViewSet):
+    """
+    Orders with their user and products.
+
+    Every page costs the same number of queries: the user is joined,
+    products come from one prefetch, and only the serialized columns
+    are loaded.
+    """
+    queryset = (
+        Order.objects
+        .select_related("user")
+        .only(
+            "id",
+            "delivery_address",
+            "promocode",
+            "created_at",
+            "products_count",
+            "total",
+            "discounted_total",
+            "receipt",
+            "user__id",
+            "user__username",
+            "user__first_name",
+        )
+        .prefetch_related(
+            Prefetch("products", queryset=Product.objects.only("id", "name", "price", "discount")),
+        )
+        .order_by("-created_at", "-pk")
+    )
+    serializer_class = OrderSerializer
+    pagination_class = OrderPagination
+    permission_classes = [IsAuthenticated]
+    filter_backends = [
+        DjangoFilterBackend,
+        OrderingFilter,
+    ]
+    filterset_fields = {
+        "user": ["exact"],
+        "created_at": ["gte", "lte", "date", "date__gte", "date__lte"],
+    }
+    ordering_fields = [
+        "created_at",
+        "total",
+        "products_count",
+    ]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # as OrderDetailView: other users' orders need the view permission
+        if not self.request.user.has_perm("shopapp.view_order"):
+            queryset = queryset.filter(user=self.request.user)
+        return queryset
+
+    @action(
+        detail=True,
+        methods=["post", "delete"],
+        url_path="products",
+        permission_classes=[OrderChangePermissions],
+    )
+    def products(self, request: Request, pk: int) -> Response:
+        """
+        POST links and DELETE unlinks a list of products
+        (`{"products": [1, 2, 3]}`) in bulk
+        """
+        order = get_object_or_404(Order.objects.only("id"), pk=pk)
+        serializer = OrderProductsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if request.method == "POST":
+            order.add_products(serializer.validated_data["products"])
+        else:
+            order.remove_products(serializer.validated_data["products"])
+        order.refresh_from_db(fields=["products_count", "total", "discounted_total"])
+        return Response({
+            "pk": order.pk,
+            "products_count": order.products_count,
+            "total": str(order.total),
+            "discounted_total": str(order.discounted_total),
+        })
 
 
 class ShopIndexView(View):
@@ -107,16 +263,37 @@ class ShopIndexView(View):
         return render(request, 'shopapp/shop-index.html', context=context)
 
 
-class ProductDetailsView(DetailView):
+class ProductDetailsView(View):
+    """
+    Async equivalent of DetailView: under ASGI the request stays
+    on the event loop, only the query runs in the ORM's thread
+    """
     template_name = "shopapp/products-details.html"
     queryset = Product.objects.prefetch_related("images")
-    context_object_name = "product"
+
+    async def get(self, request: HttpRequest, pk: int) -> HttpResponse:
+        try:
+            product = await self.queryset.aget(pk=pk)
+        except Product.DoesNotExist:
+            raise Http404("No product found matching the query")
+        return TemplateResponse(request, self.template_name, {"object": product, "product": product})
 
 
 class ProductsListView(ListView):
     template_name = "shopapp/products-list.html"
     context_object_name = "products"
-    queryset = Product.objects.filter(archived=False)
+    paginate_by = PRODUCTS_PAGE_SIZE
+    queryset = (
+        Product.objects
+        .filter(archived=False)
+        .defer("description")
+        .order_by("name", "price", "pk")
+    )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["fragment_cache_timeout"] = PRODUCT_FRAGMENT_CACHE_TIMEOUT
+        return context
 
 
 class ProductCreateView(CreateView):
@@ -139,12 +316,7 @@ class ProductUpdateView(UpdateView):
 
     def form_valid(self, form):
         response = super().form_valid(form)
-        for image in form.files.getlist("images"):
-            ProductImage.objects.create(
-                product=self.object,
-                image=image,
-            )
-
+        save_product_images(self.object, form.cleaned_data["images"])
         return response
 
 
@@ -178,23 +350,51 @@ class OrderDetailView(PermissionRequiredMixin, DetailView):
 
 
 class ProductsDataExportView(View):
-    def get(self, request: HttpRequest) -> JsonResponse:
-        cache_key = "products_data_export"
-        # Check if the data already exists in the cache
-        products_data = cache.get(cache_key)
-
-        # If the data is not already cached, generate it and cache it
-        if products_data is None:
-            products = Product.objects.order_by('pk').all()
-            products_data = [
-                {
-                    "pk": product.pk,
-                    "name": product.name,
-                    "price": product.price,
-                    "archived": product.archived,
-                }
-                for product in products
-            ]
-            cache.set(cache_key, products_data, 300)
-
-        return JsonResponse({"products": products_data})
+    """
+    JSON export of all products.
+
+    The encoded body, its gzip-compressed variant and their hash are cached
+    together, so a hit costs no encoding at all, and clients sending back
+    the ETag in If-None-Match get an empty 304 while nothing has changed.
+    """
+
+    async def get(self, request: HttpRequest) -> HttpResponse:
+        # one worker at a time rebuilds it, the others serve the previous one meanwhile
+        export = await aget_or_recompute(
+            "products_data_export",
+            self.build_export,
+            PRODUCTS_CACHE_TIMEOUT,
+            version=await aget_generations(Product),
+        )
+
+        use_gzip = accepts_gzip_re.search(request.headers.get("Accept-Encoding", "")) is not None
+        etag = f'"{export["hash"]}-gzip"' if use_gzip else f'"{export["hash"]}"'
+        if_none_match = parse_etags(request.headers.get("If-None-Match", ""))
+        if "*" in if_none_match or etag in [tag.removeprefix("W/") for tag in if_none_match]:
+            response = HttpResponseNotModified()
+        elif use_gzip:
+            response = HttpResponse(export["gzip"], content_type="application/json")
+            response["Content-Encoding"] = "gzip"
+        else:
+            response = HttpResponse(export["body"], content_type="application/json")
+        response["ETag"] = etag
+        patch_vary_headers(response, ["Accept-Encoding"])
+        return response
+
+    async def build_export(self) -> dict:
+        products_data = [
+            product async for product in
+            Product.objects
+            .order_by("pk")
+            .values("pk", "name", "price", "archived")
+        ]
+        # encoding and compressing the whole catalog would block the event loop
+        return await sync_to_async(self.encode_export, thread_sensitive=False)(products_data)
+
+    def encode_export(self, products_data: list) -> dict:
+        body = json.dumps({"products": products_data}, cls=DjangoJSONEncoder).encode()
+        return {
+            "body": body,
+            "gzip": gzip.compress(body),
+            "hash": hashlib.blake2b(body, digest_size=16).hexdigest(),
+        }